@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+vaslam benchmarks
+=================
+
+Measure latency distribution, memory allocations and threads spawned by the
+hot paths of vaslam, offline, against local stand-ins of the network.
+Results are saved as JSON to compare across commits.
+
+usage: python benchmarks/bench.py [-o results.json] [-c baseline.json]
+"""
+import sys
+import json
+import threading
+import tracemalloc
+from os import path
+from time import perf_counter, sleep
+from argparse import ArgumentParser
+from platform import python_version
+from subprocess import run
+from statistics import mean, median
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+from unittest.mock import patch
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from vaslam.conf import Conf, default_conf
+from vaslam.diag import diagnose_network
+from vaslam.net import _parse_ping_output
+
+
+PING_OUTPUT = """
+PING 127.0.0.1 (127.0.0.1) 56(84) bytes of data.
+
+--- 127.0.0.1 ping statistics ---
+5 packets transmitted, 5 received, 0% packet loss, time 4005ms
+rtt min/avg/max/mdev = 0.041/0.057/0.078/0.012 ms
+"""
+
+
+class _EchoIpHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.client_address[0].encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _stand_in_ping_cmd(delay: float) -> Callable[..., str]:
+    def _ping_cmd(host, timeout=15, packets=5):
+        sleep(delay)
+        return PING_OUTPUT
+
+    return _ping_cmd
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+class _ThreadCounter:
+    def __init__(self):
+        self.started = 0
+        self._orig_start = threading.Thread.start
+
+    def __enter__(self):
+        counter = self
+
+        def _start(thread):
+            counter.started += 1
+            return counter._orig_start(thread)
+
+        threading.Thread.start = _start
+        return self
+
+    def __exit__(self, *exc):
+        threading.Thread.start = self._orig_start
+        return False
+
+
+def bench(func: Callable[[], object], runs: int, warmup: int = 1) -> Dict:
+    """Run func and return latency distribution in milliseconds,
+    allocations of a single run, and threads spawned per run.
+    """
+    for _ in range(warmup):
+        func()
+    durations = []
+    with _ThreadCounter() as threads:
+        for _ in range(runs):
+            start = perf_counter()
+            func()
+            durations.append((perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    func()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    return {
+        "runs": runs,
+        "min_ms": min(durations),
+        "mean_ms": mean(durations),
+        "median_ms": median(durations),
+        "p90_ms": _percentile(durations, 90),
+        "p99_ms": _percentile(durations, 99),
+        "max_ms": max(durations),
+        "alloc_peak_bytes": peak,
+        "alloc_blocks": sum(max(0, s.count_diff) for s in stats),
+        "threads_per_run": threads.started / float(runs),
+    }
+
+
+def bench_parse_ping_output(runs: int) -> Dict:
+    return bench(lambda: _parse_ping_output(PING_OUTPUT), runs)
+
+
+def bench_default_conf(runs: int) -> Dict:
+    return bench(default_conf, runs)
+
+
+def bench_diagnose_network(runs: int, ping_delay: float = 0.005) -> Dict:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _EchoIpHandler)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    conf = Conf()
+    conf.hostnames = ["localhost"]
+    conf.ipv4_gateway = "127.0.0.1"
+    conf.ipv4_ping_hosts = ["127.0.0.1"]
+    conf.ipv4_echo_urls = ["http://127.0.0.1:{}/".format(server.server_address[1])]
+    try:
+        with patch("vaslam.net.path.exists", return_value=True), patch(
+            "vaslam.net._ping_cmd", _stand_in_ping_cmd(ping_delay)
+        ):
+            return bench(lambda: diagnose_network(conf), runs)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_cli_startup(runs: int) -> Dict:
+    cmd = [sys.executable, "-m", "vaslam.app", "--version"]
+    cwd = path.dirname(path.dirname(path.abspath(__file__)))
+    return bench(lambda: run(cmd, cwd=cwd, capture_output=True, check=True), runs)
+
+
+benchmarks = {
+    "parse_ping_output": (bench_parse_ping_output, 2000),
+    "default_conf": (bench_default_conf, 200),
+    "diagnose_network": (bench_diagnose_network, 50),
+    "cli_startup": (bench_cli_startup, 10),
+}  # type: Dict[str, tuple]
+
+
+def _git_commit() -> str:
+    proc = run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+    return proc.stdout.strip() if proc.returncode == 0 else ""
+
+
+def _compare(results: Dict, baseline_path: str) -> None:
+    with open(baseline_path) as fh:
+        baseline = json.load(fh)["results"]
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]["median_ms"]
+        ratio = res["median_ms"] / old if old else 0
+        print(
+            "{:<20} median {:10.3f} ms  baseline {:10.3f} ms  x{:.2f}".format(
+                name, res["median_ms"], old, ratio
+            )
+        )
+
+
+def main(args=None) -> int:
+    parser = ArgumentParser(description="benchmark vaslam hot paths")
+    parser.add_argument("-o", "--output", help="save results as JSON to file")
+    parser.add_argument("-c", "--compare", help="compare with results from file")
+    parser.add_argument(
+        "-s", "--scale", type=float, default=1.0, help="multiply number of runs"
+    )
+    parser.add_argument("names", nargs="*", help="benchmarks to run")
+    opts = parser.parse_args(args)
+    for name in opts.names:
+        if name not in benchmarks:
+            parser.error("unknown benchmark {}".format(name))
+    results = {}
+    for name in opts.names or list(benchmarks):
+        func, runs = benchmarks[name]
+        res = func(max(1, int(runs * opts.scale)))
+        results[name] = res
+        print(
+            "{:<20} median {:10.3f} ms  p99 {:10.3f} ms  peak {:8d} B  "
+            "threads {:.1f}".format(
+                name,
+                res["median_ms"],
+                res["p99_ms"],
+                res["alloc_peak_bytes"],
+                res["threads_per_run"],
+            )
+        )
+    if opts.output:
+        with open(opts.output, "wt") as fh:
+            json.dump(
+                {
+                    "commit": _git_commit(),
+                    "python": python_version(),
+                    "results": results,
+                },
+                fh,
+                indent=2,
+            )
+    if opts.compare:
+        _compare(results, opts.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+from os import path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from vaslam.baseline import Baseline, BaselineStore, LATENCY, PACKET_LOSS
+
+
+class TestBaseline(TestCase):
+    def test_baseline_first_sample_sets_the_mean(self):
+        baseline = Baseline()
+        baseline.update(12.5)
+        self.assertEqual(12.5, baseline.mean)
+        self.assertEqual(0, baseline.var)
+        self.assertEqual(1, baseline.samples)
+
+    def test_baseline_mean_follows_the_values(self):
+        baseline = Baseline(0.5)
+        for val in (10, 20, 20, 20, 20, 20):
+            baseline.update(val)
+        self.assertGreater(baseline.mean, 19)
+        self.assertGreater(baseline.var, 0)
+
+    def test_baseline_is_not_anomalous_while_learning(self):
+        baseline = Baseline()
+        baseline.update(1)
+        self.assertFalse(baseline.is_anomalous(100, min_samples=5))
+
+    def test_baseline_detects_values_far_above_the_normal(self):
+        baseline = Baseline()
+        for val in (1.0, 1.1, 0.9, 1.0, 1.2, 1.0, 0.9):
+            baseline.update(val)
+        self.assertTrue(baseline.is_anomalous(40, min_delta=5, min_ratio=2))
+        self.assertFalse(baseline.is_anomalous(1.3, min_delta=5, min_ratio=2))
+        self.assertFalse(baseline.is_anomalous(0.1, min_delta=5, min_ratio=2))
+
+
+class TestBaselineStore(TestCase):
+    def _learn(self, store, target, rtt, loss, count=10):
+        for _ in range(count):
+            store.update(target, rtt, loss)
+
+    def test_baseline_store_compares_against_each_target_baseline(self):
+        store = BaselineStore()
+        self._learn(store, "192.168.0.1", 1.0, 0)
+        self._learn(store, "1.1.1.1", 600.0, 0)
+        self.assertTrue(store.latency_anomalous("192.168.0.1", 40))
+        self.assertFalse(store.latency_anomalous("1.1.1.1", 610))
+        self.assertFalse(store.latency_anomalous("8.8.8.8", 900))
+
+    def test_baseline_store_detects_packet_loss_anomalies(self):
+        store = BaselineStore()
+        self._learn(store, "192.168.0.1", 1.0, 0)
+        self.assertTrue(store.packet_loss_anomalous("192.168.0.1", 10))
+        self.assertFalse(store.packet_loss_anomalous("192.168.0.1", 0))
+
+    def test_baseline_store_saves_and_loads_baselines(self):
+        with TemporaryDirectory() as tmp_dir:
+            file_path = path.join(tmp_dir, "baselines.json")
+            store = BaselineStore(file_path)
+            self._learn(store, "192.168.0.1", 1.5, 2)
+            store.save()
+
+            loaded = BaselineStore(file_path)
+            loaded.load()
+            baseline = loaded.get("192.168.0.1", LATENCY)
+            self.assertAlmostEqual(1.5, baseline.mean)
+            self.assertEqual(10, baseline.samples)
+            self.assertAlmostEqual(2, loaded.get("192.168.0.1", PACKET_LOSS).mean)
+
+    def test_baseline_store_ignores_invalid_files(self):
+        with TemporaryDirectory() as tmp_dir:
+            file_path = path.join(tmp_dir, "baselines.json")
+            with open(file_path, "wt") as fh:
+                fh.write("not json")
+            store = BaselineStore(file_path)
+            store.load()
+            self.assertEqual({}, store.baselines)
@@ -1,6 +1,11 @@
 from unittest import TestCase
 from unittest.mock import patch, call
-from vaslam.check import check_dns, check_ping_ipv4, get_visible_ipv4
+from vaslam.check import (
+    check_dns,
+    check_ping_ipv4,
+    check_ping_ipv6,
+    get_visible_ipv4,
+)
 from vaslam.net import ConnectionError, PingStats, HttpConError
 
 
@@ -89,6 +94,14 @@ class TestCheckPingIpv4(TestCase):
         )
         self.assertGreaterEqual(self.mock_logger.warning.call_count, 1)
 
+    def test_check_ping_ipv6_traces_and_logs_ipv6_attempts(self):
+        self.mock_ping.side_effect = ConnectionError("mocked err in tests")
+        with patch("vaslam.check.span") as mock_span:
+            host, _ = check_ping_ipv6(["2001:db8::1"])
+        self.assertEqual("", host)
+        mock_span.assert_called_once_with("check_ping_ipv6.attempt", "2001:db8::1")
+        self.assertIn("ipv6", self.mock_logger.warning.call_args[0][0])
+
 
 class TestGetVisibleIpv4(TestCase):
     def setUp(self):
@@ -0,0 +1,162 @@
+from os import path
+from time import time, sleep
+from threading import Thread, Event
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from vaslam.diag import (
+    Result,
+    INTERNET_LATENCY,
+    INTERNET_UNREACHABLE,
+    DNS_FAIL,
+)
+from vaslam.collector import (
+    Collector,
+    CollectorServer,
+    RecordSender,
+    agent_record,
+    GATEWAY,
+    TARGET,
+)
+
+
+def _record(agent, gateway, issues, target="1.1.1.1", rtt=20.0, ipv4=""):
+    result = Result.new_all_ok()
+    result.gateway, result.internet_host = gateway, target
+    result.ipv4 = ipv4
+    for stats in (result.gateway_ping_stats, result.internet_ping_stats):
+        stats.packets_sent = stats.packets_recv = 5
+    result.internet_ping_stats.rtt_avg = rtt
+    record = agent_record(agent, result)
+    record["i"] = issues
+    return record
+
+
+class TestCollector(TestCase):
+    def setUp(self):
+        self.collector = Collector(window=30)
+
+    def _faults(self, now=100):
+        return [
+            (f.kind, f.key, f.issue, f.affected, f.agents)
+            for f in self.collector.attribute(now)
+        ]
+
+    def test_issues_of_most_agents_behind_a_gateway_are_attributed_to_it(self):
+        for idx in range(4):
+            issues = [INTERNET_LATENCY] if idx else [DNS_FAIL]
+            self.collector.ingest(_record("a{}".format(idx), "10.0.0.1", issues), 90)
+        for idx in range(4):
+            self.collector.ingest(_record("b{}".format(idx), "10.0.1.1", []), 90)
+        self.assertEqual(
+            [(GATEWAY, "10.0.0.1", INTERNET_LATENCY, 3, 4)], self._faults()
+        )
+
+    def test_issues_of_agents_behind_many_gateways_are_attributed_upstream(self):
+        for idx in range(6):
+            gateway = "10.0.{}.1".format(idx % 3)
+            record = _record("a{}".format(idx), gateway, [INTERNET_UNREACHABLE])
+            self.collector.ingest(record, 90)
+        self.assertEqual(
+            [(TARGET, "1.1.1.1", INTERNET_UNREACHABLE, 6, 6)], self._faults()
+        )
+
+    def test_sites_sharing_a_private_gateway_address_are_told_apart(self):
+        for site, ipv4 in (("a", "203.0.113.7"), ("b", "198.51.100.9")):
+            for idx in range(4):
+                issues = [INTERNET_LATENCY] if site == "a" else []
+                record = _record(site + str(idx), "192.168.1.1", issues, ipv4=ipv4)
+                self.collector.ingest(record, 90)
+        self.assertEqual(
+            [(GATEWAY, "192.168.1.1@203.0.113.7", INTERNET_LATENCY, 4, 4)],
+            self._faults(),
+        )
+        record = agent_record("c0", Result.new_all_ok(), [], "office")
+        record["g"] = "192.168.1.1"
+        self.collector.ingest(record, 90)
+        # explicit sites are used instead of the visible IPv4
+        self.assertEqual("192.168.1.1@office", self.collector._agents["c0"].gateway)
+
+    def test_issues_of_a_few_agents_are_local_faults(self):
+        for idx in range(5):
+            issues = [INTERNET_LATENCY] if idx < 2 else []
+            self.collector.ingest(_record("a{}".format(idx), "10.0.0.1", issues), 90)
+        self.assertEqual([], self._faults())
+
+    def test_agents_not_reported_in_the_window_are_expired(self):
+        for idx in range(3):
+            self.collector.ingest(
+                _record("a{}".format(idx), "10.0.0.1", [DNS_FAIL]), 50
+            )
+        self.collector.ingest(_record("a0", "10.0.0.1", [DNS_FAIL]), 90)
+        self.assertEqual([], self._faults())
+        self.assertEqual(1, self.collector.agents)
+
+    def test_memory_is_bounded_by_max_agents(self):
+        collector = Collector(max_agents=100, max_segments=10)
+        for idx in range(1000):
+            collector.ingest(_record(str(idx), "10.0.{}.1".format(idx), []))
+        self.assertEqual(100, collector.agents)
+        self.assertEqual(10, len(collector._segments))
+
+    def test_latency_sketches_are_merged_per_segment(self):
+        for idx in range(10):
+            record = _record(str(idx), "10.0.0.1", [], rtt=10.0 * (idx + 1))
+            self.collector.ingest(record, 90)
+        self.assertAlmostEqual(50, self.collector.latency(TARGET, "1.1.1.1"), delta=1)
+        self.assertEqual(0.0, self.collector.latency(TARGET, "8.8.8.8"))
+
+    def test_invalid_records_are_counted(self):
+        self.assertFalse(self.collector.ingest({"g": "10.0.0.1"}))
+        self.assertFalse(
+            self.collector.ingest({"a": "x", "g": "10.0.0.1", "gs": [1, 2]})
+        )
+        self.assertEqual(2, self.collector.invalid)
+
+
+class TestCollectorServer(TestCase):
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.unix_path = path.join(tmp_dir.name, "collector.sock")
+        self.collector = Collector()
+        self.server = CollectorServer(self.collector, ["127.0.0.1:0", self.unix_path])
+        self.stop = Event()
+        th = Thread(target=self.server.serve, args=(self.stop, 0.05))
+        th.start()
+        self.addCleanup(self.server.close)
+        self.addCleanup(th.join)
+        self.addCleanup(self.stop.set)
+
+    def _wait_for(self, records):
+        deadline = time() + 10
+        while self.collector.records < records and time() < deadline:
+            sleep(0.01)
+
+    def test_records_of_local_agents_are_collected_over_tcp_and_unix(self):
+        tcp_address = "127.0.0.1:{}".format(self.server.addresses[0][1])
+        senders = [RecordSender(tcp_address), RecordSender(self.unix_path)]
+        for sender in senders:
+            self.addCleanup(sender.close)
+        for idx in range(4):
+            sender = senders[idx % 2]
+            sender.send(_record(str(idx), "10.0.0.1", [INTERNET_LATENCY]))
+        self._wait_for(4)
+        self.assertEqual(4, self.collector.agents)
+        self.assertEqual(
+            [(GATEWAY, "10.0.0.1", INTERNET_LATENCY)],
+            [(f.kind, f.key, f.issue) for f in self.collector.attribute()],
+        )
+
+    def test_thousands_of_agents_are_collected_on_a_single_thread(self):
+        senders = [RecordSender(self.unix_path) for _ in range(50)]
+        for sender in senders:
+            self.addCleanup(sender.close)
+        records = [
+            _record(str(idx), "10.0.{}.1".format(idx % 200), []) for idx in range(5000)
+        ]
+        start = time()
+        for idx, record in enumerate(records):
+            senders[idx % len(senders)].send(record)
+        self._wait_for(5000)
+        self.assertEqual(5000, self.collector.agents)
+        self.assertLess(time() - start, 5)
@@ -5,6 +5,7 @@ from vaslam.conf import (
     default_ipv4_name_servers,
     default_ipv4_ping_hosts,
     default_ipv4_echo_urls,
+    default_ipv6_ping_hosts,
 )
 from unittest import TestCase
 from unittest.mock import patch
@@ -22,6 +23,11 @@ class TestDefaultConf(TestCase):
         self.mock_get_gw = patcher.start()
         self.mock_get_gw.return_value = "192.168.0.1"
 
+        patcher = patch("vaslam.conf.get_gateway_ipv6")
+        self.addCleanup(patcher.stop)
+        self.mock_get_gw6 = patcher.start()
+        self.mock_get_gw6.return_value = ""
+
     def test_default_conf_returns_a_conf_with_defaults(self):
         ret = default_conf()
         self.assertIsInstance(ret, Conf)
@@ -29,6 +35,7 @@ class TestDefaultConf(TestCase):
         self.assertEqual(ret.ipv4_default_name_servers, default_ipv4_name_servers)
         self.assertEqual(ret.ipv4_ping_hosts, default_ipv4_ping_hosts)
         self.assertEqual(ret.ipv4_echo_urls, default_ipv4_echo_urls)
+        self.assertEqual(ret.https_echo_urls, [])
 
     def test_default_conf_returns_system_name_servers_and_default_gateway(self):
         ret = default_conf()
@@ -36,3 +43,11 @@ class TestDefaultConf(TestCase):
         self.mock_get_ns.assert_called_once_with()
         self.assertEqual(ret.ipv4_gateway, "192.168.0.1")
         self.mock_get_gw.assert_called_once_with()
+
+    def test_default_conf_enables_ipv6_checks_with_ipv6_default_gateway(self):
+        self.assertFalse(default_conf().ipv6)
+        self.mock_get_gw6.return_value = "fe80::1%eth0"
+        ret = default_conf()
+        self.assertTrue(ret.ipv6)
+        self.assertEqual(ret.ipv6_gateway, "fe80::1%eth0")
+        self.assertEqual(ret.ipv6_ping_hosts, default_ipv6_ping_hosts)
@@ -0,0 +1,169 @@
+import json
+from unittest import TestCase
+from vaslam.baseline import BaselineStore
+from vaslam.diag import (
+    Result,
+    LOCALNET_LATENCY,
+    INTERNET_PACKET_LOSS,
+    INTERNET_ISP_LATENCY,
+    INTERNET_UPSTREAM_PACKET_LOSS,
+    INTERNET_MTU_BLACKHOLE,
+    BANDWIDTH_LOW,
+    BANDWIDTH_CAPACITY_LOW,
+    BANDWIDTH_BUFFERBLOAT,
+    LOCALNET_INTERFACE_ERRORS,
+    LOCALNET_RETRANSMITS,
+    IPV6_LATENCY,
+    IPV6_DNS_FAIL,
+    DNS_TRANSPORT_FAIL,
+    DNS_TRANSPORT_SLOW,
+    HTTPS_FAIL,
+    HTTPS_CERT_UNTRUSTED,
+    HTTPS_HANDSHAKE_SLOW,
+)
+from vaslam.dnstransport import TransportStats
+from vaslam.tls import HttpsStats
+from vaslam.pmtu import MtuStats
+from vaslam.traceroute import Hop
+
+
+class TestResultGetIssues(TestCase):
+    def setUp(self):
+        self.result = Result.new_all_ok()
+        self.result.gateway = "192.168.0.1"
+        self.result.internet_host = "1.1.1.1"
+        for stats in (self.result.gateway_ping_stats, self.result.internet_ping_stats):
+            stats.packets_sent = stats.packets_recv = 5
+        self.result.gateway_ping_stats.rtt_avg = 1.0
+        self.result.internet_ping_stats.rtt_avg = 20.0
+
+    def test_get_issues_returns_empty_list_when_all_ok(self):
+        self.assertEqual([], self.result.get_issues())
+
+    def test_get_issues_reports_issues_relative_to_baselines(self):
+        baselines = BaselineStore()
+        for _ in range(10):
+            self.result.update_baselines(baselines)
+        self.assertEqual([], self.result.get_issues(baselines))
+
+        self.result.gateway_ping_stats.rtt_avg = 40.0
+        self.result.internet_ping_stats.packet_loss_pct = 4
+        self.assertEqual([], self.result.get_issues())
+        self.assertEqual(
+            [LOCALNET_LATENCY, INTERNET_PACKET_LOSS], self.result.get_issues(baselines)
+        )
+
+    def test_update_baselines_skips_anomalous_targets(self):
+        baselines = BaselineStore()
+        for _ in range(10):
+            self.result.update_baselines(baselines)
+        self.result.gateway_ping_stats.rtt_avg = 40.0
+        self.result.update_baselines(baselines)
+        self.assertEqual(10, baselines.get("192.168.0.1", "latency").samples)
+        self.assertEqual(1.0, baselines.get("192.168.0.1", "latency").mean)
+        self.assertEqual(11, baselines.get("1.1.1.1", "latency").samples)
+
+    def test_get_issues_skips_the_local_network_of_on_link_routes(self):
+        self.result.localnet = False
+        self.result.gateway_ping_stats.packets_sent = 0
+        self.result.on_link = True
+        self.assertEqual([], self.result.get_issues())
+
+    def test_get_issues_reports_path_segment_issues(self):
+        for ttl, address, rtt, recv in (
+            (1, "192.168.0.1", 1.0, 10),
+            (2, "100.64.0.1", 160.0, 10),
+            (3, "198.51.100.1", 170.0, 8),
+        ):
+            hop = Hop(ttl)
+            hop.address, hop.sent, hop.rtts = address, 10, [rtt] * recv
+            self.result.path_hops.append(hop)
+        self.assertEqual(
+            [INTERNET_ISP_LATENCY, INTERNET_UPSTREAM_PACKET_LOSS],
+            self.result.get_issues(),
+        )
+
+    def test_get_issues_reports_low_bandwidth_when_measured(self):
+        self.result.upload_stats.goodput = 0.5e6
+        self.assertEqual([], self.result.get_issues())
+        for stats in (self.result.download_stats, self.result.upload_stats):
+            stats.bytes = 1000000
+        self.result.download_stats.goodput = 4e6
+        self.result.upload_stats.goodput = 2.5e6
+        self.assertEqual([BANDWIDTH_LOW], self.result.get_issues())
+
+    def test_get_issues_reports_low_capacity_and_bufferbloat(self):
+        self.result.capacity_stats.capacity = 50e6
+        self.result.capacity_stats.queueing_delay = 20
+        self.assertEqual([], self.result.get_issues())
+        self.result.capacity_stats.capacity = 2e6
+        self.result.capacity_stats.queueing_delay = 250
+        self.assertEqual(
+            [BANDWIDTH_CAPACITY_LOW, BANDWIDTH_BUFFERBLOAT], self.result.get_issues()
+        )
+
+    def test_get_issues_reports_interface_errors_and_retransmits(self):
+        self.result.counters.tcp_out_segs = 50
+        self.result.counters.tcp_retrans_segs = 10
+        self.assertEqual([], self.result.get_issues())
+        self.result.counters.rx_errors = 2
+        self.result.counters.tcp_out_segs = 1000
+        self.result.counters.tcp_retrans_segs = 80
+        self.assertEqual(
+            [LOCALNET_INTERFACE_ERRORS, LOCALNET_RETRANSMITS], self.result.get_issues()
+        )
+
+    def test_get_issues_reports_ipv6_issues_per_family(self):
+        v6 = Result.new_all_ok()
+        v6.internet_ping_stats.packets_sent = v6.internet_ping_stats.packets_recv = 5
+        v6.internet_ping_stats.rtt_avg = 400.0
+        v6.dns = False
+        self.result.ipv6_result = v6
+        self.assertEqual([IPV6_LATENCY, IPV6_DNS_FAIL], self.result.get_issues())
+
+    def test_get_issues_reports_failed_and_slow_dns_transports(self):
+        self.result.dns_time = 20.0
+        tcp, tls = TransportStats("tcp"), TransportStats("tls")
+        tcp.ok, tcp.query_time = True, 40.0
+        tls.ok, tls.query_time, tls.handshake_time = True, 60.0, 900.0
+        self.result.dns_transports = [tcp, tls]
+        self.assertEqual([], self.result.get_issues())
+        tls.query_time = 90.0
+        self.assertEqual([DNS_TRANSPORT_SLOW], self.result.get_issues())
+        tls.ok = False
+        self.assertEqual([DNS_TRANSPORT_FAIL], self.result.get_issues())
+
+    def test_get_issues_reports_https_issues(self):
+        https = self.result.https_stats = HttpsStats("https://192.0.2.80/ip")
+        https.ok, https.handshake_time = True, 40.0
+        self.assertEqual([], self.result.get_issues())
+        https.handshake_time = 800.0
+        self.assertEqual([HTTPS_HANDSHAKE_SLOW], self.result.get_issues())
+        https.ok, https.error = False, "connection reset"
+        self.assertEqual([HTTPS_FAIL], self.result.get_issues())
+        https.cert_error = True
+        self.assertEqual([HTTPS_CERT_UNTRUSTED], self.result.get_issues())
+
+
+class TestResultDict(TestCase):
+    def test_result_from_dict_restores_the_result(self):
+        result = Result.new_all_ok()
+        result.internet_ping_stats.rtt_avg = 20.0
+        hop = Hop(1)
+        hop.address, hop.sent, hop.rtts = "192.168.0.1", 3, [1.0, 2.0]
+        result.path_hops.append(hop)
+        transport = TransportStats("tls", "tls://192.0.2.53:853")
+        transport.ok, transport.handshake_time = True, 30.0
+        result.dns_transports.append(transport)
+        mtu = MtuStats("192.0.2.9")
+        mtu.ok, mtu.mtu, mtu.blackhole = True, 1400, True
+        result.mtu_stats.append(mtu)
+        result.ipv6_result = Result()
+        result.ipv6_result.ipv6 = "2001:db8::7"
+        restored = Result.from_dict(json.loads(json.dumps(result.to_dict())))
+        self.assertEqual(20.0, restored.internet_ping_stats.rtt_avg)
+        self.assertEqual(1.5, restored.path_hops[0].rtt_avg)
+        self.assertEqual(30.0, restored.dns_transports[0].handshake_time)
+        self.assertIn(INTERNET_MTU_BLACKHOLE, restored.get_issues())
+        self.assertEqual("2001:db8::7", restored.ipv6_result.ipv6)
+        self.assertEqual(result.to_dict(), restored.to_dict())
@@ -0,0 +1,93 @@
+from unittest import TestCase
+from unittest.mock import patch
+from vaslam.dns import (
+    DnsCache,
+    DnsRecord,
+    decode,
+    encode_query,
+    encode_response,
+    TYPE_A,
+    TYPE_AAAA,
+    TYPE_CNAME,
+    RCODE_NXDOMAIN,
+)
+
+
+class TestDnsMessages(TestCase):
+    def test_encode_query_can_be_decoded(self):
+        msg = decode(encode_query("www.debian.org", TYPE_AAAA, 4321))
+        self.assertEqual(4321, msg.id)
+        self.assertFalse(msg.is_response)
+        self.assertEqual([("www.debian.org", TYPE_AAAA)], msg.questions)
+
+    def test_encode_response_answers_the_query(self):
+        query = decode(encode_query("www.debian.org", TYPE_A, 7))
+        answers = [
+            DnsRecord("www.debian.org", TYPE_CNAME, 60, "debian.org"),
+            DnsRecord("debian.org", TYPE_A, 300, "192.0.2.10"),
+            DnsRecord("debian.org", TYPE_AAAA, 120, "2001:db8::10"),
+        ]
+        msg = decode(encode_response(query, answers))
+        self.assertEqual(7, msg.id)
+        self.assertTrue(msg.is_response)
+        self.assertEqual(0, msg.rcode)
+        self.assertEqual(["192.0.2.10"], msg.addresses(TYPE_A))
+        self.assertEqual(["2001:db8::10"], msg.addresses(TYPE_AAAA))
+        self.assertEqual(["debian.org"], msg.addresses(TYPE_CNAME))
+        self.assertEqual(60, msg.min_ttl())
+
+    def test_encode_response_with_error_code(self):
+        query = decode(encode_query("invalid.local"))
+        msg = decode(encode_response(query, [], RCODE_NXDOMAIN))
+        self.assertEqual(RCODE_NXDOMAIN, msg.rcode)
+        self.assertEqual([], msg.addresses())
+
+    def test_decode_follows_compressed_names(self):
+        data = bytes.fromhex(
+            "00078180000100010000000003777777066465626961"
+            "6e036f72670000010001c00c000100010000012c0004c000020a"
+        )
+        msg = decode(data)
+        self.assertEqual("www.debian.org", msg.answers[0].name)
+        self.assertEqual(["192.0.2.10"], msg.addresses())
+        self.assertEqual(300, msg.answers[0].ttl)
+
+    def test_decode_raises_value_error_on_truncated_messages(self):
+        data = encode_query("www.debian.org")
+        with self.assertRaises(ValueError):
+            decode(data[:5])
+        with self.assertRaises(ValueError):
+            decode(data[:-3])
+
+
+class TestDnsCache(TestCase):
+    def test_dns_cache_returns_addresses_until_ttl_expires(self):
+        cache = DnsCache()
+        cache.put("www.Debian.org.", TYPE_A, ["192.0.2.10"], 60, now=1000)
+        self.assertEqual(["192.0.2.10"], cache.get("www.debian.org", now=1059))
+        self.assertEqual([], cache.get("www.debian.org", now=1060))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_dns_cache_does_not_cache_empty_answers_or_zero_ttl(self):
+        cache = DnsCache()
+        cache.put("www.debian.org", TYPE_A, [], 60)
+        cache.put("www.ubuntu.com", TYPE_A, ["192.0.2.11"], 0)
+        self.assertEqual([], cache.get("www.debian.org"))
+        self.assertEqual([], cache.get("www.ubuntu.com"))
+
+    def test_dns_cache_evicts_least_recently_used_entries(self):
+        cache = DnsCache(max_entries=2)
+        cache.put("a.example", TYPE_A, ["192.0.2.1"], 60)
+        cache.put("b.example", TYPE_A, ["192.0.2.2"], 60)
+        cache.get("a.example")
+        cache.put("c.example", TYPE_A, ["192.0.2.3"], 60)
+        self.assertEqual(["192.0.2.1"], cache.get("a.example"))
+        self.assertEqual([], cache.get("b.example"))
+
+    @patch("vaslam.dns.socket.gethostbyname")
+    def test_dns_cache_lookup_resolves_and_caches_names(self, mock_gethostbyname):
+        mock_gethostbyname.return_value = "192.0.2.10"
+        cache = DnsCache(default_ttl=30)
+        self.assertEqual("192.0.2.10", cache.lookup("www.debian.org"))
+        self.assertEqual("192.0.2.10", cache.lookup("www.debian.org"))
+        mock_gethostbyname.assert_called_once_with("www.debian.org")
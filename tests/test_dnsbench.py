@@ -0,0 +1,55 @@
+from unittest import TestCase
+from vaslam.dnsbench import (
+    ResolverStats,
+    bench_resolvers,
+    slow_system_resolver,
+    SYSTEM,
+    PUBLIC,
+)
+from vaslam.sim import DnsResponder, Impairment
+
+
+class TestBenchResolvers(TestCase):
+    def _name_server(self, host, port, impairment):
+        server = DnsResponder(host, port, impairment, {"example.org": host})
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_bench_resolvers_ranks_name_servers_and_flags_slow_system_one(self):
+        port = self._name_server("127.0.0.3", 0, Impairment(delay=0.08)).address[1]
+        self._name_server("127.0.0.4", port, Impairment())
+        ranked = bench_resolvers(
+            ["127.0.0.3"], ["127.0.0.4"], ["example.org"], rounds=4, port=port
+        )
+        self.assertEqual(["127.0.0.4", "127.0.0.3"], [s.name_server for s in ranked])
+        self.assertEqual([PUBLIC, SYSTEM], [s.source for s in ranked])
+        self.assertEqual([4, 4], [s.queries for s in ranked])
+        self.assertGreater(ranked[1].median, 70)
+        self.assertEqual([0, 0], [s.incorrect for s in ranked])
+        self.assertTrue(slow_system_resolver(ranked))
+
+
+class TestResolverStats(TestCase):
+    def _stats(self, name_server, source, median, errors=0):
+        stats = ResolverStats(name_server, source)
+        stats.latencies = [median] * 5
+        stats.queries = 5
+        stats.timeouts = errors
+        return stats
+
+    def test_slow_system_resolver_compares_working_name_servers(self):
+        system = self._stats("192.168.0.1", SYSTEM, 80)
+        public = self._stats("1.1.1.1", PUBLIC, 10)
+        self.assertTrue(slow_system_resolver([public, system]))
+        self.assertFalse(slow_system_resolver([system]))
+        broken = self._stats("1.1.1.1", PUBLIC, 10, errors=3)
+        self.assertFalse(slow_system_resolver([broken, system]))
+        close = self._stats("8.8.8.8", PUBLIC, 70)
+        self.assertFalse(slow_system_resolver([close, system]))
+
+    def test_error_rate_counts_timeouts_and_incorrect_answers(self):
+        stats = ResolverStats("1.1.1.1")
+        self.assertEqual(1.0, stats.error_rate)
+        stats.queries, stats.timeouts, stats.incorrect = 10, 1, 1
+        self.assertAlmostEqual(0.2, stats.error_rate)
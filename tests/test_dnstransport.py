@@ -0,0 +1,126 @@
+from time import sleep
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from vaslam.dns import TYPE_A
+from vaslam.net import DnsConError
+from vaslam.dnstransport import (
+    DnsTransport,
+    TlsTransport,
+    HttpsTransport,
+    TransportPool,
+    new_transport,
+)
+from vaslam.sim import (
+    DnsResponder,
+    DnsStreamServer,
+    DohHttpServer,
+    Impairment,
+    LOCAL_HOST,
+    INTERNET_HOST,
+    self_signed_contexts,
+)
+
+
+class TestDnsTransport(TestCase):
+    def setUp(self):
+        self.responder = DnsResponder(LOCAL_HOST, 0, Impairment(), {"*": INTERNET_HOST})
+        self.addCleanup(self.responder.sock.close)
+
+    def _serve(self, server):
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def _tls_contexts(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        try:
+            return self_signed_contexts(tmp_dir.name)
+        except OSError as err:
+            self.skipTest("can not create a certificate: {}".format(err))
+
+    def test_tcp_queries_reuse_the_connection(self):
+        server = self._serve(
+            DnsStreamServer(LOCAL_HOST, 0, Impairment(), self.responder)
+        )
+        transport = new_transport(server.uri, 2)
+        self.addCleanup(transport.close)
+        msg, stats = transport.query("www.example.org")
+        self.assertEqual([INTERNET_HOST], msg.addresses(TYPE_A))
+        self.assertTrue(stats.ok)
+        self.assertFalse(stats.reused)
+        self.assertGreater(stats.connect_time, 0)
+        self.assertEqual(0, stats.handshake_time)
+        for _ in range(3):
+            msg, stats = transport.query("www.example.org")
+            self.assertTrue(stats.reused)
+            self.assertEqual(0, stats.connect_time)
+        self.assertEqual((1, 1), (transport.connections, server.connections))
+
+    def test_connections_closed_by_the_server_are_reopened(self):
+        server = self._serve(
+            DnsStreamServer(LOCAL_HOST, 0, Impairment(), self.responder, None, 0.1)
+        )
+        transport = DnsTransport(*server.address, timeout=2)
+        self.addCleanup(transport.close)
+        transport.query("www.example.org")
+        sleep(0.3)
+        msg, stats = transport.query("www.example.org")
+        self.assertEqual([INTERNET_HOST], msg.addresses(TYPE_A))
+        self.assertFalse(stats.reused)
+        self.assertEqual(2, server.connections)
+
+    def test_query_raises_dns_error_if_server_is_down(self):
+        server = DnsStreamServer(LOCAL_HOST, 0, Impairment(), self.responder)
+        server.server.server_close()
+        transport = DnsTransport(*server.address, timeout=1)
+        with self.assertRaises(DnsConError):
+            transport.query("www.example.org")
+
+    def test_tls_handshake_is_timed_apart_from_queries(self):
+        server_context, client_context = self._tls_contexts()
+        server = self._serve(
+            DnsStreamServer(LOCAL_HOST, 0, Impairment(), self.responder, server_context)
+        )
+        self.assertTrue(server.uri.startswith("tls://"))
+        transport = new_transport(server.uri, 2, client_context)
+        self.addCleanup(transport.close)
+        msg, stats = transport.query("www.example.org")
+        self.assertEqual([INTERNET_HOST], msg.addresses(TYPE_A))
+        self.assertGreater(stats.handshake_time, 0)
+        _, stats = transport.query("www.example.org")
+        self.assertEqual((True, 0), (stats.reused, stats.handshake_time))
+        self.assertEqual(1, server.connections)
+
+    def test_tls_query_fails_with_untrusted_certificate(self):
+        server_context, _ = self._tls_contexts()
+        server = self._serve(
+            DnsStreamServer(LOCAL_HOST, 0, Impairment(), self.responder, server_context)
+        )
+        transport = TlsTransport(*server.address, timeout=2)
+        with self.assertRaises(DnsConError):
+            transport.query("www.example.org")
+
+    def test_doh_queries_reuse_the_connection(self):
+        server_context, client_context = self._tls_contexts()
+        server = self._serve(
+            DohHttpServer(LOCAL_HOST, 0, Impairment(), self.responder, server_context)
+        )
+        transport = new_transport(server.url, 2, client_context)
+        self.assertIsInstance(transport, HttpsTransport)
+        self.addCleanup(transport.close)
+        for _ in range(3):
+            msg, stats = transport.query("www.example.org")
+            self.assertEqual([INTERNET_HOST], msg.addresses(TYPE_A))
+        self.assertTrue(stats.reused)
+        self.assertEqual(1, server.connections)
+
+    def test_pool_returns_the_same_transport_of_uri(self):
+        pool = TransportPool()
+        transport = pool.get("tls://192.0.2.53")
+        self.assertIs(transport, pool.get("tls://192.0.2.53"))
+        self.assertEqual(("192.0.2.53", 853), (transport.host, transport.port))
+        self.assertEqual(5353, pool.get("tcp://192.0.2.53:5353").port)
+        with self.assertRaises(ValueError):
+            pool.get("udp://192.0.2.53")
+        pool.close()
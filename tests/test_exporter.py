@@ -0,0 +1,137 @@
+from threading import Thread
+from urllib.request import urlopen
+from urllib.error import HTTPError
+from unittest import TestCase
+from vaslam.diag import Result, HTTP_FAIL
+from vaslam.watch import Cycle
+from vaslam.system import Counters
+from vaslam.exporter import Histogram, Metrics, new_server, split_address
+
+
+class TestHistogram(TestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        hist = Histogram((0.01, 0.1))
+        for val in (0.005, 0.05, 0.05, 1.0):
+            hist.observe(val)
+        self.assertEqual(
+            [
+                'rtt_bucket{target="a",le="0.01"} 1',
+                'rtt_bucket{target="a",le="0.1"} 3',
+                'rtt_bucket{target="a",le="+Inf"} 4',
+                'rtt_sum{target="a"} 1.105',
+                'rtt_count{target="a"} 4',
+            ],
+            hist.render("rtt", (("target", "a"),)),
+        )
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.result = Result.new_all_ok()
+        self.result.gateway = "192.168.0.1"
+        self.result.gateway_ping_stats.packets_sent = 5
+        self.result.gateway_ping_stats.packets_recv = 4
+        self.result.gateway_ping_stats.rtt_avg = 2.0
+        self.result.dns_time = 20
+        self.cycle = Cycle()
+        self.cycle.duration = 1.5
+        self.cycle.cpu_time = 0.25
+        self.cycle.interval = 120.0
+
+    def test_metrics_are_rendered_on_update(self):
+        metrics = Metrics()
+        metrics.update(self.result, self.cycle)
+        text = metrics.rendered.decode("utf-8")
+        self.assertIn(
+            'vaslam_rtt_avg_seconds_count{path="gateway",target="192.168.0.1"} 1', text
+        )
+        self.assertIn(
+            'vaslam_ping_packets_lost_total{path="gateway",target="192.168.0.1"} 1',
+            text,
+        )
+        self.assertIn("vaslam_dns_duration_seconds_sum 0.02", text)
+        self.assertIn('vaslam_up{check="dns"} 1', text)
+        self.assertIn("vaslam_probe_duration_seconds 1.5", text)
+        self.assertIn("vaslam_probe_cpu_seconds_total 0.25", text)
+        self.assertIn("vaslam_probe_interval_seconds 120.0", text)
+
+    def test_metrics_observe_the_phases_of_https_requests(self):
+        https = self.result.https_stats
+        https.ok = True
+        https.connect_time, https.handshake_time, https.first_byte_time = 10, 30, 50
+        metrics = Metrics()
+        metrics.update(self.result, self.cycle)
+        text = metrics.rendered.decode("utf-8")
+        for phase, seconds in (
+            ("connect", "0.01"),
+            ("handshake", "0.03"),
+            ("first_byte", "0.05"),
+        ):
+            self.assertIn(
+                'vaslam_https_duration_seconds_sum{{phase="{}"}} {}'.format(
+                    phase, seconds
+                ),
+                text,
+            )
+        https.ok = False
+        metrics.update(self.result, self.cycle)
+        self.assertEqual(1, metrics.https_duration["connect"].count)
+
+    def test_metrics_add_up_kernel_counters(self):
+        metrics = Metrics()
+        counters = Counters()
+        counters.rx_errors = 2
+        counters.interval = 1.0
+        metrics.update_counters(counters)
+        metrics.update_counters(counters)
+        text = metrics.rendered.decode("utf-8")
+        self.assertIn('vaslam_kernel_counter_total{counter="rx_errors"} 4', text)
+        self.assertNotIn('counter="interval"', text)
+
+    def test_metrics_clear_resolved_issues(self):
+        metrics = Metrics()
+        self.result.http = False
+        metrics.update(self.result, self.cycle)
+        self.assertEqual(1, metrics.issues[HTTP_FAIL])
+        self.result.http = True
+        metrics.update(self.result, self.cycle)
+        self.assertEqual(0, metrics.issues[HTTP_FAIL])
+        self.assertIn(
+            'vaslam_issue{{code="{}",issue="Web access failed"}} 0'.format(HTTP_FAIL),
+            metrics.rendered.decode("utf-8"),
+        )
+
+
+class TestServer(TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+        self.server = new_server(self.metrics, "127.0.0.1", 0)
+        self.addCleanup(self.server.server_close)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.shutdown)
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def test_server_serves_rendered_metrics(self):
+        with urlopen(self.url + "/metrics", timeout=5) as resp:
+            self.assertEqual(200, resp.getcode())
+            self.assertEqual(self.metrics.rendered, resp.read())
+
+    def test_server_returns_not_found_for_other_paths(self):
+        with self.assertRaises(HTTPError):
+            urlopen(self.url + "/", timeout=5)
+
+    def test_server_listens_on_ipv6_addresses(self):
+        host, port = split_address("[::1]:0")
+        self.assertEqual(("::1", 0), (host, port))
+        self.assertEqual(("", 9650), split_address("9650"))
+        self.assertEqual(("127.0.0.1", 9650), split_address("127.0.0.1:9650"))
+        try:
+            server = new_server(self.metrics, host, port)
+        except OSError as err:
+            self.skipTest("IPv6 is not available: {}".format(err))
+        self.addCleanup(server.server_close)
+        Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        url = "http://[::1]:{}/metrics".format(server.server_address[1])
+        with urlopen(url, timeout=5) as resp:
+            self.assertEqual(self.metrics.rendered, resp.read())
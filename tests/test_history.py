@@ -0,0 +1,168 @@
+import json
+from os import path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from vaslam.diag import Result, HTTP_FAIL
+from vaslam.history import (
+    HistoryStore,
+    Bucket,
+    RAW,
+    MINUTE,
+    HOUR,
+    DAY,
+    GATEWAY,
+    INTERNET,
+)
+
+# a day boundary, so buckets of all resolutions start here
+START = 1700006400.0
+
+
+def _result(rtt=20.0, recv=5, http=True):
+    result = Result.new_all_ok()
+    result.http = http
+    result.gateway_ping_stats.packets_sent = 5
+    result.gateway_ping_stats.packets_recv = 5
+    result.gateway_ping_stats.rtt_avg = 2.0
+    result.internet_ping_stats.packets_sent = 5
+    result.internet_ping_stats.packets_recv = recv
+    result.internet_ping_stats.rtt_avg = rtt
+    return result
+
+
+class TestHistoryStore(TestCase):
+    def setUp(self):
+        self.history = HistoryStore()
+
+    def _add_every(self, interval, count, start=START, **kwargs):
+        for idx in range(count):
+            self.history.add(_result(**kwargs), start + idx * interval)
+
+    def test_results_are_folded_into_buckets_of_all_resolutions(self):
+        self._add_every(30, 4)
+        self.history.add(_result(rtt=80.0, recv=3, http=False), START + 120)
+        self.assertEqual(5, len(self.history.raw))
+        minutes = self.history.buckets[MINUTE].values()
+        self.assertEqual([2, 2, 1], [b.count for b in minutes])
+        hour = self.history.buckets[HOUR][START]
+        self.assertEqual(5, hour.count)
+        self.assertEqual(5, self.history.buckets[DAY][START].count)
+        self.assertEqual(25, hour.packets_sent[INTERNET])
+        self.assertEqual(8.0, hour.packet_loss_pct(INTERNET))
+        self.assertEqual(0.0, hour.packet_loss_pct(GATEWAY))
+        self.assertAlmostEqual(20.0, hour.quantile(INTERNET, 0.5), delta=0.4)
+        self.assertAlmostEqual(80.0, hour.quantile(INTERNET, 0.95), delta=1.6)
+        self.assertEqual({HTTP_FAIL: 1}, hour.issues)
+
+    def test_storage_is_bounded_by_retention(self):
+        history = HistoryStore(retention={RAW: HOUR, MINUTE: DAY, HOUR: 7 * DAY})
+        self.history = history
+        # a result every 10 minutes for 30 days
+        self._add_every(600, 30 * 144)
+        self.assertEqual(6, len(history.raw))
+        # buckets overlapping the retention window are kept
+        self.assertEqual(144 + 1, len(history.buckets[MINUTE]))
+        self.assertEqual(7 * 24 + 1, len(history.buckets[HOUR]))
+        self.assertEqual(30, len(history.buckets[DAY]))
+        summary = history.summary(START, START + 30 * DAY, START + 30 * DAY)
+        self.assertEqual(30 * 144, summary.count)
+
+    def test_queries_use_the_coarsest_sufficient_resolution(self):
+        now = START + 10 * DAY
+        self.assertEqual(RAW, self.history.resolution(now - 600, 30, now))
+        self.assertEqual(MINUTE, self.history.resolution(now - 600, 90, now))
+        self.assertEqual(HOUR, self.history.resolution(now - DAY, HOUR, now))
+        self.assertEqual(DAY, self.history.resolution(now - 5 * DAY, DAY, now))
+        # minutes are not kept for 5 days, hours are
+        self.assertEqual(HOUR, self.history.resolution(now - 5 * DAY, 600, now))
+        self.assertEqual(DAY, self.history.resolution(now - 90 * DAY, HOUR, now))
+
+    def test_trend_merges_buckets_into_points(self):
+        self._add_every(600, 6 * 24 * 3)
+        trend = self.history.trend(START, START + 3 * DAY, 3, START + 3 * DAY)
+        self.assertEqual([DAY] * 3, [b.width for b in trend])
+        self.assertEqual([144] * 3, [b.count for b in trend])
+        trend = self.history.trend(START, START + DAY, 24, START + 3 * DAY)
+        self.assertEqual(24, len(trend))
+        self.assertEqual([6] * 24, [b.count for b in trend])
+        # steps finer than the resolution covering the start are widened
+        trend = self.history.trend(START, START + HOUR, 60, START + 3 * DAY)
+        self.assertEqual(
+            [(START, HOUR, 6)], [(b.start, b.width, b.count) for b in trend]
+        )
+
+    def test_history_is_saved_and_loaded(self):
+        self._add_every(600, 12, http=False)
+        with TemporaryDirectory() as tmp_dir:
+            file_path = path.join(tmp_dir, "history.json")
+            self.history.path = file_path
+            self.history.save()
+            loaded = HistoryStore(file_path)
+            loaded.load(START + 2 * HOUR)
+            with open(file_path, "wt") as fh:
+                fh.write("{invalid")
+            invalid = HistoryStore(file_path)
+            with self.assertLogs("vaslam.history", "WARNING"):
+                invalid.load(START + 2 * HOUR)
+        self.assertEqual(12, len(loaded.raw))
+        original = self.history.summary(START, START + DAY, START + DAY)
+        restored = loaded.summary(START, START + DAY, START + DAY)
+        self.assertEqual(original.to_dict(), restored.to_dict())
+        self.assertEqual({HTTP_FAIL: 12}, restored.issues)
+        self.assertEqual(0, len(invalid.raw))
+
+    def test_results_are_journaled_between_snapshots(self):
+        with TemporaryDirectory() as tmp_dir:
+            file_path = path.join(tmp_dir, "history.json")
+            self.history.path = file_path
+            self._add_every(60, 1)
+            self.history.save(START)
+            snapshot_size = path.getsize(file_path)
+            for idx in range(1, 6):
+                self.history.add(_result(http=False), START + idx * 60)
+                self.history.save(START + idx * 60)
+            self.assertEqual(snapshot_size, path.getsize(file_path))
+            with open(self.history.journal_path, "rt") as fh:
+                self.assertEqual(5, len(fh.readlines()))
+            loaded = HistoryStore(file_path)
+            loaded.load(START + HOUR)
+            # a snapshot before the journal was removed doesn't count twice
+            self.history.snapshot()
+            with open(loaded.journal_path, "wt") as fh:
+                fh.write(json.dumps(self.history.raw[-1].to_dict()))
+                fh.write("\n{invalid\n")
+            reloaded = HistoryStore(file_path)
+            with self.assertLogs("vaslam.history", "WARNING"):
+                reloaded.load(START + HOUR)
+        for store in (loaded, reloaded):
+            summary = store.summary(START, START + HOUR, START + HOUR)
+            self.assertEqual(6, summary.count)
+            self.assertEqual({HTTP_FAIL: 5}, summary.issues)
+
+    def test_loaded_history_is_compacted(self):
+        self._add_every(600, 12)
+        with TemporaryDirectory() as tmp_dir:
+            file_path = path.join(tmp_dir, "history.json")
+            self.history.path = file_path
+            self.history.save()
+            loaded = HistoryStore(file_path)
+            loaded.load(START + 3 * DAY)
+        self.assertEqual(0, len(loaded.raw))
+        self.assertEqual(0, len(loaded.buckets[MINUTE]))
+        self.assertEqual(2, len(loaded.buckets[HOUR]))
+
+    def test_trend_points_cover_the_whole_period(self):
+        self._add_every(600, 6 * 24)
+        trend = self.history.trend(START, START + DAY, 7, START + DAY)
+        self.assertEqual([DAY / 7] * 7, [b.width for b in trend])
+        self.assertEqual(START + DAY, trend[-1].start + trend[-1].width)
+        self.assertEqual(144, sum(b.count for b in trend))
+
+
+class TestBucket(TestCase):
+    def test_bucket_dict_round_trip(self):
+        bucket = Bucket(START, HOUR)
+        bucket.merge(Bucket.from_result(_result(http=False), START))
+        restored = Bucket.from_dict(bucket.to_dict())
+        self.assertEqual(bucket.to_dict(), restored.to_dict())
+        self.assertEqual(1, restored.issues[HTTP_FAIL])
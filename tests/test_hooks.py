@@ -0,0 +1,110 @@
+from os import path
+from time import sleep, monotonic
+from threading import Event
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from vaslam.diag import Result, HTTP_FAIL
+from vaslam.hooks import (
+    TransitionTracker,
+    HookRunner,
+    Transition,
+    ISSUE_RAISED,
+    ISSUE_CLEARED,
+    IPV4_CHANGED,
+    GATEWAY_CHANGED,
+)
+
+
+def _result(http=True, ipv4="203.0.113.1", gateway="192.0.2.1"):
+    result = Result.new_all_ok()
+    result.http = http
+    result.ipv4, result.gateway = ipv4, gateway
+    return result
+
+
+class TestTransitionTracker(TestCase):
+    def setUp(self):
+        self.tracker = TransitionTracker(debounce=2, clear_after=3)
+
+    def _kinds(self, result):
+        return [(t.kind, t.issue) for t in self.tracker.update(result)]
+
+    def test_issues_are_raised_after_debounce_and_cleared_after_hysteresis(self):
+        self.assertEqual([], self._kinds(_result()))
+        self.assertEqual([], self._kinds(_result(http=False)))
+        self.assertEqual([(ISSUE_RAISED, HTTP_FAIL)], self._kinds(_result(http=False)))
+        self.assertEqual([], self._kinds(_result(http=False)))
+        self.assertEqual([], self._kinds(_result()))
+        self.assertEqual([], self._kinds(_result()))
+        self.assertEqual([(ISSUE_CLEARED, HTTP_FAIL)], self._kinds(_result()))
+        self.assertEqual([], self._kinds(_result()))
+
+    def test_flapping_issues_are_not_raised_or_cleared(self):
+        for idx in range(10):
+            self.assertEqual([], self._kinds(_result(http=bool(idx % 2))))
+        for _ in range(2):
+            self._kinds(_result(http=False))
+        for idx in range(10):
+            self.assertEqual([], self._kinds(_result(http=bool(idx % 2))))
+
+    def test_changed_values_are_debounced(self):
+        self.assertEqual([], self._kinds(_result()))
+        self.assertEqual([], self._kinds(_result(ipv4="203.0.113.2")))
+        self.assertEqual([], self._kinds(_result(ipv4="203.0.113.3")))
+        transitions = self.tracker.update(_result(ipv4="203.0.113.3"))
+        self.assertEqual([IPV4_CHANGED], [t.kind for t in transitions])
+        self.assertEqual(
+            ("203.0.113.1", "203.0.113.3"), (transitions[0].old, transitions[0].new)
+        )
+        self.assertEqual([], self._kinds(_result(ipv4="", gateway="")))
+        self.assertEqual([], self._kinds(_result(ipv4="203.0.113.3")))
+        self._kinds(_result(ipv4="203.0.113.3", gateway="192.0.2.2"))
+        self.assertEqual(
+            [(GATEWAY_CHANGED, 0)],
+            self._kinds(_result(ipv4="203.0.113.3", gateway="192.0.2.2")),
+        )
+
+
+class TestHookRunner(TestCase):
+    def test_slow_hooks_dont_block_dispatch(self):
+        called = []
+        done = Event()
+
+        def _hook(transition):
+            sleep(0.2)
+            called.append(transition.kind)
+            done.set()
+
+        runner = HookRunner([_hook])
+        runner.start()
+        start = monotonic()
+        runner.dispatch([Transition(ISSUE_RAISED, HTTP_FAIL)])
+        self.assertLess(monotonic() - start, 0.1)
+        self.assertTrue(done.wait(5))
+        runner.stop()
+        self.assertEqual([ISSUE_RAISED], called)
+
+    def test_commands_receive_the_transition_in_environment(self):
+        with TemporaryDirectory() as tmp_dir:
+            out = path.join(tmp_dir, "out")
+            command = 'echo "$VASLAM_EVENT $VASLAM_ISSUE $VASLAM_NEW" >> ' + out
+            runner = HookRunner([command, "exit 3"])
+            runner.start()
+            runner.dispatch(
+                [
+                    Transition(ISSUE_RAISED, HTTP_FAIL),
+                    Transition(IPV4_CHANGED, old="203.0.113.1", new="203.0.113.2"),
+                ]
+            )
+            runner.stop()
+            with open(out) as fh:
+                lines = fh.read().splitlines()
+        self.assertEqual(
+            ["issue_raised 400 ", "ipv4_changed  203.0.113.2"],
+            lines,
+        )
+
+    def test_transitions_are_dropped_when_hooks_fall_behind(self):
+        runner = HookRunner([lambda t: None], max_pending=2)
+        runner.dispatch([Transition(ISSUE_RAISED, HTTP_FAIL)] * 5)
+        self.assertEqual(3, runner.dropped)
@@ -2,11 +2,17 @@ from urllib.error import URLError
 from subprocess import CompletedProcess, TimeoutExpired
 from unittest import TestCase
 from unittest.mock import Mock, patch, call
+from vaslam.sim import UdpEchoTarget, Impairment
 from vaslam.net import (
     _parse_ping_output,
     ping_host,
+    ping_df,
     http_get,
     resolve_any_hostname,
+    probe_capacity,
+    new_socket,
+    current_binding,
+    Binding,
     PingStats,
     ConnectionError,
     HttpConError,
@@ -56,6 +62,36 @@ rtt min/avg/max/mdev = 0.079/0.083/0.087/0.003 ms
             timeout=8,
         )
 
+    def test_ping_host_binds_ping_cmd_to_interface_of_binding(self):
+        with Binding("wwan0", "10.0.0.2"):
+            ping_host("127.0.10.10", 8, 4)
+        self.mock_run.assert_called_once_with(
+            [
+                "/usr/bin/ping",
+                "-4",
+                "-q",
+                "-w",
+                "8",
+                "-c",
+                "4",
+                "-I",
+                "wwan0",
+                "127.0.10.10",
+            ],
+            capture_output=True,
+            text=True,
+            timeout=8,
+        )
+
+    def test_ping_host_pings_ipv6_hosts_with_icmpv6(self):
+        ping_host("2001:db8::1", 8, 4)
+        self.mock_run.assert_called_once_with(
+            ["/usr/bin/ping", "-6", "-q", "-w", "8", "-c", "4", "2001:db8::1"],
+            capture_output=True,
+            text=True,
+            timeout=8,
+        )
+
     def test_ping_host_checks_ping_cmd_uses_deafult_timeout_and_packets(self):
         ret = ping_host("127.0.10.10")
 
@@ -105,6 +141,45 @@ rtt min/avg/max/mdev = 0.079/0.083/0.087/0.003 ms
         with self.assertRaises(ConnectionError):
             ping_host("127.0.0.1")
 
+    def test_ping_df_sends_dont_fragment_packets_of_the_size(self):
+        replies, mtu = ping_df("127.0.10.10", 1400, 1, 4)
+        self.assertEqual((3, 0), (replies, mtu))
+        self.mock_run.assert_called_once_with(
+            [
+                "/usr/bin/ping",
+                "-4",
+                "-M",
+                "probe",
+                "-s",
+                "1372",
+                "-i",
+                "0.2",
+                "-w",
+                "1",
+                "-c",
+                "4",
+                "127.0.10.10",
+            ],
+            capture_output=True,
+            text=True,
+            timeout=2,
+        )
+
+    def test_ping_df_returns_the_mtu_reported_for_big_packets(self):
+        self.mock_run_result.returncode = 1
+        self.mock_run_result.stdout = """
+PING 192.0.2.9 (192.0.2.9) 1472(1500) bytes of data.
+From 192.0.2.1 icmp_seq=1 Frag needed and DF set (mtu = 1492)
+
+--- 192.0.2.9 ping statistics ---
+2 packets transmitted, 0 received, +2 errors, 100% packet loss, time 201ms
+"""
+        self.assertEqual((0, 1492), ping_df("192.0.2.9", 1500))
+        self.mock_run_result.returncode = 2
+        self.mock_run_result.stdout = ""
+        with self.assertRaises(ConnectionError):
+            ping_df("192.0.2.9", 1400)
+
 
 class TestParsePingOutput(TestCase):
     def test_ping_parse_output_ping_s20190515_fedora(self):
@@ -210,3 +285,56 @@ class TestResolveAnyDomain(TestCase):
         self.mock_gethostbyname.side_effect = OSError("mocked err in tests")
         ret = resolve_any_hostname(["invalid.local", "localhost"])
         self.assertEqual(("", "", 0, ""), ret)
+
+
+class TestProbeCapacity(TestCase):
+    def _echo_target(self, impairment):
+        target = UdpEchoTarget("127.0.0.1", 0, impairment)
+        target.start()
+        self.addCleanup(target.stop)
+        return target.address
+
+    def test_probe_capacity_estimates_bottleneck_capacity(self):
+        # 125 KB/s of payload, 1 Mbit/s
+        host, port = self._echo_target(Impairment(rate=125000))
+        stats = probe_capacity(host, port, trains=4, train_length=5)
+        self.assertEqual(4, stats.trains)
+        self.assertEqual(20, stats.packets_sent)
+        self.assertEqual(20, stats.packets_recv)
+        self.assertEqual(16000, stats.bytes_sent)
+        self.assertAlmostEqual(1.0, stats.capacity_mbps, delta=0.15)
+        self.assertGreater(stats.rtt_min, 5)
+
+    def test_probe_capacity_measures_queueing_delay(self):
+        host, port = self._echo_target(Impairment(spikes=[(0, 0.25, 0.2)]))
+        stats = probe_capacity(host, port, trains=5, train_length=3)
+        self.assertGreater(stats.queueing_delay, 150)
+
+    def test_probe_capacity_returns_empty_stats_without_replies(self):
+        host, port = self._echo_target(Impairment(loss=1))
+        stats = probe_capacity(host, port, trains=2, timeout=0.2)
+        self.assertEqual(12, stats.packets_sent)
+        self.assertEqual(0, stats.packets_recv)
+        self.assertEqual(0, stats.capacity)
+
+
+class TestBinding(TestCase):
+    def test_new_socket_is_bound_to_source_address_of_binding(self):
+        with Binding("", "127.0.0.1"):
+            sock = new_socket()
+        with sock:
+            self.assertEqual("127.0.0.1", sock.getsockname()[0])
+        with new_socket() as sock:
+            self.assertEqual(("0.0.0.0", 0), sock.getsockname())
+
+    def test_new_socket_raises_os_error_for_unknown_interface(self):
+        with Binding("vaslam-none0"):
+            with self.assertRaises(OSError):
+                new_socket()
+
+    def test_bindings_are_nested_per_thread(self):
+        with Binding("eth0"):
+            with Binding("wwan0", "10.0.0.2"):
+                self.assertEqual("wwan0", current_binding().interface)
+            self.assertEqual("eth0", current_binding().interface)
+        self.assertEqual("", current_binding().interface)
@@ -0,0 +1,67 @@
+from unittest import TestCase
+from unittest.mock import patch
+from vaslam.net import ConnectionError
+from vaslam.sim import UdpEchoTarget, Impairment, INTERNET_HOST
+from vaslam.pmtu import probe_path_mtu, _next_sizes
+
+
+class TestProbePathMtu(TestCase):
+    def _echo_target(self, mtu=0):
+        target = UdpEchoTarget(INTERNET_HOST, 0, Impairment(mtu=mtu))
+        target.start()
+        self.addCleanup(target.stop)
+        return target
+
+    def test_path_without_limits_has_the_max_mtu(self):
+        target = self._echo_target()
+        stats = probe_path_mtu(INTERNET_HOST, target.address[1], timeout=0.5)
+        self.assertTrue(stats.ok)
+        self.assertEqual((1500, 1500), (stats.mtu, stats.max_size))
+        self.assertEqual(1, stats.rounds)
+        self.assertFalse(stats.blackhole)
+
+    def test_big_packets_vanishing_are_a_blackhole(self):
+        target = self._echo_target(1400)
+        stats = probe_path_mtu(INTERNET_HOST, target.address[1], timeout=0.5)
+        self.assertEqual(1400, stats.mtu)
+        self.assertTrue(stats.blackhole)
+        self.assertLessEqual(stats.rounds, 4)
+
+    def test_path_mtu_is_a_lower_bound_after_max_rounds(self):
+        target = self._echo_target(1000)
+        stats = probe_path_mtu(
+            INTERNET_HOST, target.address[1], timeout=0.3, max_rounds=2
+        )
+        self.assertEqual(2, stats.rounds)
+        self.assertTrue(576 < stats.mtu <= 1000)
+        self.assertTrue(stats.blackhole)
+
+    def test_unanswered_probes_are_reported_in_stats(self):
+        target = self._echo_target(100)
+        stats = probe_path_mtu(INTERNET_HOST, target.address[1], timeout=0.3)
+        self.assertFalse(stats.ok)
+        self.assertFalse(stats.blackhole)
+        self.assertTrue(stats.error)
+
+    @patch("vaslam.pmtu.ping_df")
+    def test_mtu_reported_by_routers_is_not_a_blackhole(self, mock_ping):
+        mock_ping.side_effect = lambda host, size, *args: (
+            (2, 0) if size <= 1492 else (0, 1492)
+        )
+        stats = probe_path_mtu(INTERNET_HOST)
+        self.assertEqual((1492, 1492), (stats.mtu, stats.reported_mtu))
+        self.assertFalse(stats.blackhole)
+        self.assertEqual(1, stats.rounds)
+
+    @patch("vaslam.pmtu.ping_df")
+    def test_ping_errors_raise_connection_error(self, mock_ping):
+        mock_ping.side_effect = NotImplementedError()
+        with self.assertRaises(ConnectionError):
+            probe_path_mtu(INTERNET_HOST)
+
+
+class TestNextSizes(TestCase):
+    def test_sizes_are_evenly_spaced_between_the_bounds(self):
+        self.assertEqual([1300, 1320, 1340, 1360], _next_sizes(1280, 1380, 4))
+        self.assertEqual([1493, 1494, 1495], _next_sizes(1492, 1496, 4))
+        self.assertEqual([], _next_sizes(1492, 1493, 4))
@@ -0,0 +1,32 @@
+import json
+from os import path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from vaslam.recorder import FlightRecorder
+
+
+class TestFlightRecorder(TestCase):
+    def test_flight_recorder_records_nothing_when_disabled(self):
+        rec = FlightRecorder()
+        rec.record("dns", "localhost", ("127.0.0.1", 0.2))
+        self.assertEqual([], rec.get_events())
+
+    def test_flight_recorder_keeps_the_latest_events(self):
+        rec = FlightRecorder(3)
+        for i in range(5):
+            rec.record("ping", "host{}".format(i))
+        self.assertEqual(["host2", "host3", "host4"], [e[2] for e in rec.get_events()])
+
+    def test_flight_recorder_dumps_events_as_json_lines_and_clears(self):
+        rec = FlightRecorder(8)
+        rec.record("dns", "localhost", ("127.0.0.1", 0.2))
+        rec.record("http_error", "http://localhost", OSError("refused"))
+        with TemporaryDirectory() as tmp_dir:
+            file_path = path.join(tmp_dir, "events.jsonl")
+            self.assertEqual(2, rec.dump(file_path))
+            self.assertEqual(0, rec.dump(file_path))
+            with open(file_path) as fh:
+                events = [json.loads(l) for l in fh]
+        self.assertEqual(["dns", "http_error"], [e["kind"] for e in events])
+        self.assertEqual(["127.0.0.1", 0.2], events[0]["data"])
+        self.assertEqual("refused", events[1]["data"])
@@ -0,0 +1,159 @@
+from os import path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+import vaslam.check
+from vaslam.conf import Conf
+from vaslam.diag import Result, INTERNET_LATENCY, LOCALNET_GATEWAY_UNREACHABLE
+from vaslam.dnstransport import TransportStats
+from vaslam.net import PingStats, HttpConError
+from vaslam.replay import (
+    Capture,
+    capture_diagnosis,
+    replay,
+    save_capture,
+    load_captures,
+    PROBES,
+)
+
+
+def _ping_stats(rtt):
+    stats = PingStats()
+    stats.packets_sent = stats.packets_recv = 5
+    stats.rtt_min = stats.rtt_avg = stats.rtt_max = rtt
+    return stats
+
+
+class TestCaptureReplay(TestCase):
+    def setUp(self):
+        self.conf = Conf()
+        self.conf.hostnames = ["www.debian.org"]
+        self.conf.ipv4_gateway = "192.168.0.1"
+        self.conf.ipv4_ping_hosts = ["1.1.1.1"]
+        self.conf.ipv4_echo_urls = ["http://icanhazip.com/ip", "http://ifconfig.me/ip"]
+
+        rtts = {"192.168.0.1": 1.5, "1.1.1.1": 250}
+        patcher = patch("vaslam.check.ping_host")
+        self.addCleanup(patcher.stop)
+        self.mock_ping = patcher.start()
+        self.mock_ping.side_effect = lambda host, *args: _ping_stats(rtts[host])
+
+        patcher = patch("vaslam.check.resolve_any_hostname")
+        self.addCleanup(patcher.stop)
+        self.mock_resolve = patcher.start()
+        self.mock_resolve.return_value = ("www.debian.org", "192.0.2.10", 20.0, "")
+
+        def _http_get(url):
+            if "icanhazip" in url:
+                raise HttpConError("mocked err in tests")
+            return 200, "203.0.113.7\n"
+
+        patcher = patch("vaslam.check.http_get")
+        self.addCleanup(patcher.stop)
+        self.mock_http = patcher.start()
+        self.mock_http.side_effect = _http_get
+
+    def test_capture_records_probe_observations(self):
+        with self.assertLogs("vaslam", "WARNING"):
+            result, capture = capture_diagnosis(self.conf)
+        self.assertEqual("203.0.113.7", result.ipv4)
+        probes = sorted((o["probe"], o["target"]) for o in capture.observations)
+        self.assertEqual(
+            [
+                ("http_get", "http://icanhazip.com/ip"),
+                ("http_get", "http://ifconfig.me/ip"),
+                ("ping_host", "1.1.1.1"),
+                ("ping_host", "192.168.0.1"),
+                ("resolve_any_hostname", "www.debian.org"),
+            ],
+            probes,
+        )
+
+    def test_capture_restores_the_probes(self):
+        originals = [getattr(vaslam.check, name) for name in PROBES]
+        with self.assertLogs("vaslam", "WARNING"):
+            capture_diagnosis(self.conf)
+        self.assertEqual(originals, [getattr(vaslam.check, name) for name in PROBES])
+
+    def test_replay_saved_captures_reproduces_results_without_probing(self):
+        with self.assertLogs("vaslam", "WARNING"):
+            result, capture = capture_diagnosis(self.conf)
+        with TemporaryDirectory() as tmp_dir:
+            file_path = path.join(tmp_dir, "captures.jsonl")
+            save_capture(capture, file_path)
+            save_capture(capture, file_path)
+            captures = list(load_captures(file_path))
+        self.assertEqual(2, len(captures))
+        self.mock_ping.reset_mock()
+        self.mock_http.reset_mock()
+
+        with self.assertLogs("vaslam", "WARNING"):
+            replayed = replay(captures[0])
+        self.assertFalse(self.mock_ping.called)
+        self.assertFalse(self.mock_http.called)
+        self.assertEqual(result.get_issues(), replayed.get_issues())
+        self.assertEqual(250, replayed.internet_ping_stats.rtt_avg)
+        self.assertEqual("203.0.113.7", replayed.ipv4)
+
+        class StrictResult(Result):
+            default_latency_threshold = 200
+
+        with patch("vaslam.diag.Result", StrictResult), self.assertLogs("vaslam"):
+            self.assertEqual([INTERNET_LATENCY], replay(captures[1]).get_issues())
+
+    def test_replay_fails_probes_that_were_not_captured(self):
+        with self.assertLogs("vaslam", "WARNING"):
+            result = replay(Capture(self.conf))
+        self.assertIn(LOCALNET_GATEWAY_UNREACHABLE, result.get_issues())
+        self.assertFalse(result.dns)
+        self.assertFalse(self.mock_ping.called)
+
+    def test_replay_dns_transport_queries(self):
+        self.conf.dns_transports = ["tls://192.0.2.53", "tcp://192.0.2.54"]
+
+        def _query(transport, name, *args):
+            stats = TransportStats(transport.transport, transport.server)
+            stats.ok, stats.query_time = True, 30.0
+            return stats
+
+        with patch("vaslam.check.query_transport") as mock_query:
+            mock_query.side_effect = _query
+            with self.assertLogs("vaslam", "WARNING"):
+                result, capture = capture_diagnosis(self.conf)
+            mock_query.reset_mock()
+            with self.assertLogs("vaslam", "WARNING"):
+                replayed = replay(capture)
+            self.assertFalse(mock_query.called)
+        self.assertEqual(
+            sorted((t.server, t.query_time) for t in result.dns_transports),
+            sorted((t.server, t.query_time) for t in replayed.dns_transports),
+        )
+        self.assertEqual(2, len(replayed.dns_transports))
+        capture.observations = []
+        with self.assertLogs("vaslam", "WARNING"):
+            replayed = replay(capture)
+        self.assertFalse(any(t.ok for t in replayed.dns_transports))
+
+    def test_replay_resolver_measurements_without_querying(self):
+        self.conf.name_servers = ["192.0.2.53"]
+        self.conf.dns_measure_domain = "example.com"
+        with patch("vaslam.check.measure_resolver") as mock_measure:
+            mock_measure.return_value = (120.0, 10.0)
+            with self.assertLogs("vaslam", "WARNING"):
+                result, capture = capture_diagnosis(self.conf)
+        self.assertIn(
+            ("measure_resolver", "192.0.2.53 example.com"),
+            [(o["probe"], o["target"]) for o in capture.observations],
+        )
+        with patch("vaslam.dns.query") as mock_query:
+            mock_query.side_effect = AssertionError("queried the network")
+            with self.assertLogs("vaslam", "WARNING"):
+                replayed = replay(capture)
+            self.assertEqual(
+                (120.0, 10.0), (replayed.dns_cold_time, replayed.dns_warm_time)
+            )
+            capture.observations = []
+            with self.assertLogs("vaslam", "WARNING"):
+                replayed = replay(capture)
+            self.assertFalse(mock_query.called)
+        self.assertEqual((0, 0), (replayed.dns_cold_time, replayed.dns_warm_time))
@@ -0,0 +1,91 @@
+from time import monotonic, sleep
+from threading import Lock, Thread
+from unittest import TestCase
+from vaslam.scheduler import ProbeScheduler, TokenBucket
+
+
+class TestTokenBucket(TestCase):
+    def test_reserve_waits_for_tokens_beyond_the_burst(self):
+        bucket = TokenBucket(10, 2)
+        now = bucket.updated
+        self.assertEqual(0, bucket.reserve(1, now))
+        self.assertEqual(0, bucket.reserve(1, now))
+        self.assertAlmostEqual(0.1, bucket.reserve(1, now))
+        self.assertAlmostEqual(0.2, bucket.reserve(1, now))
+        self.assertAlmostEqual(0.2, bucket.reserve(1, now + 0.1))
+
+    def test_tokens_refill_up_to_the_burst(self):
+        bucket = TokenBucket(10, 2)
+        now = bucket.updated
+        self.assertEqual(0, bucket.reserve(2, now + 60))
+        self.assertAlmostEqual(0.1, bucket.reserve(1, now + 60))
+
+
+class TestProbeScheduler(TestCase):
+    def setUp(self):
+        self.scheduler = ProbeScheduler()
+
+    def test_not_configured_scheduler_does_not_wait(self):
+        for _ in range(100):
+            with self.scheduler.slot("192.0.2.1") as slot:
+                self.assertEqual(0, slot.waited)
+        self.assertFalse(self.scheduler.enabled)
+        self.assertEqual(0, self.scheduler.scheduled)
+
+    def test_probes_are_paced_by_the_rate(self):
+        self.scheduler.configure(rate=50)
+        start = monotonic()
+        for _ in range(6):
+            with self.scheduler.slot("192.0.2.1"):
+                pass
+        self.assertGreaterEqual(monotonic() - start, 0.09)
+        self.assertEqual(6, self.scheduler.scheduled)
+        self.assertGreater(self.scheduler.total_wait, 0.09)
+
+    def test_destinations_are_paced_separately(self):
+        self.scheduler.configure(destination_rate=5)
+        start = monotonic()
+        for idx in range(5):
+            with self.scheduler.slot("192.0.2.{}".format(idx)) as slot:
+                self.assertLess(slot.waited, 0.05)
+        with self.scheduler.slot("192.0.2.1") as slot:
+            self.assertGreater(slot.waited, 0.15)
+        self.assertGreaterEqual(monotonic() - start, 0.15)
+
+    def test_probes_in_flight_are_bounded(self):
+        self.scheduler.configure(max_in_flight=2)
+        lock = Lock()
+        in_flight = [0, 0]
+
+        def _probe():
+            with self.scheduler.slot("192.0.2.1"):
+                with lock:
+                    in_flight[0] += 1
+                    in_flight[1] = max(in_flight)
+                sleep(0.02)
+                with lock:
+                    in_flight[0] -= 1
+
+        threads = [Thread(target=_probe) for _ in range(8)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        self.assertEqual(2, in_flight[1])
+
+    def test_nested_probes_are_scheduled_with_their_parent(self):
+        self.scheduler.configure(max_in_flight=1, rate=1)
+        with self.scheduler.slot("192.0.2.1"):
+            with self.scheduler.slot("192.0.2.1") as nested:
+                self.assertEqual(0, nested.waited)
+        self.assertEqual(1, self.scheduler.scheduled)
+
+    def test_thread_wait_adds_up_waits_of_the_thread(self):
+        self.scheduler.configure(jitter=0.02)
+        before = self.scheduler.thread_wait()
+        waits = []
+        for _ in range(3):
+            with self.scheduler.slot("192.0.2.1") as slot:
+                waits.append(slot.waited)
+        self.assertAlmostEqual(sum(waits), self.scheduler.thread_wait() - before)
+        self.assertGreater(sum(waits), 0)
@@ -0,0 +1,82 @@
+import socket
+from os import path
+from time import sleep
+from threading import Thread
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from vaslam.conf import Conf
+from vaslam.diag import Result
+from vaslam.net import ConnectionError
+from vaslam.service import DiagnosisService, ServiceServer, request_diagnosis
+
+
+class TestDiagnosisService(TestCase):
+    def setUp(self):
+        self.calls = 0
+        self.service = DiagnosisService(Conf(), self._diagnose)
+
+    def _diagnose(self, conf, observer, dns_cache):
+        self.calls += 1
+        sleep(0.2)
+        result = Result.new_all_ok()
+        result.ipv4 = "203.0.113.{}".format(self.calls)
+        return result
+
+    def test_concurrent_requests_share_a_single_diagnosis(self):
+        results = []
+        threads = [
+            Thread(target=lambda: results.append(self.service.get(5)[0]))
+            for _ in range(8)
+        ]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        self.assertEqual(1, self.calls)
+        self.assertEqual({"203.0.113.1"}, {r.ipv4 for r in results})
+
+    def test_requests_are_answered_from_fresh_enough_result(self):
+        self.service.get(5)
+        result, age = self.service.get(5)
+        self.assertEqual(1, self.calls)
+        self.assertLess(age, 5)
+        result, age = self.service.get(0)
+        self.assertEqual(2, self.calls)
+        self.assertEqual(("203.0.113.2", 0.0), (result.ipv4, age))
+
+
+class TestServiceServer(TestCase):
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = path.join(tmp_dir.name, "vaslam.sock")
+
+    def _serve(self, diagnose):
+        server = ServiceServer(DiagnosisService(Conf(), diagnose), self.path)
+        th = Thread(target=server.serve_forever, daemon=True)
+        th.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_request_diagnosis_returns_result_of_the_service(self):
+        result = Result.new_all_ok()
+        result.ipv4 = "203.0.113.7"
+        result.internet_ping_stats.rtt_avg = 12.5
+        server = self._serve(lambda conf, observer, dns_cache: result)
+        received, age = request_diagnosis(10, self.path, 5)
+        self.assertEqual(result.to_dict(), received.to_dict())
+        self.assertEqual(0.0, age)
+        _, age = request_diagnosis(10, self.path, 5)
+        self.assertGreater(age, 0.0)
+        self.assertEqual(1, server.service.diagnoses)
+
+    def test_request_diagnosis_raises_connection_error_without_service(self):
+        with self.assertRaises(ConnectionError):
+            request_diagnosis(10, self.path, 1)
+
+    def test_server_replaces_stale_socket(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(self.path)
+        self._serve(lambda conf, observer, dns_cache: Result.new_all_ok())
+        self.assertTrue(request_diagnosis(10, self.path, 5)[0].internet)
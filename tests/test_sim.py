@@ -0,0 +1,284 @@
+from time import time
+from threading import Thread
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from vaslam.diag import (
+    diagnose_network,
+    LOCALNET_PACKET_LOSS_HIGH,
+    LOCALNET_UNKNOWN,
+    LOCALNET_LATENCY,
+    INTERNET_UNKNOWN,
+    INTERNET_UNREACHABLE,
+    INTERNET_LATENCY,
+    INTERNET_MTU_BLACKHOLE,
+    DNS_FAIL,
+    DNS_LATENCY,
+    DNS_TRANSPORT_SLOW,
+    HTTP_FAIL,
+    HTTPS_CERT_UNTRUSTED,
+    BANDWIDTH_LOW,
+    LOCALNET_UPLINK_DOWN,
+    diagnose_uplinks,
+    IPV4_UNREACHABLE,
+    IPV6_UNREACHABLE,
+)
+from vaslam.check import (
+    check_dns,
+    check_dns_cold_warm,
+    check_ping_ipv4,
+    get_visible_ipv4,
+)
+from vaslam.dns import DnsCache, encode_query
+from vaslam.dnstransport import TransportPool
+from vaslam.sim import (
+    Simulator,
+    Impairment,
+    DnsResponder,
+    LOCAL_HOST,
+    INTERNET_HOST,
+    GATEWAY_HOST,
+    self_signed_contexts,
+)
+from vaslam.tls import TlsSessions
+from vaslam.system import Route
+
+
+class TestSimulator(TestCase):
+    def _simulate(self, **kwargs):
+        sim = Simulator(**kwargs)
+        sim.start()
+        self.addCleanup(sim.stop)
+        return sim
+
+    def test_checks_run_against_the_simulated_network(self):
+        sim = self._simulate()
+        conf = sim.conf()
+        host, addr, _, resolver = check_dns(
+            conf.hostnames, None, conf.resolver, conf.resolver_port
+        )
+        self.assertEqual(("www.example.org", INTERNET_HOST), (host, addr))
+        self.assertEqual("127.0.0.1", resolver)
+        host, stats = check_ping_ipv4(conf.ipv4_ping_hosts, None, conf.ping_port, 2)
+        self.assertEqual(INTERNET_HOST, host)
+        self.assertEqual(5, stats.packets_recv)
+        self.assertEqual("127.0.0.1", get_visible_ipv4(conf.ipv4_echo_urls)[0])
+
+    def test_diagnose_healthy_simulated_network_has_no_issues(self):
+        sim = self._simulate()
+        result = diagnose_network(sim.conf())
+        self.assertEqual([], result.get_issues())
+
+    def test_diagnose_traces_path_to_the_simulated_internet_host(self):
+        sim = self._simulate()
+        conf = sim.conf()
+        conf.trace_path = True
+        result = diagnose_network(conf)
+        self.assertEqual([INTERNET_HOST], [h.address for h in result.path_hops])
+        self.assertEqual([], result.get_issues())
+
+    def test_diagnose_finds_mtu_blackhole_of_the_simulated_internet(self):
+        sim = self._simulate(internet=Impairment(mtu=1400))
+        conf = sim.conf()
+        conf.path_mtu = True
+        result = diagnose_network(conf)
+        mtus = {m.host: (m.mtu, m.blackhole) for m in result.mtu_stats}
+        self.assertEqual(
+            {GATEWAY_HOST: (1500, False), INTERNET_HOST: (1400, True)}, mtus
+        )
+        self.assertEqual([INTERNET_MTU_BLACKHOLE], result.get_issues())
+
+    def test_diagnose_uplinks_concurrently_bound_to_their_interfaces(self):
+        sim = self._simulate()
+        routes = [Route("vaslam-none0", GATEWAY_HOST, 50), Route("lo", GATEWAY_HOST)]
+        result = diagnose_uplinks(sim.conf(), routes)
+        self.assertEqual(routes, [u.route for u in result.uplinks])
+        down, up = result.uplinks
+        self.assertFalse(down.result.internet)
+        self.assertTrue(up.result.internet)
+        self.assertEqual("127.0.0.1", up.source)
+        self.assertEqual("127.0.0.1", result.ipv4)
+        self.assertEqual([LOCALNET_UPLINK_DOWN], result.get_issues())
+
+    def test_diagnose_uplinks_without_gateway_skips_the_local_network(self):
+        sim = self._simulate()
+        result = diagnose_uplinks(sim.conf(), [Route("lo", "", 50)])
+        self.assertTrue(result.on_link)
+        self.assertTrue(result.internet)
+        self.assertEqual(0, result.gateway_ping_stats.packets_sent)
+        self.assertEqual([], result.get_issues())
+
+    def test_diagnose_dual_stack_simulated_network(self):
+        sim = self._simulate(ipv6=Impairment())
+        result = diagnose_network(sim.conf())
+        self.assertEqual(("127.0.0.1", "::1"), (result.ipv4, result.ipv6))
+        self.assertTrue(result.ipv6_result.dns)
+        self.assertEqual(5, result.ipv6_result.internet_ping_stats.packets_recv)
+        self.assertEqual([], result.get_issues())
+
+    def test_diagnose_does_not_wait_for_the_unreachable_ip_family(self):
+        outage = [(0, 60)]
+        sim = self._simulate(
+            gateway=Impairment(outages=outage),
+            internet=Impairment(outages=outage),
+            name_server=Impairment(outages=outage),
+            http=Impairment(outages=outage),
+            ipv6=Impairment(),
+        )
+        conf = sim.conf(ping_timeout=5)
+        conf.resolver_timeout = 1
+        start = time()
+        with self.assertLogs("vaslam", "INFO"):
+            result = diagnose_network(conf)
+        # pings are abandoned once DNS and HTTP of IPv4 failed
+        self.assertLess(time() - start, 3)
+        self.assertEqual("::1", result.ipv6)
+        self.assertEqual(["gw", "internet"], result.unknown)
+        self.assertEqual(
+            [LOCALNET_UNKNOWN, INTERNET_UNKNOWN, DNS_FAIL, HTTP_FAIL, IPV4_UNREACHABLE],
+            result.get_issues(),
+        )
+
+    def test_diagnose_waits_for_the_slower_working_ip_family(self):
+        sim = self._simulate(
+            gateway=Impairment(delay=0.3),
+            internet=Impairment(delay=0.3),
+            ipv6=Impairment(),
+        )
+        conf = sim.conf()
+        conf.family_grace = 0.05
+        result = diagnose_network(conf)
+        self.assertEqual([], result.unknown)
+        self.assertEqual(5, result.internet_ping_stats.packets_recv)
+        self.assertEqual([LOCALNET_LATENCY, INTERNET_LATENCY], result.get_issues())
+
+    def test_diagnose_reports_unreachable_ipv6(self):
+        sim = self._simulate(ipv6=Impairment(outages=[(0, 60)]))
+        conf = sim.conf(ping_timeout=5)
+        conf.resolver_timeout = 1
+        with self.assertLogs("vaslam", "INFO"):
+            result = diagnose_network(conf)
+        self.assertEqual("127.0.0.1", result.ipv4)
+        self.assertEqual(["gw", "internet"], result.ipv6_result.unknown)
+        self.assertEqual([IPV6_UNREACHABLE], result.get_issues())
+
+    def test_diagnose_low_bandwidth_simulated_network(self):
+        sim = self._simulate(bandwidth=100000)
+        conf = sim.conf()
+        conf.throughput_download_url = sim.bulk.url
+        conf.throughput_duration = 1
+        result = diagnose_network(conf)
+        self.assertLess(result.download_stats.goodput_mbps, 5)
+        self.assertEqual([BANDWIDTH_LOW], result.get_issues())
+        self.assertEqual("127.0.0.1", result.ipv4)
+
+    def test_diagnose_reports_simulated_latency_and_packet_loss(self):
+        sim = self._simulate(
+            gateway=Impairment(loss=0.3, seed=3),
+            internet=Impairment(delay=0.35, jitter=0.01),
+        )
+        start = time()
+        result = diagnose_network(sim.conf(ping_timeout=2))
+        self.assertLess(time() - start, 3)
+        issues = result.get_issues()
+        self.assertIn(LOCALNET_PACKET_LOSS_HIGH, issues)
+        self.assertIn(INTERNET_LATENCY, issues)
+        self.assertGreater(result.internet_ping_stats.rtt_avg, 300)
+
+    def test_diagnose_holds_timeouts_during_outages(self):
+        outage = [(0, 60)]
+        sim = self._simulate(
+            internet=Impairment(outages=outage),
+            name_server=Impairment(outages=outage),
+            http=Impairment(outages=outage),
+        )
+        conf = sim.conf(ping_timeout=1)
+        start = time()
+        with self.assertLogs("vaslam", "WARNING"):
+            result = diagnose_network(conf)
+        self.assertLess(time() - start, 15)
+        issues = result.get_issues()
+        self.assertIn(INTERNET_UNREACHABLE, issues)
+        self.assertIn(DNS_FAIL, issues)
+        self.assertIn(HTTP_FAIL, issues)
+
+    def test_cached_names_are_not_resolved_again(self):
+        sim = self._simulate(hostnames=["echo.example.org"])
+        sim.name_server.records["echo.example.org"] = "127.0.0.1"
+        conf = sim.conf()
+        url = "http://echo.example.org:{}/ip".format(sim.http.address[1])
+        cache = DnsCache()
+        check_dns(conf.hostnames, None, conf.resolver, conf.resolver_port, 2, cache)
+        received = sim.name_server.received
+        for _ in range(3):
+            self.assertEqual("127.0.0.1", get_visible_ipv4([url], None, cache)[0])
+        self.assertEqual(received, sim.name_server.received)
+        self.assertEqual(3, cache.hits)
+
+    def test_cold_and_warm_resolution_are_measured(self):
+        sim = self._simulate(dns_cold_delay=0.6)
+        conf = sim.conf()
+        cold, warm = check_dns_cold_warm(
+            conf.resolver, "example.org", conf.resolver_port, 2
+        )
+        self.assertGreater(cold, 500)
+        self.assertLess(warm, 500)
+
+        conf.dns_measure_domain = "example.net"
+        result = diagnose_network(conf)
+        self.assertGreater(result.dns_cold_time, 500)
+        self.assertIn(DNS_LATENCY, result.get_issues())
+
+    def test_dns_transport_connections_are_reused_between_diagnosis(self):
+        sim = self._simulate(dns_tcp=Impairment(delay=0.2))
+        conf = sim.conf()
+        pool = TransportPool()
+        self.addCleanup(pool.close)
+        for _ in range(2):
+            result = diagnose_network(conf, None, None, pool)
+        stats = result.dns_transports[0]
+        self.assertEqual((True, True), (stats.ok, stats.reused))
+        self.assertGreater(stats.query_time, 200)
+        self.assertEqual(1, sim.dns_tcp.connections)
+        self.assertIn(DNS_TRANSPORT_SLOW, result.get_issues())
+
+    def test_https_sessions_are_resumed_between_diagnosis(self):
+        with TemporaryDirectory() as tmp_dir:
+            try:
+                server_context, client_context = self_signed_contexts(tmp_dir)
+            except OSError as err:
+                self.skipTest("can not create a certificate: {}".format(err))
+        sim = self._simulate(tls_context=server_context)
+        sessions = TlsSessions(client_context)
+        first = diagnose_network(sim.conf(), None, None, None, sessions)
+        second = diagnose_network(sim.conf(), None, None, None, sessions)
+        self.assertEqual("127.0.0.1", first.https_stats.ip)
+        self.assertEqual(
+            (False, True), (first.https_stats.resumed, second.https_stats.resumed)
+        )
+        self.assertEqual([], second.get_issues())
+        self.assertEqual(
+            [HTTPS_CERT_UNTRUSTED], diagnose_network(sim.conf()).get_issues()
+        )
+
+
+class TestDnsResponder(TestCase):
+    def test_only_the_first_query_of_a_name_is_delayed(self):
+        responder = DnsResponder(
+            LOCAL_HOST, 0, Impairment(), {"*": INTERNET_HOST}, cold_delay=0.5
+        )
+        self.addCleanup(responder.sock.close)
+        delays = []
+
+        def _query():
+            for _ in range(50):
+                response, delay = responder.respond(encode_query("example.org"))
+                self.assertIsNotNone(response)
+                delays.append(delay)
+
+        threads = [Thread(target=_query) for _ in range(4)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        self.assertEqual(200, len(delays))
+        self.assertEqual(1, delays.count(0.5))
@@ -0,0 +1,58 @@
+from random import Random
+from unittest import TestCase
+from vaslam.sketch import LatencySketch
+
+
+class TestLatencySketch(TestCase):
+    def setUp(self):
+        rnd = Random(7)
+        self.values = sorted(rnd.lognormvariate(3, 1) for _ in range(5000))
+
+    def _exact(self, q):
+        return self.values[int(q * (len(self.values) - 1))]
+
+    def test_quantiles_are_within_relative_accuracy(self):
+        sketch = LatencySketch(0.01)
+        for value in self.values:
+            sketch.add(value)
+        self.assertEqual(5000, sketch.count)
+        for q in (0.1, 0.5, 0.9, 0.99):
+            self.assertAlmostEqual(1, sketch.quantile(q) / self._exact(q), delta=0.02)
+
+    def test_merged_sketches_equal_sketch_of_all_values(self):
+        whole, first, second = LatencySketch(), LatencySketch(), LatencySketch()
+        for idx, value in enumerate(self.values):
+            whole.add(value)
+            (first if idx % 2 else second).add(value)
+        first.merge(second)
+        self.assertEqual(whole.buckets, first.buckets)
+        self.assertEqual(whole.quantile(0.9), first.quantile(0.9))
+
+    def test_buckets_are_bounded_keeping_high_quantiles(self):
+        sketch = LatencySketch(0.01, max_buckets=64)
+        for value in self.values:
+            sketch.add(value)
+        self.assertLessEqual(len(sketch.buckets), 64)
+        self.assertAlmostEqual(1, sketch.quantile(0.99) / self._exact(0.99), delta=0.02)
+
+    def test_zero_values_are_counted(self):
+        sketch = LatencySketch()
+        sketch.add(0, 3)
+        sketch.add(10.0)
+        self.assertEqual(0.0, sketch.quantile(0.5))
+        self.assertAlmostEqual(10.0, sketch.quantile(1), delta=0.1)
+        self.assertEqual(0.0, LatencySketch().quantile(0.5))
+
+    def test_sketch_from_list_restores_encoded_sketch(self):
+        sketch = LatencySketch()
+        sketch.add(0, 2)
+        for value in self.values[:100]:
+            sketch.add(value)
+        restored = LatencySketch.from_list(sketch.to_list())
+        self.assertEqual(
+            (sketch.count, sketch.zeros, sketch.buckets),
+            (restored.count, restored.zeros, restored.buckets),
+        )
+        for encoded in ([], [0, 1], [0, 1, -1]):
+            with self.assertRaises(ValueError):
+                LatencySketch.from_list(encoded)
@@ -0,0 +1,105 @@
+import sys
+from os import path
+from time import time
+from threading import Thread, Event
+from tempfile import TemporaryDirectory
+from subprocess import run
+from unittest import TestCase
+from vaslam.diag import Result, DNS_FAIL, INTERNET_LATENCY
+from vaslam.status import StatusReader, StatusWriter, read_status
+
+
+class TestStatus(TestCase):
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = path.join(tmp_dir.name, "vaslam.status")
+        self.result = Result.new_all_ok()
+        self.result.ipv4 = "203.0.113.7"
+        for stats in (self.result.gateway_ping_stats, self.result.internet_ping_stats):
+            stats.packets_sent = stats.packets_recv = 5
+        self.result.internet_ping_stats.rtt_avg = 20.5
+
+    def test_read_status_returns_none_before_publishing(self):
+        with StatusWriter(self.path):
+            self.assertIsNone(read_status(self.path))
+
+    def test_read_status_returns_the_published_result(self):
+        with StatusWriter(self.path) as writer:
+            writer.publish(self.result, 3)
+            self.result.dns = False
+            self.result.internet_ping_stats.rtt_avg = 400.0
+            writer.publish(self.result, 4)
+        status = read_status(self.path)
+        self.assertEqual(4, status.cycle)
+        self.assertTrue(status.internet)
+        self.assertFalse(status.dns)
+        self.assertEqual("203.0.113.7", status.ipv4)
+        self.assertEqual(400.0, status.internet_rtt)
+        self.assertEqual([INTERNET_LATENCY, DNS_FAIL], status.issues)
+        self.assertLess(status.age, 5)
+
+    def test_invalid_addresses_are_not_published(self):
+        published = []
+        with StatusWriter(self.path) as writer:
+            for ipv4, ipv6 in (
+                ("<html>café</html>", "2001:db8::1"),
+                ("203.0.113.7\n" * 4, "fe80::1%" + "a" * 60),
+            ):
+                self.result.ipv4, self.result.ipv6 = ipv4, ipv6
+                writer.publish(self.result, 1)
+                status = read_status(self.path)
+                published.append((status.ipv4, status.ipv6))
+        self.assertEqual([("", "2001:db8::1"), ("", "")], published)
+
+    def test_writer_continues_the_sequence_of_the_existing_file(self):
+        with StatusWriter(self.path) as writer:
+            writer.publish(self.result, 1)
+        with StatusWriter(self.path) as writer:
+            self.assertEqual(1, read_status(self.path).cycle)
+            writer.publish(self.result, 2)
+        self.assertEqual(2, read_status(self.path).cycle)
+
+    def test_readers_get_consistent_status_while_writing(self):
+        stop = Event()
+        writer = StatusWriter(self.path)
+        self.addCleanup(writer.close)
+        writer.publish(self.result, 0)
+
+        def _publish():
+            cycle = 0
+            while not stop.is_set():
+                cycle += 1
+                self.result.internet_ping_stats.rtt_avg = float(cycle)
+                writer.publish(self.result, cycle)
+
+        th = Thread(target=_publish)
+        th.start()
+        self.addCleanup(th.join)
+        self.addCleanup(stop.set)
+        with StatusReader(self.path) as reader:
+            deadline = time() + 0.5
+            while time() < deadline:
+                status = reader.read()
+                if status is not None and status.cycle:
+                    self.assertEqual(float(status.cycle), status.internet_rtt)
+
+    def test_reader_rejects_files_of_other_layouts(self):
+        with open(self.path, "wb") as fh:
+            fh.write(bytes(512))
+        with self.assertRaises(ValueError):
+            read_status(self.path)
+
+    def test_status_command_does_not_import_network_modules(self):
+        with StatusWriter(self.path) as writer:
+            writer.publish(self.result, 1)
+        code = (
+            "import sys\n"
+            "from vaslam.app import main\n"
+            "code = main(['status', '-q', '-s', {!r}])\n"
+            "loaded = [m for m in ('vaslam.net', 'vaslam.diag') if m in sys.modules]\n"
+            "sys.exit(code + len(loaded))\n"
+        ).format(self.path)
+        root = path.dirname(path.dirname(path.abspath(__file__)))
+        proc = run([sys.executable, "-c", code], cwd=root)
+        self.assertEqual(0, proc.returncode)
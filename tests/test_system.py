@@ -1,7 +1,17 @@
+from os import path
+from tempfile import TemporaryDirectory
 from subprocess import CompletedProcess
 from unittest import TestCase
 from unittest.mock import patch, call, mock_open
-from vaslam.system import get_name_servers, get_gateway_ipv4
+from vaslam.system import (
+    get_name_servers,
+    get_gateway_ipv4,
+    get_default_routes_ipv4,
+    get_gateway_ipv6,
+    get_default_routes_ipv6,
+    CounterSampler,
+    RouteSampler,
+)
 
 
 class TestGetNameServers(TestCase):
@@ -153,3 +163,139 @@ eth1	000011AC	00000000	0001	0	0	0	0000FFFF	0	0	0
         """
         self._mock_open(route)
         self.assertEqual("", get_gateway_ipv4())
+
+    def test_get_gateway_ipv4_returns_empty_str_for_on_link_routes(self):
+        route = r"""
+Iface	Destination	Gateway 	Flags	RefCnt	Use	Metric	Mask		MTU	Window	IRTT
+tun0	00000000	00000000	0001	0	0	0	00000000	0	0	0
+eth0	00000000	0101A8C0	0003	0	0	600	00000000	0	0	0
+        """
+        self._mock_open(route)
+        with self.assertLogs("vaslam.system", "INFO"):
+            self.assertEqual("", get_gateway_ipv4())
+        routes = get_default_routes_ipv4()
+        self.assertEqual(["", "192.168.1.1"], [r.gateway for r in routes])
+
+    def test_get_default_routes_ipv4_returns_all_default_routes_by_metric(self):
+        route = r"""
+Iface	Destination	Gateway 	Flags	RefCnt	Use	Metric	Mask		MTU	Window	IRTT
+wwan0	00000000	0100000A	0003	0	0	700	00000000	0	0	0
+eth0	00000000	0101A8C0	0003	0	0	100	00000000	0	0	0
+eth0	0001A8C0	00000000	0001	0	0	100	00FFFFFF	0	0	0
+tun0	00000000	00000000	0001	0	0	50	00000000	0	0	0
+        """
+        self._mock_open(route)
+        routes = get_default_routes_ipv4()
+        self.assertEqual(
+            [("tun0", "", 50), ("eth0", "192.168.1.1", 100)],
+            [(r.interface, r.gateway, r.metric) for r in routes[:2]],
+        )
+        self.assertEqual(
+            ("wwan0", "10.0.0.1"), (routes[2].interface, routes[2].gateway)
+        )
+
+    def test_get_default_routes_ipv6_skips_reject_routes(self):
+        route = """\
+fd000000000000000000000000000000 40 00000000000000000000000000000000 00 00000000000000000000000000000000 00000100 00000001 00000000 00000001     eth0
+00000000000000000000000000000000 00 00000000000000000000000000000000 00 fe800000000000000000000000000001 00000400 00000001 00000000 00000003    wlan0
+00000000000000000000000000000000 00 00000000000000000000000000000000 00 fd000000000000000000000000000001 00000100 00000001 00000000 00000003     eth0
+00000000000000000000000000000000 00 00000000000000000000000000000000 00 00000000000000000000000000000000 ffffffff 00000001 00000000 00200200       lo
+"""
+        self._mock_open(route)
+        routes = get_default_routes_ipv6()
+        self.assertEqual(
+            [("eth0", "fd00::1", 256), ("wlan0", "fe80::1%wlan0", 1024)],
+            [(r.interface, r.gateway, r.metric) for r in routes],
+        )
+        self.assertEqual("fd00::1", get_gateway_ipv6())
+
+    def test_get_gateway_ipv6_returns_empty_str_if_no_default_route(self):
+        self._mock_open("")
+        with self.assertLogs("vaslam.system", "DEBUG") as logs:
+            self.assertEqual("", get_gateway_ipv6())
+        self.assertEqual(["DEBUG"], [r.levelname for r in logs.records])
+
+
+_proc_net_dev = """Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo: 1000  10    0    0    0     0          0         0 1000  10    0    0    0     0       0          0
+  eth0: 5000  {rx}    {errs}    2    0     0          0         0 3000  40    0    0    0     0       0          0
+ wlan0: 2000  20    0    0    0     0          0         0 1000  10    1    0    0     0       0          0
+"""
+
+_proc_net_snmp = """Icmp: InMsgs InErrors InCsumErrors InDestUnreachs
+Icmp: 5 0 0 3
+Tcp: RtoAlgorithm RtoMin RtoMax MaxConn ActiveOpens PassiveOpens AttemptFails EstabResets CurrEstab InSegs OutSegs RetransSegs InErrs OutRsts InCsumErrors
+Tcp: 1 200 120000 -1 10 10 0 0 2 500 {out} {retrans} 0 0 0
+Udp: InDatagrams NoPorts InErrors OutDatagrams RcvbufErrors SndbufErrors InCsumErrors IgnoredMulti MemErrors
+Udp: 20 0 1 20 1 0 0 0 0
+"""
+
+
+class TestCounterSampler(TestCase):
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.dev_path = path.join(tmp_dir.name, "dev")
+        self.snmp_path = path.join(tmp_dir.name, "snmp")
+        self._write(rx=30, errs=0, out=400, retrans=2)
+
+    def _write(self, **counters):
+        with open(self.dev_path, "wt") as fh:
+            fh.write(_proc_net_dev.format(**counters))
+        with open(self.snmp_path, "wt") as fh:
+            fh.write(_proc_net_snmp.format(**counters))
+
+    def test_counter_sampler_reads_counters_excluding_loopback(self):
+        with CounterSampler(("lo",), self.dev_path, self.snmp_path) as sampler:
+            counters = sampler.read()
+        self.assertEqual(50, counters.rx_packets)
+        self.assertEqual(50, counters.tx_packets)
+        self.assertEqual(2, counters.rx_dropped)
+        self.assertEqual(1, counters.interface_errors)
+        self.assertEqual(400, counters.tcp_out_segs)
+        self.assertEqual(2, counters.tcp_retrans_segs)
+        self.assertEqual(1, counters.udp_rcvbuf_errors)
+        self.assertEqual(3, counters.icmp_in_dest_unreachs)
+        self.assertGreater(counters.sampled, 0)
+
+    def test_counter_sampler_rereads_open_files_for_deltas(self):
+        with CounterSampler(("lo",), self.dev_path, self.snmp_path) as sampler:
+            first = sampler.read()
+            self._write(rx=130, errs=3, out=1400, retrans=102)
+            delta = sampler.read().delta(first)
+        self.assertEqual(100, delta.rx_packets)
+        self.assertEqual(3, delta.interface_errors)
+        self.assertEqual(0, delta.tx_packets)
+        self.assertEqual(1000, delta.tcp_out_segs)
+        self.assertEqual(10.0, delta.retransmit_pct)
+        self.assertGreater(delta.interval, 0)
+
+
+_proc_net_route = """Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask
+eth0\t00000000\t{gateway}\t0003\t0\t{use}\t100\t00000000
+eth0\t0000A8C0\t00000000\t0001\t0\t{use}\t100\t00FFFFFF
+"""
+
+
+class TestRouteSampler(TestCase):
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.route_path = path.join(tmp_dir.name, "route")
+        self.ipv6_route_path = path.join(tmp_dir.name, "ipv6_route")
+
+    def _write(self, gateway, use):
+        with open(self.route_path, "wt") as fh:
+            fh.write(_proc_net_route.format(gateway=gateway, use=use))
+
+    def test_route_sampler_rereads_default_routes(self):
+        self._write("0101A8C0", 10)
+        # the IPv6 routes file is missing
+        with RouteSampler(self.route_path, self.ipv6_route_path) as sampler:
+            routes = sampler.read()
+            self.assertEqual(((b"eth0", b"0101A8C0", b"0003", b"100"),), routes)
+            self._write("0101A8C0", 2000)
+            self.assertEqual(routes, sampler.read())
+            self._write("FE01A8C0", 2000)
+            self.assertNotEqual(routes, sampler.read())
@@ -0,0 +1,67 @@
+import socket
+from socketserver import BaseRequestHandler, ThreadingTCPServer
+from threading import Thread
+from unittest import TestCase
+from vaslam.net import ConnectionError
+from vaslam.sim import BulkHttpServer, Impairment
+from vaslam.throughput import measure_throughput, DOWNLOAD, UPLOAD
+
+
+class _SourceHandler(BaseRequestHandler):
+    def handle(self):
+        data = bytes(16 * 1024)
+        try:
+            while True:
+                self.request.sendall(data)
+        except OSError:
+            pass
+
+
+class TestMeasureThroughput(TestCase):
+    def _bulk_server(self, rate=0.0):
+        server = BulkHttpServer("127.0.0.1", 0, Impairment(), rate)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_measure_throughput_of_rate_limited_http_streams(self):
+        server = self._bulk_server(rate=500000)
+        for direction in (DOWNLOAD, UPLOAD):
+            stats = measure_throughput(
+                direction, server.url, duration=1, streams=2, sample_interval=0.2
+            )
+            self.assertEqual(direction, stats.direction)
+            self.assertEqual(2, stats.streams)
+            self.assertGreaterEqual(len(stats.samples), 4)
+            # 2 streams of 500 KB/s, with some slack for the socket buffers
+            self.assertAlmostEqual(8, stats.goodput_mbps, delta=2.5)
+            self.assertGreater(stats.bytes, 600000)
+
+    def test_measure_throughput_of_finished_download(self):
+        server = self._bulk_server()
+        url = server.url + "?bytes=100000"
+        stats = measure_throughput(DOWNLOAD, url, duration=2, streams=3)
+        self.assertEqual(300000, stats.bytes)
+        self.assertGreater(stats.goodput, 0)
+
+    def test_measure_throughput_from_raw_tcp_source(self):
+        server = ThreadingTCPServer(("127.0.0.1", 0), _SourceHandler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = "tcp://127.0.0.1:{}".format(server.server_address[1])
+        stats = measure_throughput(DOWNLOAD, url, duration=0.5, sample_interval=0.1)
+        self.assertEqual(4, stats.streams)
+        self.assertGreater(stats.bytes, 0)
+        self.assertGreater(stats.goodput, 0)
+
+    def test_measure_throughput_raises_connection_error_when_unreachable(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        url = "tcp://127.0.0.1:{}".format(sock.getsockname()[1])
+        sock.close()
+        with self.assertRaises(ConnectionError):
+            measure_throughput(DOWNLOAD, url, duration=0.5, streams=1)
+        with self.assertRaises(ConnectionError):
+            measure_throughput(DOWNLOAD, "ftp://127.0.0.1/", duration=0.5)
@@ -0,0 +1,67 @@
+import ssl
+import socket
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from vaslam.sim import EchoIpHttpServer, Impairment, LOCAL_HOST, self_signed_contexts
+from vaslam.tls import TlsSessions, probe_https
+
+
+class TestProbeHttps(TestCase):
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        try:
+            server_context, self.client_context = self_signed_contexts(tmp_dir.name)
+        except OSError as err:
+            self.skipTest("can not create a certificate: {}".format(err))
+        self.server = EchoIpHttpServer(LOCAL_HOST, 0, Impairment(), server_context)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def test_probe_measures_timings_and_gets_visible_ip(self):
+        stats = probe_https(self.server.url, TlsSessions(self.client_context), 5)
+        self.assertTrue(stats.ok, stats.error)
+        self.assertEqual((200, LOCAL_HOST), (stats.status, stats.ip))
+        self.assertFalse(stats.resumed)
+        self.assertTrue(stats.tls_version.startswith("TLS"))
+        self.assertGreater(stats.connect_time, 0)
+        self.assertGreater(stats.handshake_time, 0)
+        self.assertGreater(stats.first_byte_time, 0)
+        self.assertEqual(stats.handshake_time, stats.full_handshake_time)
+
+    def test_sessions_are_resumed_by_later_probes(self):
+        sessions = TlsSessions(self.client_context)
+        first = probe_https(self.server.url, sessions, 5)
+        self.assertGreater(first.resumed_handshake_time, 0)
+        second = probe_https(self.server.url, sessions, 5)
+        self.assertTrue(second.ok, second.error)
+        self.assertTrue(second.resumed)
+        self.assertEqual(second.handshake_time, second.resumed_handshake_time)
+        self.assertEqual(first.full_handshake_time, second.full_handshake_time)
+
+    def test_untrusted_certificate_is_reported(self):
+        stats = probe_https(self.server.url, TlsSessions(), 5)
+        self.assertFalse(stats.ok)
+        self.assertTrue(stats.cert_error)
+        self.assertIn("certificate", stats.error)
+
+    def test_unreachable_server_is_reported_in_stats(self):
+        with socket.socket() as sock:
+            sock.bind((LOCAL_HOST, 0))
+            url = "https://{}:{}/ip".format(*sock.getsockname())
+        stats = probe_https(url, TlsSessions(self.client_context), 1)
+        self.assertFalse(stats.ok)
+        self.assertFalse(stats.cert_error)
+        self.assertTrue(stats.error)
+
+
+class TestTlsSessions(TestCase):
+    def test_least_recently_used_sessions_are_dropped(self):
+        sessions = TlsSessions(ssl.create_default_context(), max_sessions=2)
+        for port in (1, 2, 3):
+            sessions.put(("192.0.2.1", port), object())
+            sessions.handshake(("192.0.2.1", port), False, 10.0)
+        self.assertIsNone(sessions.get(("192.0.2.1", 1)))
+        self.assertIsNotNone(sessions.get(("192.0.2.1", 3)))
+        self.assertEqual(0, sessions.handshake(("192.0.2.1", 1), False))
+        self.assertEqual(10.0, sessions.handshake(("192.0.2.1", 2), False))
@@ -0,0 +1,49 @@
+import json
+from os import path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from vaslam.trace import Tracer
+
+
+class TestTracer(TestCase):
+    def test_tracer_records_nothing_when_disabled(self):
+        tracer = Tracer()
+        with tracer.span("check", "localhost"):
+            pass
+        self.assertEqual([], list(tracer.spans))
+        self.assertIs(tracer.span("a"), tracer.span("b"))
+
+    def test_tracer_records_spans_as_chrome_trace_events(self):
+        tracer = Tracer()
+        tracer.enable()
+        with tracer.span("check", "localhost"):
+            with tracer.span("attempt"):
+                pass
+        events = tracer.trace_events()
+        self.assertEqual(["attempt", "check"], [e["name"] for e in events])
+        attempt, check = events
+        self.assertEqual("X", check["ph"])
+        self.assertEqual({"target": "localhost"}, check["args"])
+        self.assertNotIn("args", attempt)
+        self.assertGreaterEqual(attempt["ts"], check["ts"])
+        self.assertGreaterEqual(check["dur"], attempt["dur"])
+
+    def test_tracer_keeps_the_latest_spans(self):
+        tracer = Tracer(max_spans=3)
+        tracer.enable()
+        for name in "abcde":
+            with tracer.span(name):
+                pass
+        self.assertEqual(["c", "d", "e"], [e["name"] for e in tracer.trace_events()])
+
+    def test_tracer_writes_trace_event_json(self):
+        tracer = Tracer()
+        tracer.enable()
+        with tracer.span("check"):
+            pass
+        with TemporaryDirectory() as tmp_dir:
+            file_path = path.join(tmp_dir, "trace.json")
+            tracer.write(file_path)
+            with open(file_path) as fh:
+                data = json.load(fh)
+        self.assertEqual(["check"], [e["name"] for e in data["traceEvents"]])
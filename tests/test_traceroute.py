@@ -0,0 +1,58 @@
+from unittest import TestCase
+from vaslam.traceroute import Hop, trace_path, analyze_path
+
+
+def _hop(ttl, address, rtt, loss_pct=0):
+    hop = Hop(ttl)
+    hop.address = address
+    hop.sent = 10
+    hop.rtts = [rtt] * int(10 - loss_pct / 10)
+    return hop
+
+
+class TestTracePath(TestCase):
+    def test_trace_path_to_loopback_reaches_host_in_first_hop(self):
+        hops = trace_path("127.0.0.1", max_hops=5, probes=3, timeout=1)
+        self.assertEqual(1, len(hops))
+        self.assertEqual("127.0.0.1", hops[0].address)
+        self.assertTrue(hops[0].reached)
+        self.assertEqual(3, hops[0].sent)
+        self.assertEqual(3, hops[0].recv)
+        self.assertEqual(0, hops[0].packet_loss_pct)
+
+
+class TestAnalyzePath(TestCase):
+    def test_analyze_path_attributes_latency_to_isp(self):
+        hops = [
+            _hop(1, "192.168.1.1", 2),
+            _hop(2, "100.64.0.1", 150),
+            _hop(3, "203.0.113.1", 155),
+            _hop(4, "198.51.100.1", 160),
+        ]
+        path = analyze_path(hops)
+        self.assertEqual("100.64.0.1", path.isp_edge)
+        self.assertAlmostEqual(148, path.isp_latency)
+        self.assertAlmostEqual(10, path.upstream_latency)
+        self.assertEqual(0, path.isp_packet_loss_pct)
+
+    def test_analyze_path_ignores_latency_and_loss_not_persisting(self):
+        hops = [
+            _hop(1, "192.168.1.1", 2),
+            _hop(2, "100.64.0.1", 10),
+            _hop(3, "203.0.113.1", 300, 50),
+            _hop(4, "198.51.100.1", 200, 20),
+        ]
+        silent = Hop(5)
+        silent.sent = 10
+        hops.append(silent)
+        hops.append(_hop(6, "198.51.100.9", 20, 20))
+        path = analyze_path(hops)
+        self.assertAlmostEqual(8, path.isp_latency)
+        self.assertAlmostEqual(10, path.upstream_latency)
+        self.assertEqual(0, path.isp_packet_loss_pct)
+        self.assertEqual(20, path.upstream_packet_loss_pct)
+
+    def test_analyze_path_without_public_hops_returns_empty_analysis(self):
+        path = analyze_path([_hop(1, "192.168.1.1", 2), Hop(2)])
+        self.assertEqual("", path.isp_edge)
+        self.assertEqual(0, path.isp_latency)
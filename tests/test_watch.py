@@ -0,0 +1,135 @@
+from threading import Event
+from unittest import TestCase
+from unittest.mock import patch
+from vaslam.baseline import BaselineStore
+from vaslam.conf import Conf
+from vaslam.diag import Result, LOCALNET_LATENCY
+from vaslam.system import Route
+from vaslam.diag import Uplink
+from vaslam.watch import AdaptiveInterval, watch
+
+
+class TestWatch(TestCase):
+    def setUp(self):
+        patcher = patch("vaslam.watch.diagnose_network")
+        self.addCleanup(patcher.stop)
+        self.mock_diagnose = patcher.start()
+        self.mock_diagnose.side_effect = lambda *args: Result.new_all_ok()
+
+    def test_watch_diagnoses_each_interval_and_samples_counters_between(self):
+        stop = Event()
+        cycles, samples = [], []
+
+        def _on_result(result, cycle):
+            cycles.append((result, cycle))
+            if len(cycles) == 2:
+                stop.set()
+
+        watch(Conf(), 0.3, _on_result, stop, samples.append, 0.1)
+        self.assertEqual([1, 2], [cycle.counter for _, cycle in cycles])
+        self.assertGreater(cycles[1][0].counters.interval, 0.2)
+        self.assertGreaterEqual(len(samples), 2)
+        self.assertLess(samples[0].interval, 0.2)
+
+    def test_watch_waits_the_adaptive_interval(self):
+        stop = Event()
+        started = []
+
+        def _on_result(result, cycle):
+            started.append(cycle.started)
+            if len(started) == 3:
+                stop.set()
+
+        adaptive = AdaptiveInterval(0.05, 10)
+        watch(Conf(), 60, _on_result, stop, None, 0.1, adaptive)
+        self.assertLess(started[2] - started[0], 0.5)
+        self.assertAlmostEqual(0.4, adaptive.interval)
+
+    def test_watch_diagnoses_right_away_when_routes_change(self):
+        stop = Event()
+        started = []
+
+        def _on_result(result, cycle):
+            started.append(cycle.started)
+            if len(started) == 2:
+                stop.set()
+
+        eth0, wlan0 = ((b"eth0", b"0102000A"),), ((b"wlan0", b"0101A8C0"),)
+        adaptive = AdaptiveInterval(5, 60)
+        with patch("vaslam.watch.RouteSampler") as mock_sampler:
+            # the default route moves to wlan0 while waiting after the first cycle
+            mock_sampler.return_value.read.side_effect = [eth0, eth0, wlan0, wlan0]
+            with self.assertLogs("vaslam.watch", "INFO"):
+                watch(Conf(), 60, _on_result, stop, None, 0.1, adaptive)
+        self.assertLess(started[1] - started[0], 1)
+        self.assertEqual(10, adaptive.interval)
+        self.assertTrue(mock_sampler.return_value.close.called)
+
+    def test_watch_compares_issues_against_the_baselines(self):
+        stop = Event()
+        rtts = [1.0] * 10 + [40.0]
+        cycles = []
+
+        def _diagnose(*args):
+            result = Result.new_all_ok()
+            result.gateway = "192.168.0.1"
+            result.gateway_ping_stats.packets_sent = 5
+            result.gateway_ping_stats.packets_recv = 5
+            result.gateway_ping_stats.rtt_avg = rtts[len(cycles)]
+            return result
+
+        def _on_result(result, cycle):
+            cycles.append(cycle)
+            if len(cycles) == len(rtts):
+                stop.set()
+
+        self.mock_diagnose.side_effect = _diagnose
+        baselines = BaselineStore()
+        watch(Conf(), 0, _on_result, stop, baselines=baselines)
+        self.assertEqual([[]] * 10, [cycle.issues for cycle in cycles[:10]])
+        self.assertEqual([LOCALNET_LATENCY], cycles[10].issues)
+        # the anomalous result doesn't become the baseline
+        self.assertEqual(10, baselines.get("192.168.0.1", "latency").samples)
+
+
+class TestAdaptiveInterval(TestCase):
+    def setUp(self):
+        self.adaptive = AdaptiveInterval(10, 300)
+
+    def _result(self, rtt=20.0):
+        result = Result.new_all_ok()
+        result.gateway, result.internet_host = "192.0.2.1", "198.51.100.1"
+        for stats in (result.gateway_ping_stats, result.internet_ping_stats):
+            stats.packets_sent = stats.packets_recv = 5
+            stats.rtt_avg = rtt
+        return result
+
+    def test_interval_backs_off_while_healthy_up_to_max(self):
+        intervals = [self.adaptive.next(self._result()) for _ in range(7)]
+        self.assertEqual([20, 40, 80, 160, 300, 300, 300], intervals)
+
+    def test_issues_drop_to_min_interval_then_back_off(self):
+        for _ in range(5):
+            self.adaptive.next(self._result())
+        result = self._result()
+        result.http = False
+        self.assertTrue(result.get_issues())
+        self.assertEqual(10, self.adaptive.next(result))
+        self.assertEqual(20, self.adaptive.next(self._result()))
+
+    def test_route_change_drops_to_min_interval(self):
+        for _ in range(5):
+            self.adaptive.next(self._result())
+        result = self._result()
+        result.gateway = "192.0.2.254"
+        self.assertEqual(10, self.adaptive.next(result))
+        result = self._result()
+        result.gateway = "192.0.2.254"
+        result.uplinks = [Uplink(Route("eth1", "192.0.2.254"))]
+        self.assertEqual(10, self.adaptive.next(result))
+
+    def test_rising_latency_drops_to_min_interval(self):
+        for _ in range(5):
+            self.adaptive.next(self._result(20))
+        self.assertEqual(300, self.adaptive.next(self._result(25)))
+        self.assertEqual(10, self.adaptive.next(self._result(60)))
@@ -1,5 +1,8 @@
 import sys
-from os import EX_OK, EX_TEMPFAIL
+import signal
+from time import time, strftime, localtime
+from threading import Thread, Event
+from os import EX_OK, EX_TEMPFAIL, EX_UNAVAILABLE
 from logging import (
     INFO,
     DEBUG,
@@ -11,19 +14,45 @@ from logging import (
     FileHandler,
 )
 from argparse import ArgumentParser
-from vaslam.conf import default_conf
-from vaslam.diag import diagnose_network, issue_message
+from vaslam.issues import issue_message
+from vaslam.status import StatusWriter, read_status
+from vaslam.trace import tracer, span
+from vaslam.recorder import recorder
 from vaslam import __summary__, __version__
 
+# network modules are imported by the commands using them, so reading
+# the published status doesn't load them
+
 
 logger = getLogger("vaslam")
 
+# seconds between saving the baselines while watching
+BASELINES_SAVE_INTERVAL = 300  # type: float
+
 
 def _parse_args(args=None):
     parser = ArgumentParser(prog="vaslam", description=__summary__)
     parser.add_argument(
         "--version", action="version", version="%(prog)s {}".format(__version__)
     )
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="diagnose",
+        choices=[
+            "diagnose",
+            "dns-bench",
+            "watch",
+            "status",
+            "serve",
+            "collect",
+            "history",
+        ],
+        help="diagnose the connection (default), benchmark name servers, "
+        "keep diagnosing and publish the status, show the published status, "
+        "serve diagnosis to local processes, collect results of agents, "
+        "or show the trend of the history",
+    )
     parser.add_argument(
         "-q", "--quiet", action="store_true", help="no output, just exit code"
     )
@@ -31,7 +60,220 @@ def _parse_args(args=None):
         "-d", "--debug", action="store_true", help="log debug information"
     )
     parser.add_argument("-l", "--log", help="log to file")
-    return parser.parse_args(args)
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        help="file to keep per target latency and packet loss baselines",
+    )
+    parser.add_argument(
+        "--history",
+        metavar="FILE",
+        help="file to keep the history of results, rolled up over time",
+    )
+    parser.add_argument(
+        "--days",
+        type=float,
+        default=1,
+        help="days of history to show the trend of",
+    )
+    parser.add_argument(
+        "-t",
+        "--trace",
+        metavar="FILE",
+        help="write Chrome trace events of the checks to file",
+    )
+    parser.add_argument(
+        "-f",
+        "--flight-recorder",
+        metavar="FILE",
+        help="keep recent probe events in memory, dump to file on issues or signals",
+    )
+    parser.add_argument(
+        "-c",
+        "--capture",
+        metavar="FILE",
+        help="append raw observations of the probes to file for replay",
+    )
+    parser.add_argument(
+        "-r",
+        "--replay",
+        metavar="FILE",
+        help="diagnose again from captured observations in file, offline",
+    )
+    parser.add_argument(
+        "-m",
+        "--measure-dns",
+        metavar="DOMAIN",
+        help="measure uncached and cached resolution of names in the domain",
+    )
+    parser.add_argument(
+        "-u",
+        "--uplinks",
+        action="store_true",
+        help="diagnose all the uplinks (default routes) concurrently",
+    )
+    parser.add_argument(
+        "-p",
+        "--path",
+        action="store_true",
+        help="trace the path to the Internet, to find the hops adding latency",
+    )
+    parser.add_argument(
+        "--mtu",
+        action="store_true",
+        help="find the path MTU to the gateway and the Internet, to detect blackholes",
+    )
+    parser.add_argument(
+        "--https",
+        action="store_true",
+        help="time the TLS handshakes to the HTTPS echo services, and resumption",
+    )
+    parser.add_argument(
+        "--download",
+        metavar="URL",
+        help="measure download throughput from HTTP or tcp://host:port URL",
+    )
+    parser.add_argument(
+        "--upload",
+        metavar="URL",
+        help="measure upload throughput to HTTP or tcp://host:port URL",
+    )
+    parser.add_argument(
+        "--dns-transport",
+        metavar="URI",
+        action="append",
+        help="also query tcp://HOST[:PORT], tls://HOST[:PORT] or https:// DoH URL",
+    )
+    parser.add_argument(
+        "--capacity",
+        metavar="HOST:PORT",
+        help="estimate path capacity with packet trains to this UDP echo service",
+    )
+    parser.add_argument(
+        "-4",
+        "--ipv4-only",
+        action="store_true",
+        help="skip the IPv6 checks, even if there is an IPv6 default route",
+    )
+    parser.add_argument(
+        "--probe-rate",
+        type=float,
+        default=0,
+        help="max probes per second, all destinations (default unlimited)",
+    )
+    parser.add_argument(
+        "--destination-rate",
+        type=float,
+        default=0,
+        help="max probes per second to each destination (default unlimited)",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=0,
+        help="max probes in flight at the same time (default unlimited)",
+    )
+    parser.add_argument(
+        "--probe-jitter",
+        type=float,
+        default=0,
+        help="max random seconds to delay the start of each probe",
+    )
+    parser.add_argument(
+        "-e",
+        "--exporter",
+        metavar="[HOST:]PORT",
+        help="keep diagnosing and serve Prometheus metrics on this address",
+    )
+    parser.add_argument(
+        "-s",
+        "--status-file",
+        metavar="FILE",
+        help="file to publish the status to, or read it from",
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="Unix socket of the diagnosis service",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=10,
+        help="seconds old a result of the diagnosis service can be",
+    )
+    parser.add_argument(
+        "--collector",
+        metavar="ADDR",
+        help="send results to the collector on [HOST:]PORT or Unix socket path",
+    )
+    parser.add_argument(
+        "--site",
+        default="",
+        help="site of the agent for the collector, the visible IPv4 by default",
+    )
+    parser.add_argument(
+        "--listen",
+        metavar="ADDR",
+        action="append",
+        help="[HOST:]PORT or Unix socket path to collect results on, repeatable",
+    )
+    parser.add_argument(
+        "--hook",
+        metavar="CMD",
+        action="append",
+        help="command to run on changes of the network state, repeatable",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=int,
+        default=2,
+        help="cycles a change should persist before running the hooks",
+    )
+    parser.add_argument(
+        "--clear-after",
+        type=int,
+        default=3,
+        help="cycles an issue should be gone before it's cleared",
+    )
+    parser.add_argument(
+        "-i",
+        "--interval",
+        type=float,
+        default=60,
+        help="seconds between diagnosis when running continuously",
+    )
+    parser.add_argument(
+        "--max-interval",
+        type=float,
+        default=0,
+        help="back off up to these seconds between diagnosis while healthy",
+    )
+    opts = parser.parse_args(args)
+    if opts.capacity and not _capacity_address(opts.capacity)[1]:
+        parser.error(
+            "argument --capacity: invalid HOST:PORT {!r}, IPv6 hosts are in "
+            "brackets as in [::1]:7".format(opts.capacity)
+        )
+    return opts
+
+
+def _capacity_address(address: str):
+    """Return the host and port of the capacity probe address, or an empty
+    host and a zero port if it's invalid
+    """
+    from vaslam.exporter import split_address
+
+    try:
+        host, port = split_address(address)
+    except ValueError:
+        return "", 0
+    if not host or not 0 < port < 65536:
+        return "", 0
+    # bare IPv6 addresses can't be told apart from their port
+    if ":" in host and not address.startswith("["):
+        return "", 0
+    return host, port
 
 
 def _diag_prog(total: int, step: int) -> None:
@@ -48,6 +290,321 @@ def _diag_prog(total: int, step: int) -> None:
         print("")  # print new line
 
 
+def _print_path(hops) -> None:
+    print("{:<4} {:<40} {:>10} {:>6}".format("hop", "address", "rtt ms", "loss%"))
+    for hop in hops:
+        print(
+            "{:<4} {:<40} {:>10.2f} {:>6}".format(
+                hop.ttl, hop.address or "*", hop.rtt_avg, hop.packet_loss_pct
+            )
+        )
+
+
+def _print_mtu(all_stats) -> None:
+    for stats in all_stats:
+        if not stats.ok:
+            print("path MTU to {} unknown: {}".format(stats.host, stats.error))
+            continue
+        print(
+            "path MTU to {} is {} bytes{}".format(
+                stats.host,
+                stats.mtu,
+                " (blackhole, bigger packets are lost)" if stats.blackhole else "",
+            )
+        )
+
+
+def _print_uplinks(uplinks) -> None:
+    for uplink in uplinks:
+        issues = uplink.result.get_issues()
+        print(
+            "uplink {} via {}: {}".format(
+                uplink.route.interface,
+                uplink.route.gateway or "-",
+                ", ".join(issue_message(i) for i in issues) if issues else "OK",
+            )
+        )
+
+
+def _print_families(result) -> None:
+    for family, address, works in (
+        ("IPv4", result.ipv4, result.works),
+        ("IPv6", result.ipv6, result.ipv6_result.works),
+    ):
+        print("{}: {}".format(family, address or ("OK" if works else "unreachable")))
+
+
+def _print_dns_transports(transports) -> None:
+    for stats in transports:
+        if not stats.ok:
+            print("{} failed: {}".format(stats.server, stats.error))
+            continue
+        print(
+            "{} query {:.2f} ms, connect {:.2f} ms, handshake {:.2f} ms{}".format(
+                stats.server,
+                stats.query_time,
+                stats.connect_time,
+                stats.handshake_time,
+                " (reused)" if stats.reused else "",
+            )
+        )
+
+
+def _print_https(stats) -> None:
+    if not stats.ok:
+        print("{} failed: {}".format(stats.url, stats.error))
+        return
+    print(
+        "{} connect {:.2f} ms, {} {} handshake {:.2f} ms, first byte {:.2f} ms".format(
+            stats.url,
+            stats.connect_time,
+            stats.tls_version,
+            "resumed" if stats.resumed else "full",
+            stats.handshake_time,
+            stats.first_byte_time,
+        )
+    )
+    print(
+        "TLS handshake full {:.2f} ms, resumed {:.2f} ms".format(
+            stats.full_handshake_time, stats.resumed_handshake_time
+        )
+    )
+
+
+def _print_throughput(*all_stats) -> None:
+    for stats in all_stats:
+        if stats.bytes > 0:
+            print(
+                "{} {:.2f} Mbit/s, ramp-up {:.1f} seconds".format(
+                    stats.direction, stats.goodput_mbps, stats.ramp_up
+                )
+            )
+
+
+def _load_baselines(file_path: str):
+    from vaslam.baseline import BaselineStore
+
+    if not file_path:
+        return None
+    baselines = BaselineStore(file_path)
+    baselines.load()
+    return baselines
+
+
+def _load_history(file_path: str):
+    from vaslam.history import HistoryStore
+
+    if not file_path:
+        return None
+    history = HistoryStore(file_path)
+    history.load()
+    return history
+
+
+def _run_history(file_path: str, days: float, quiet: bool) -> int:
+    from vaslam.history import GATEWAY, INTERNET, DAY
+
+    history = _load_history(file_path)
+    if history is None:
+        if not quiet:
+            print("No history is kept, use --history FILE")
+        return EX_UNAVAILABLE
+    end = time()
+    trend = history.trend(end - days * DAY, end)
+    if quiet:
+        return EX_OK
+    for bucket in trend:
+        if not bucket.count:
+            continue
+        print(
+            "{} {:>5} results, gateway {:.1f}% loss, Internet {:.1f}% loss, "
+            "p50 {:.2f} ms p95 {:.2f} ms".format(
+                strftime("%Y-%m-%d %H:%M", localtime(bucket.start)),
+                bucket.count,
+                bucket.packet_loss_pct(GATEWAY),
+                bucket.packet_loss_pct(INTERNET),
+                bucket.quantile(INTERNET, 0.5),
+                bucket.quantile(INTERNET, 0.95),
+            )
+        )
+        for issue, count in sorted(bucket.issues.items()):
+            print("  {} x {}".format(issue_message(issue) or "Unknown issue", count))
+    return EX_OK
+
+
+def _enable_flight_recorder(file_path: str) -> None:
+    recorder.enable()
+
+    def _dump_on_signal(signum, frame):
+        recorder.dump(file_path)
+        if signum != signal.SIGUSR1:
+            sys.exit(128 + signum)
+
+    for signum in (signal.SIGUSR1, signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, _dump_on_signal)
+
+
+def _new_status_writer(file_path: str):
+    try:
+        return StatusWriter(file_path)
+    except OSError as err:
+        logger.warning("can not publish the status: {}".format(err))
+        return None
+
+
+def _run_watch(conf, opts) -> int:
+    from vaslam.watch import AdaptiveInterval, watch
+    from vaslam.exporter import Metrics, new_server, split_address
+
+    writer = _new_status_writer(opts.status_file or "")
+    history = _load_history(opts.history or "")
+    baselines = _load_baselines(opts.baseline or "")
+    baselines_saved = time()
+    sender = None
+    if opts.collector:
+        from socket import gethostname
+        from vaslam.collector import RecordSender, agent_record
+        from vaslam.net import ConnectionError
+
+        sender = RecordSender(opts.collector)
+    tracker, runner = None, None
+    if opts.hook:
+        from vaslam.hooks import HookRunner, TransitionTracker
+
+        tracker = TransitionTracker(opts.debounce, opts.clear_after)
+        runner = HookRunner(opts.hook)
+        runner.start()
+    metrics, server = None, None
+    if opts.exporter:
+        host, port = split_address(opts.exporter)
+        metrics = Metrics()
+        server = new_server(metrics, host, port)
+        Thread(target=server.serve_forever, daemon=True).start()
+        logger.info("serving metrics on {}".format(opts.exporter))
+
+    def _on_result(result, cycle):
+        nonlocal baselines_saved
+        if writer:
+            writer.publish(result, cycle.counter, cycle.issues)
+        if metrics:
+            metrics.update(result, cycle, cycle.issues)
+        if history:
+            history.add(result, cycle.started, cycle.issues)
+            history.save(cycle.started)
+        if baselines and cycle.started - baselines_saved >= BASELINES_SAVE_INTERVAL:
+            baselines.save()
+            baselines_saved = cycle.started
+        if sender:
+            try:
+                sender.send(
+                    agent_record(gethostname(), result, cycle.issues, opts.site)
+                )
+            except ConnectionError as err:
+                logger.warning("{}".format(err))
+        if tracker:
+            runner.dispatch(tracker.update(result, cycle.issues))
+        if opts.flight_recorder and cycle.issues:
+            recorder.dump(opts.flight_recorder)
+
+    try:
+        watch(
+            conf,
+            opts.interval,
+            _on_result,
+            Event(),
+            metrics.update_counters if metrics else None,
+            adaptive=(
+                AdaptiveInterval(opts.interval, opts.max_interval)
+                if opts.max_interval > opts.interval
+                else None
+            ),
+            baselines=baselines,
+        )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server:
+            server.shutdown()
+        if baselines:
+            baselines.save()
+        if history:
+            history.snapshot()
+        if writer:
+            writer.close()
+        if sender:
+            sender.close()
+        if runner:
+            runner.stop()
+    return EX_OK
+
+
+def _run_collector(addresses, interval: float) -> int:
+    from vaslam.collector import Collector, CollectorServer
+
+    collector = Collector(window=max(30, interval * 3))
+    server = CollectorServer(collector, addresses)
+    stop = Event()
+    serve_thread = Thread(target=server.serve, args=(stop,))
+    serve_thread.start()
+    logger.info("collecting results on {}".format(", ".join(addresses)))
+    try:
+        while not stop.wait(interval):
+            faults = collector.attribute()
+            print(
+                "{}: {} agents, {} shared faults".format(
+                    strftime("%Y-%m-%d %H:%M:%S"), collector.agents, len(faults)
+                )
+            )
+            for fault in faults:
+                print(
+                    "  {} {}: {} ({}/{} agents)".format(
+                        fault.kind,
+                        fault.key,
+                        issue_message(fault.issue) or "Unknown issue",
+                        fault.affected,
+                        fault.agents,
+                    )
+                )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        serve_thread.join()
+        server.close()
+    return EX_OK
+
+
+def _run_status(file_path: str, quiet: bool) -> int:
+    try:
+        status = read_status(file_path)
+    except (OSError, ValueError) as err:
+        logger.debug("can not read the status: {}".format(err))
+        status = None
+    if status is None:
+        if not quiet:
+            print("No status is published, is vaslam watch running?")
+        return EX_UNAVAILABLE
+    if not quiet:
+        print(
+            "{} (cycle {}, {:.0f} seconds ago)".format(
+                strftime("%Y-%m-%d %H:%M:%S", localtime(status.updated)),
+                status.cycle,
+                status.age,
+            )
+        )
+        print(
+            "gateway {:.2f} ms {:.0f}% loss, Internet {:.2f} ms {:.0f}% loss".format(
+                status.gateway_rtt,
+                status.gateway_packet_loss_pct,
+                status.internet_rtt,
+                status.internet_packet_loss_pct,
+            )
+        )
+        for issue in status.issues:
+            print(issue_message(issue) or "Unknown issue")
+    return EX_TEMPFAIL if status.issues else EX_OK
+
+
 def main(args=None) -> int:
     opts = _parse_args(args)
     logger.setLevel(DEBUG)  # level is set per handler
@@ -63,11 +620,229 @@ def main(args=None) -> int:
             Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
         )
         logger.addHandler(file_handler)
-    observer = None if opts.quiet else _diag_prog
+    if opts.trace:
+        tracer.enable()
+    try:
+        return _run(opts)
+    finally:
+        if opts.trace:
+            tracer.write(opts.trace)
+
+
+def _run_replay(file_path: str, baselines) -> int:
+    from vaslam.replay import load_captures, replay
+
+    for capture in load_captures(file_path):
+        result = replay(capture)
+        issues = result.get_issues(baselines)
+        if baselines:
+            result.update_baselines(baselines)
+        messages = [issue_message(i) or "Unknown issue" for i in issues]
+        print(
+            "{}: {}".format(
+                strftime("%Y-%m-%d %H:%M:%S", localtime(capture.started)),
+                "; ".join(messages) or "no issues",
+            )
+        )
+    return EX_OK
+
+
+def _run_dns_bench(conf, quiet: bool) -> int:
+    from vaslam.dnsbench import bench_resolvers, slow_system_resolver
+
+    ranked = bench_resolvers(
+        conf.name_servers,
+        conf.ipv4_default_name_servers,
+        conf.hostnames,
+        timeout=conf.resolver_timeout,
+    )
+    slow_system = slow_system_resolver(ranked)
+    if not quiet:
+        print(
+            "{:<4} {:<40} {:<7} {:>10} {:>10} {:>9} {:>9}".format(
+                "rank",
+                "name server",
+                "source",
+                "median ms",
+                "p90 ms",
+                "timeouts",
+                "incorrect",
+            )
+        )
+        for rank, stats in enumerate(ranked, 1):
+            print(
+                "{:<4} {:<40} {:<7} {:>10.2f} {:>10.2f} {:>9} {:>9}".format(
+                    rank,
+                    stats.name_server,
+                    stats.source,
+                    stats.median,
+                    stats.percentile(90),
+                    stats.timeouts,
+                    stats.incorrect,
+                )
+            )
+        if slow_system:
+            print(
+                "System name server is much slower than {}, consider using it".format(
+                    ranked[0].name_server
+                )
+            )
+    if slow_system or not ranked or ranked[0].error_rate > 0.2:
+        return EX_TEMPFAIL
+    return EX_OK
+
+
+def _run_service(conf, socket_path: str) -> int:
+    from vaslam.service import DiagnosisService, ServiceServer
+
+    server = ServiceServer(DiagnosisService(conf), socket_path)
+    logger.info("serving diagnosis on {}".format(server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return EX_OK
+
+
+def _request_service(opts):
+    """Return the result from the diagnosis service if it's running, and the
+    diagnosis doesn't need options the service is not configured with.
+    """
+    from vaslam.service import request_diagnosis
+    from vaslam.net import ConnectionError
+
+    if (
+        opts.uplinks
+        or opts.capture
+        or opts.path
+        or opts.mtu
+        or opts.https
+        or opts.download
+        or opts.upload
+        or opts.capacity
+        or opts.measure_dns
+        or opts.ipv4_only
+        or opts.dns_transport
+    ):
+        return None
+    try:
+        result, age = request_diagnosis(opts.max_age, opts.socket or "")
+    except ConnectionError as err:
+        logger.debug("diagnosing without the service: {}".format(err))
+        return None
+    logger.debug("got diagnosis from the service, {:.1f} seconds old".format(age))
+    return result
+
+
+def _run(opts) -> int:
+    if opts.command == "status":
+        return _run_status(opts.status_file or "", opts.quiet)
+    if opts.command == "collect":
+        return _run_collector(opts.listen or ["8470"], opts.interval)
+    if opts.command == "history":
+        return _run_history(opts.history or "", opts.days, opts.quiet)
+
+    from vaslam.conf import default_conf, default_https_echo_urls
+    from vaslam.diag import diagnose_network, diagnose_uplinks
+    from vaslam.system import get_default_routes_ipv4
+    from vaslam.replay import capture_diagnosis, save_capture
+
+    if opts.replay:
+        return _run_replay(opts.replay, _load_baselines(opts.baseline))
+    result = _request_service(opts) if opts.command == "diagnose" else None
+    if result is not None:
+        return _report(result, opts)
+    if opts.flight_recorder:
+        _enable_flight_recorder(opts.flight_recorder)
+    _configure_scheduler(opts)
     conf = default_conf()
-    result = diagnose_network(conf, observer)
-    issues = result.get_issues()
+    if opts.measure_dns:
+        conf.dns_measure_domain = opts.measure_dns
+    conf.trace_path = opts.path
+    conf.path_mtu = opts.mtu
+    if opts.https:
+        conf.https_echo_urls = default_https_echo_urls
+    if opts.ipv4_only:
+        conf.ipv6 = False
+    conf.dns_transports = opts.dns_transport or []
+    conf.throughput_download_url = opts.download or ""
+    conf.throughput_upload_url = opts.upload or ""
+    if opts.capacity:
+        conf.capacity_host, conf.capacity_port = _capacity_address(opts.capacity)
+    if opts.command == "dns-bench":
+        return _run_dns_bench(conf, opts.quiet)
+    if opts.exporter or opts.command == "watch":
+        return _run_watch(conf, opts)
+    if opts.command == "serve":
+        return _run_service(conf, opts.socket or "")
+    observer = None if opts.quiet else _diag_prog
+    with span("diagnose_network"):
+        if opts.uplinks:
+            result = diagnose_uplinks(conf, get_default_routes_ipv4(), observer)
+        elif opts.capture:
+            result, capture = capture_diagnosis(conf, observer)
+            save_capture(capture, opts.capture)
+        else:
+            result = diagnose_network(conf, observer)
+    return _report(result, opts)
+
+
+def _configure_scheduler(opts) -> None:
+    from vaslam.scheduler import scheduler
+
+    # allow bursts of a second worth of probes
+    scheduler.configure(
+        rate=opts.probe_rate,
+        burst=max(1.0, opts.probe_rate),
+        destination_rate=opts.destination_rate,
+        destination_burst=max(1.0, opts.destination_rate),
+        max_in_flight=opts.max_in_flight,
+        jitter=opts.probe_jitter,
+    )
+
+
+def _report(result, opts) -> int:
+    if result.path_hops and not opts.quiet:
+        _print_path(result.path_hops)
+    if result.mtu_stats and not opts.quiet:
+        _print_mtu(result.mtu_stats)
+    if result.uplinks and not opts.quiet:
+        _print_uplinks(result.uplinks)
+    if result.ipv6_result is not None and not opts.quiet:
+        _print_families(result)
+    if result.dns_transports and not opts.quiet:
+        _print_dns_transports(result.dns_transports)
+    if result.https_stats.url and not opts.quiet:
+        _print_https(result.https_stats)
+    if not opts.quiet:
+        _print_throughput(result.download_stats, result.upload_stats)
+        if result.capacity_stats.capacity:
+            print(
+                "capacity {:.2f} Mbit/s, queueing delay {:.2f} ms".format(
+                    result.capacity_stats.capacity_mbps,
+                    result.capacity_stats.queueing_delay,
+                )
+            )
+        if result.scheduler_wait:
+            print(
+                "probes waited {:.2f} ms for the scheduler".format(
+                    result.scheduler_wait
+                )
+            )
+    baselines = _load_baselines(opts.baseline)
+    issues = result.get_issues(baselines)
+    if baselines:
+        result.update_baselines(baselines)
+        baselines.save()
+    history = _load_history(opts.history or "")
+    if history:
+        history.add(result)
+        history.save()
     if issues:
+        if opts.flight_recorder:
+            recorder.dump(opts.flight_recorder)
         for issue in issues:
             print(issue_message(issue) or "Unknown issue")
         return EX_TEMPFAIL
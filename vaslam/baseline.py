@@ -0,0 +1,143 @@
+"""
+vaslam.baseline
+===============
+
+adaptive per-target baselines for latency and packet loss
+"""
+import json
+from os import path, replace
+from logging import getLogger
+from typing import Dict, Tuple
+
+
+logger = getLogger(__name__)
+
+LATENCY = "latency"  # type: str
+PACKET_LOSS = "packet_loss"  # type: str
+
+
+class Baseline:
+    """Exponentially weighted moving average and variance of a metric.
+    Updates are O(1) in time and memory.
+    """
+
+    def __init__(self, alpha: float = 0.1):
+        self.alpha = alpha  # type: float
+        self.mean = 0.0  # type: float
+        self.var = 0.0  # type: float
+        self.samples = 0  # type: int
+
+    def update(self, value: float) -> None:
+        if self.samples == 0:
+            self.mean = float(value)
+            self.var = 0.0
+        else:
+            diff = value - self.mean
+            incr = self.alpha * diff
+            self.mean += incr
+            self.var = (1 - self.alpha) * (self.var + diff * incr)
+        self.samples += 1
+
+    @property
+    def std(self) -> float:
+        return self.var**0.5
+
+    def is_anomalous(
+        self,
+        value: float,
+        sigmas: float = 4.0,
+        min_delta: float = 0.0,
+        min_ratio: float = 1.0,
+        min_samples: int = 5,
+    ) -> bool:
+        """Return True if value is unusually higher than the baseline.
+        The value has to be more than sigmas standard deviations, at least
+        min_delta units and min_ratio times above the mean. Baselines with less
+        than min_samples samples are still learning and never report anomalies.
+        """
+        if self.samples < min_samples:
+            return False
+        delta = value - self.mean
+        if delta < min_delta or delta <= sigmas * self.std:
+            return False
+        return value >= self.mean * min_ratio
+
+
+class BaselineStore:
+    """Baselines of latency and packet loss, per target.
+    Persisted as a JSON file between runs if a path is provided.
+    """
+
+    latency_sigmas = 4.0
+    latency_min_delta = 5.0  # milliseconds
+    latency_min_ratio = 2.0
+    packet_loss_sigmas = 4.0
+    packet_loss_min_delta = 3.0  # percent
+
+    def __init__(self, file_path: str = "", alpha: float = 0.1):
+        self.path = file_path  # type: str
+        self.alpha = alpha  # type: float
+        self.baselines = {}  # type: Dict[Tuple[str, str], Baseline]
+
+    def get(self, target: str, metric: str) -> Baseline:
+        key = (target, metric)
+        if key not in self.baselines:
+            self.baselines[key] = Baseline(self.alpha)
+        return self.baselines[key]
+
+    def update(self, target: str, latency: float, packet_loss: float) -> None:
+        if not target:
+            return
+        self.get(target, LATENCY).update(latency)
+        self.get(target, PACKET_LOSS).update(packet_loss)
+
+    def latency_anomalous(self, target: str, latency: float) -> bool:
+        if (target, LATENCY) not in self.baselines:
+            return False
+        return self.baselines[(target, LATENCY)].is_anomalous(
+            latency,
+            self.latency_sigmas,
+            self.latency_min_delta,
+            self.latency_min_ratio,
+        )
+
+    def packet_loss_anomalous(self, target: str, packet_loss: float) -> bool:
+        if (target, PACKET_LOSS) not in self.baselines:
+            return False
+        return self.baselines[(target, PACKET_LOSS)].is_anomalous(
+            packet_loss, self.packet_loss_sigmas, self.packet_loss_min_delta
+        )
+
+    def load(self) -> None:
+        """Load baselines from the file. Missing or invalid files are ignored"""
+        if not self.path or not path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "rt") as fh:
+                data = json.load(fh)
+            for target, metrics in data.items():
+                for metric, (mean, var, samples) in metrics.items():
+                    baseline = self.get(target, metric)
+                    baseline.mean, baseline.var = float(mean), float(var)
+                    baseline.samples = int(samples)
+        except (OSError, ValueError, TypeError, AttributeError) as err:
+            logger.warning(
+                "ignoring invalid baselines in {}: {}".format(self.path, err)
+            )
+            self.baselines = {}
+
+    def save(self) -> None:
+        """Save baselines to the file, replacing it atomically"""
+        if not self.path:
+            return
+        data = {}  # type: Dict[str, Dict[str, list]]
+        for (target, metric), baseline in self.baselines.items():
+            data.setdefault(target, {})[metric] = [
+                baseline.mean,
+                baseline.var,
+                baseline.samples,
+            ]
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "wt") as fh:
+            json.dump(data, fh)
+        replace(tmp_path, self.path)
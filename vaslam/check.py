@@ -1,35 +1,73 @@
+import socket
 from time import time
+from ipaddress import ip_address
 from logging import getLogger
 from threading import Event
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
 from vaslam.net import (
     ping_host,
+    udp_ping_host,
+    probe_capacity,
     resolve_any_hostname,
     http_get,
     PingStats,
+    CapacityStats,
     ConnectionError,
     HttpConError,
 )
+from vaslam.trace import span
+from vaslam.scheduler import scheduler
+from vaslam.dns import resolve_any_hostname as resolve_with_name_server
+from vaslam.dns import DnsCache, TYPE_A, TYPE_AAAA, measure_resolver
+from vaslam.dnstransport import DnsTransport, TransportStats, query_transport
+from vaslam.tls import HttpsStats, TlsSessions, probe_https
+from vaslam.traceroute import trace_path, Hop
+from vaslam.pmtu import MtuStats, probe_path_mtu
+from vaslam.throughput import measure_throughput, ThroughputStats
 
 
 logger = getLogger(__name__)
 
 
-def check_dns(hostnames: List[str], stop: Event = None) -> Tuple[str, str, float, str]:
-    """Check DNS by resolving the IPv4 of the hostnames.
+def check_dns(
+    hostnames: List[str],
+    stop: Optional[Event] = None,
+    name_server: str = "",
+    port: int = 53,
+    timeout: float = 5,
+    cache: Optional[DnsCache] = None,
+    family: int = socket.AF_INET,
+) -> Tuple[str, str, float, str]:
+    """Check DNS by resolving the IPv4 (or IPv6 for AF_INET6 family)
+    of the hostnames.
+    Uses the system resolver, or queries the name server on the port if specified,
+    waiting up to timeout seconds for each query.
+    Names are always resolved, and the answers are stored in the cache if provided.
     Return a tuple of info of:
         - the first resolved hostname
         - the resolved address
         - miliseconds that took to resolve
-        - IP address of the resolver (currently empty until implemented)
+        - IP address of the resolver (empty for the system resolver)
     Returns empty strings and zero numerics if none could be resolved.
     """
+    type_ = TYPE_AAAA if family == socket.AF_INET6 else TYPE_A
     for hostname in hostnames:
         if stop and stop.is_set():
             logger.debug("stopping resovling hostnames due to stop event")
             break
         logger.debug("resovling hostname: {}".format(hostname))
-        host, addr, dur, res = resolve_any_hostname([hostname])
+        with span("check_dns.attempt", hostname):
+            if name_server:
+                host, addr, dur, res = resolve_with_name_server(
+                    [hostname], name_server, port, timeout, cache, type_
+                )
+            elif family == socket.AF_INET6:
+                host, addr, dur, res = resolve_any_hostname([hostname], family)
+            else:
+                host, addr, dur, res = resolve_any_hostname([hostname])
+            if not name_server and cache is not None and addr:
+                cache.put(host, type_, [addr], cache.default_ttl)
         if host and addr:
             logger.info(
                 "hostname {} resolved to address {} after {:.2f} milliseconds".format(
@@ -41,11 +79,29 @@ def check_dns(hostnames: List[str], stop: Event = None) -> Tuple[str, str, float
     return "", "", 0, ""
 
 
-def check_ping_ipv4(hosts: List[str], stop: Event = None) -> Tuple[str, PingStats]:
+def check_ping_ipv4(
+    hosts: List[str], stop: Optional[Event] = None, port: int = 0, timeout: int = 15
+) -> Tuple[str, PingStats]:
     """Ping spcified hosts, returns a tuple, of
     the first host address that could be pinged, and the ping stats.
+    Pings with ICMP, or a UDP echo service if port is specified.
     Address would be an empty string if none of the hosts could be pinged.
     """
+    return _check_ping(hosts, stop, port, timeout, "ipv4")
+
+
+def check_ping_ipv6(
+    hosts: List[str], stop: Optional[Event] = None, port: int = 0, timeout: int = 15
+) -> Tuple[str, PingStats]:
+    """Ping the IPv6 hosts, with ICMPv6 or a UDP echo service if port is
+    specified. Returns the same as check_ping_ipv4().
+    """
+    return _check_ping(hosts, stop, port, timeout, "ipv6")
+
+
+def _check_ping(
+    hosts: List[str], stop: Optional[Event], port: int, timeout: int, version: str
+) -> Tuple[str, PingStats]:
     ping_stats = PingStats()
     # @TODO: maybe find a more accurate way to signal ping failure
     ping_stats = PingStats()
@@ -53,40 +109,255 @@ def check_ping_ipv4(hosts: List[str], stop: Event = None) -> Tuple[str, PingStat
     ping_stats.packet_loss_pct = 100
     for host in hosts:
         if stop and stop.is_set():
-            logger.debug("stopping pinging hosts due to stop event")
+            logger.debug("stopping pinging {} hosts due to stop event".format(version))
             break
-        logger.debug("pinging host {}".format(host))
+        logger.debug("pinging {} host {}".format(version, host))
         try:
-            ping_stats = ping_host(
-                host, 15, 5
-            )  # @TODO: increase packets to get more accurate results
+            with span("check_ping_{}.attempt".format(version), host):
+                if port:
+                    ping_stats = udp_ping_host(host, port, timeout, 5)
+                else:
+                    ping_stats = ping_host(
+                        host, timeout, 5
+                    )  # @TODO: increase packets to get more accurate results
         except ConnectionError as err:
-            logger.warning("failed to ping '{}'. {}".format(host, err))
+            logger.warning("failed to ping {} '{}'. {}".format(version, host, err))
         if ping_stats.packets_recv > 0:
-            logger.info("did ping host {}".format(host))
+            logger.info("did ping {} host {}".format(version, host))
             return (host, ping_stats)
-    logger.warning("couldn'ping any host of: {}".format(", ".join(hosts)))
+    logger.warning("couldn'ping any {} host of: {}".format(version, ", ".join(hosts)))
     return "", ping_stats
 
 
-def get_visible_ipv4(urls: List[str], stop: Event = None) -> Tuple[str, float]:
+def get_visible_ipv4(
+    urls: List[str],
+    stop: Optional[Event] = None,
+    cache: Optional[DnsCache] = None,
+    name_server: str = "",
+    port: int = 53,
+) -> Tuple[str, float]:
     """Return visible IPv4 address of current host, and the time it took
     to call the URL and get results.
+    If a DNS cache is provided, URL hosts are looked up from the cache,
+    resolved by the name server if specified when not cached.
     Return empty string and zero time if could not detect the visible IPv4 address.
     """
+    return _get_visible_ip(urls, stop, cache, name_server, port, TYPE_A)
+
+
+def get_visible_ipv6(
+    urls: List[str],
+    stop: Optional[Event] = None,
+    cache: Optional[DnsCache] = None,
+    name_server: str = "",
+    port: int = 53,
+) -> Tuple[str, float]:
+    """Return visible IPv6 address of current host, and the time it took
+    to call the URL (of an IPv6 only host) and get results.
+    Return empty string and zero time if could not detect the visible IPv6 address.
+    """
+    return _get_visible_ip(urls, stop, cache, name_server, port, TYPE_AAAA)
+
+
+def _get_visible_ip(
+    urls: List[str],
+    stop: Optional[Event],
+    cache: Optional[DnsCache],
+    name_server: str,
+    port: int,
+    type_: int,
+) -> Tuple[str, float]:
+    version = "ipv6" if type_ == TYPE_AAAA else "ipv4"
     for url in urls:
         if stop and stop.is_set():
-            logger.debug("stopping getting visible IPv4 due to stop event")
+            logger.debug(
+                "stopping getting visible {} due to stop event".format(version)
+            )
             break
         try:
-            logger.debug("getting visible ipv4 from {}".format(url))
+            logger.debug("getting visible {} from {}".format(version, url))
             start = float(time() * 1000)
-            _, ip = http_get(url)
+            waited = scheduler.thread_wait()
+            with span("get_visible_{}.attempt".format(version), url):
+                if cache is not None:
+                    hostname = urlsplit(url).hostname or ""
+                    address = hostname if _is_ip(hostname) else ""
+                    if not address:
+                        address = cache.lookup(hostname, name_server, port, 5, type_)
+                    _, ip = http_get(url, 10, address)
+                else:
+                    _, ip = http_get(url)
             if ip:
                 ip = ip.strip()
-                logger.info("visible ipv4 is {}".format(ip))
-                return ip, (float(time() * 1000) - start)
+                logger.info("visible {} is {}".format(version, ip))
+                waited = scheduler.thread_wait() - waited
+                return ip, (float(time() * 1000) - start - waited * 1000)
         except HttpConError as err:
-            logger.warning("failed to get visible ipv4 from {}: {}".format(url, err))
-    logger.warning("failed to get visible ipv4".format())
+            logger.warning(
+                "failed to get visible {} from {}: {}".format(version, url, err)
+            )
+    logger.warning("failed to get visible {}".format(version))
     return "", 0
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+def check_dns_cold_warm(
+    name_server: str, domain: str, port: int = 53, timeout: float = 5
+) -> Tuple[float, float]:
+    """Measure miliseconds the name server takes to resolve names of the domain,
+    uncached (cold) and cached (warm).
+    Returns zero durations if the name server could not be queried.
+    """
+    try:
+        with span("check_dns_cold_warm", name_server):
+            cold, warm = measure_resolver(name_server, domain, port, timeout)
+    except ConnectionError as err:
+        logger.warning("failed to measure resolver {}: {}".format(name_server, err))
+        return 0, 0
+    logger.info(
+        "name server {} resolves cold in {:.2f} and warm in {:.2f} milliseconds".format(
+            name_server, cold, warm
+        )
+    )
+    return cold, warm
+
+
+def check_dns_transport(
+    transport: DnsTransport, hostnames: List[str], type_: int = TYPE_A
+) -> TransportStats:
+    """Query the name server of the transport for the first hostname that can
+    be resolved. Returns the stats of the query, with the error if none could.
+    """
+    stats = TransportStats(transport.transport, transport.server)
+    for hostname in hostnames:
+        try:
+            with span("check_dns_transport", transport.server):
+                stats = query_transport(transport, hostname, type_)
+        except ConnectionError as err:
+            stats.error = str(err)
+            logger.warning("{}".format(err))
+            continue
+        logger.info(
+            "{} answered {} in {:.2f} milliseconds".format(
+                transport.server, hostname, stats.query_time
+            )
+        )
+        break
+    return stats
+
+
+def check_https(
+    urls: List[str], stop: Event, sessions: TlsSessions, timeout: float = 10
+) -> HttpsStats:
+    """Probe HTTPS with the URLs until one works.
+    Returns the stats of the working URL, or the last one if none worked.
+    """
+    stats = HttpsStats()
+    for url in urls:
+        if stop and stop.is_set():
+            logger.debug("stopping probing https due to stop event")
+            break
+        with span("check_https", url):
+            stats = probe_https(url, sessions, timeout)
+        if stats.ok:
+            logger.info(
+                "{} connected in {:.2f}, handshake{} in {:.2f} milliseconds".format(
+                    url,
+                    stats.connect_time,
+                    " (resumed)" if stats.resumed else "",
+                    stats.handshake_time,
+                )
+            )
+            break
+        logger.warning("failed to probe https {}: {}".format(url, stats.error))
+    return stats
+
+
+def check_path(hosts: List[str], timeout: float = 2) -> Tuple[str, List[Hop]]:
+    """Trace the path to the first host that can be traced.
+    Returns the host and its hops, or empty values if none could be traced.
+    """
+    for host in hosts:
+        try:
+            with span("check_path", host):
+                hops = trace_path(host, timeout=timeout)
+        except ConnectionError as err:
+            logger.warning("failed to trace path to {}: {}".format(host, err))
+            continue
+        logger.info("traced {} hops to {}".format(len(hops), host))
+        for hop in hops:
+            logger.debug(
+                "hop {} {} rtt {:.2f} ms loss {}%".format(
+                    hop.ttl, hop.address or "*", hop.rtt_avg, hop.packet_loss_pct
+                )
+            )
+        return host, hops
+    return "", []
+
+
+def check_path_mtu(host: str, port: int = 0) -> MtuStats:
+    """Find the path MTU to the host, with ICMP or a UDP echo service if port
+    is specified. Returns the stats with the error if the host could not
+    be probed.
+    """
+    try:
+        with span("check_path_mtu", host):
+            stats = probe_path_mtu(host, port)
+    except ConnectionError as err:
+        logger.warning("failed to probe path MTU: {}".format(err))
+        stats = MtuStats(host)
+        stats.error = str(err)
+        return stats
+    if stats.blackhole:
+        logger.warning(
+            "packets bigger than {} bytes to {} are lost".format(stats.mtu, host)
+        )
+    else:
+        logger.info("path MTU to {} is {} bytes".format(host, stats.mtu))
+    return stats
+
+
+def check_throughput(
+    direction: str, url: str, duration: float = 10, streams: int = 4
+) -> ThroughputStats:
+    """Measure download or upload throughput with the endpoint URL.
+    Returns empty stats (no bytes) if the throughput could not be measured.
+    """
+    try:
+        with span("check_throughput", url):
+            stats = measure_throughput(direction, url, duration, streams)
+    except ConnectionError as err:
+        logger.warning("failed to measure {} throughput: {}".format(direction, err))
+        return ThroughputStats(direction, url)
+    logger.info(
+        "{} goodput {:.2f} Mbit/s with {} streams, ramp-up {:.1f} seconds".format(
+            direction, stats.goodput_mbps, streams, stats.ramp_up
+        )
+    )
+    return stats
+
+
+def check_capacity(host: str, port: int) -> CapacityStats:
+    """Estimate the capacity and queueing delay of the path to a UDP echo
+    service on the host, with packet trains.
+    Returns empty stats if the host could not be probed.
+    """
+    try:
+        with span("check_capacity", host):
+            stats = probe_capacity(host, port)
+    except ConnectionError as err:
+        logger.warning("failed to probe capacity: {}".format(err))
+        return CapacityStats()
+    logger.info(
+        "path to {} has capacity {:.2f} Mbit/s, queueing delay {:.2f} ms".format(
+            host, stats.capacity_mbps, stats.queueing_delay
+        )
+    )
+    return stats
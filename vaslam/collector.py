@@ -0,0 +1,385 @@
+"""
+vaslam.collector
+================
+
+collect results of many agents, to tell faults of a host from outages of
+a network segment shared by the agents
+"""
+import os
+import json
+import socket
+import selectors
+from time import time, monotonic
+from logging import getLogger
+from threading import Event
+from typing import Any, Dict, List, Optional, Tuple, cast
+from vaslam.net import ConnectionError
+from vaslam.sketch import LatencySketch
+
+
+logger = getLogger(__name__)
+
+GATEWAY = "gateway"  # type: str
+TARGET = "target"  # type: str
+
+MAX_RECORD_SIZE = 64 * 1024  # type: int
+
+
+def agent_record(
+    agent: str, result: Any, issues: Optional[List[int]] = None, site: str = ""
+) -> Dict[str, Any]:
+    """Return the compact record of the agent Result to send to the collector,
+    with its issues (the issues of the Result by default).
+    Latency of the gateway and the Internet host are sent as sketches.
+    The gateway is told apart from the same (private) gateway address of
+    other sites by the site, or else by the visible IPv4 of the agent.
+    """
+    record = {
+        "a": agent,
+        "t": time(),
+        "s": site,
+        "v": result.ipv4,
+        "g": result.gateway,
+        "h": result.internet_host,
+        "i": result.get_issues() if issues is None else issues,
+    }  # type: Dict[str, Any]
+    for key, stats in (
+        ("gs", result.gateway_ping_stats),
+        ("hs", result.internet_ping_stats),
+    ):
+        sketch = LatencySketch()
+        sketch.add(stats.rtt_avg, stats.packets_recv)
+        record[key] = sketch.to_list()
+    return record
+
+
+class SharedFault:
+    """An issue reported by most of the agents sharing a network segment,
+    the gateway or the upstream target of the agents.
+    """
+
+    def __init__(self, kind: str, key: str, issue: int, affected: int, agents: int):
+        self.kind = kind  # type: str
+        self.key = key  # type: str
+        self.issue = issue  # type: int
+        self.affected = affected  # type: int
+        self.agents = agents  # type: int
+
+
+def _gateway_key(gateway: str, site: str) -> str:
+    """Return the key of the gateway segment of the site"""
+    if not gateway or not site:
+        return gateway
+    return "{}@{}".format(gateway, site)
+
+
+class _AgentState:
+    __slots__ = ("seen", "gateway", "target", "issues")
+
+    def __init__(self, seen: float, gateway: str, target: str, issues: List[int]):
+        self.seen = seen
+        self.gateway = gateway
+        self.target = target
+        self.issues = issues
+
+
+class _Segment:
+    """Latency of a segment over the current and the previous window"""
+
+    __slots__ = ("current", "previous", "seen")
+
+    def __init__(self):
+        self.current = LatencySketch()
+        self.previous = LatencySketch()
+        self.seen = 0.0
+
+    def rotate(self) -> None:
+        self.previous, self.current = self.current, self.previous
+        self.current.clear()
+
+    def quantile(self, q: float) -> float:
+        merged = LatencySketch()
+        merged.merge(self.previous)
+        merged.merge(self.current)
+        return merged.quantile(q)
+
+
+class Collector:
+    """Keeps the latest state of each agent reported in the window seconds,
+    and the latency sketches of the gateways and the targets of the agents.
+    Memory is bounded by max agents and max segments, least recently
+    reported ones are dropped first.
+    """
+
+    def __init__(
+        self,
+        window: float = 30,
+        max_agents: int = 100000,
+        max_segments: int = 10000,
+        min_agents: int = 3,
+        ratio: float = 0.5,
+    ):
+        self.window = window  # type: float
+        self.max_agents = max_agents  # type: int
+        self.max_segments = max_segments  # type: int
+        # faults are shared if reported by the ratio of at least min agents
+        self.min_agents = min_agents  # type: int
+        self.ratio = ratio  # type: float
+        self.records = 0  # type: int
+        self.invalid = 0  # type: int
+        self._agents = {}  # type: Dict[str, _AgentState]
+        self._segments = {}  # type: Dict[Tuple[str, str], _Segment]
+        self._rotated = monotonic()
+
+    def ingest(self, record: Dict[str, Any], now: float = 0) -> bool:
+        """Ingest the agent record, return False if it's invalid"""
+        now = now or monotonic()
+        try:
+            agent = str(record["a"])
+            site = str(record.get("s") or record.get("v") or "")
+            gateway = _gateway_key(str(record.get("g", "")), site)
+            target = str(record.get("h", ""))
+            issues = [int(i) for i in record.get("i", [])]
+            sketches = [
+                (kind, key, LatencySketch.from_list(record[field]))
+                for kind, key, field in (
+                    (GATEWAY, gateway, "gs"),
+                    (TARGET, target, "hs"),
+                )
+                if key and field in record
+            ]
+        except (KeyError, TypeError, ValueError) as err:
+            logger.debug("invalid agent record: {}".format(err))
+            self.invalid += 1
+            return False
+        self.records += 1
+        self._agents.pop(agent, None)
+        self._agents[agent] = _AgentState(now, gateway, target, issues)
+        if len(self._agents) > self.max_agents:
+            del self._agents[next(iter(self._agents))]
+        if now - self._rotated >= self.window:
+            for segment in self._segments.values():
+                segment.rotate()
+            self._rotated = now
+        for kind, key, sketch in sketches:
+            # move the segment to the end, as the most recently reported
+            if (kind, key) in self._segments:
+                segment = self._segments.pop((kind, key))
+            else:
+                segment = _Segment()
+            segment.current.merge(sketch)
+            segment.seen = now
+            self._segments[(kind, key)] = segment
+        while len(self._segments) > self.max_segments:
+            del self._segments[next(iter(self._segments))]
+        return True
+
+    def expire(self, now: float = 0) -> None:
+        """Drop agents and segments not reported in the last window"""
+        oldest = (now or monotonic()) - self.window
+        _drop_older(self._agents, oldest)
+        _drop_older(self._segments, oldest)
+
+    @property
+    def agents(self) -> int:
+        return len(self._agents)
+
+    def latency(self, kind: str, key: str, q: float = 0.5) -> float:
+        """Return the latency quantile of the gateway or target segment"""
+        segment = self._segments.get((kind, key))
+        return segment.quantile(q) if segment else 0.0
+
+    def attribute(self, now: float = 0) -> List[SharedFault]:
+        """Correlate the issues of the agents reported in the window, and
+        return the faults shared by the agents of a segment.
+        Issues common to agents of different gateways are attributed to their
+        upstream target, the rest that are common to the agents behind a
+        gateway are attributed to the gateway. Other issues are local faults
+        of the agents.
+        Gateways are keyed by their address and the site, as gateway@site.
+        """
+        self.expire(now)
+        groups = {
+            TARGET: {},
+            GATEWAY: {},
+        }  # type: Dict[str, Dict[str, List[_AgentState]]]
+        for state in self._agents.values():
+            if state.target:
+                groups[TARGET].setdefault(state.target, []).append(state)
+            if state.gateway:
+                groups[GATEWAY].setdefault(state.gateway, []).append(state)
+
+        faults = []  # type: List[SharedFault]
+        upstream = set()  # type: set
+        for kind in (TARGET, GATEWAY):
+            for key, states in groups[kind].items():
+                if len(states) < self.min_agents:
+                    continue
+                counts = {}  # type: Dict[int, List[_AgentState]]
+                for state in states:
+                    for issue in state.issues:
+                        counts.setdefault(issue, []).append(state)
+                for issue, affected in sorted(counts.items()):
+                    if len(affected) < self.ratio * len(states):
+                        continue
+                    if kind == TARGET:
+                        if len({s.gateway for s in affected}) < 2:
+                            continue
+                        upstream.update((s.gateway, issue) for s in affected)
+                    elif (key, issue) in upstream:
+                        continue
+                    faults.append(
+                        SharedFault(kind, key, issue, len(affected), len(states))
+                    )
+        return faults
+
+
+def _drop_older(states: Dict[Any, Any], oldest: float) -> None:
+    """Drop the states seen before the oldest time, states are in the order
+    they were seen
+    """
+    while states:
+        key = next(iter(states))
+        if states[key].seen >= oldest:
+            break
+        del states[key]
+
+
+def _listen(address: str) -> socket.socket:
+    """Return a listening socket on the TCP [host:]port or the Unix socket path"""
+    if "/" in address:
+        if os.path.exists(address):
+            os.unlink(address)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(address)
+    else:
+        host, _, port = address.rpartition(":")
+        sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host.strip("[]"), int(port)))
+    sock.listen(128)
+    sock.setblocking(False)
+    return sock
+
+
+class CollectorServer:
+    """Receives agent records, as lines of JSON, over TCP and Unix sockets.
+    All the connections are served by a single thread with non-blocking I/O.
+    """
+
+    def __init__(self, collector: Collector, addresses: List[str]):
+        self.collector = collector  # type: Collector
+        self.listeners = [_listen(address) for address in addresses]
+        self.addresses = [sock.getsockname() for sock in self.listeners]
+        self._selector = selectors.DefaultSelector()
+        for sock in self.listeners:
+            self._selector.register(sock, selectors.EVENT_READ, None)
+
+    def serve(self, stop: Event, poll_interval: float = 0.5) -> None:
+        """Serve the connections until the stop event is set"""
+        while not stop.is_set():
+            for key, _ in self._selector.select(poll_interval):
+                # only sockets are registered
+                sock = cast(socket.socket, key.fileobj)
+                if key.data is None:
+                    self._accept(sock)
+                else:
+                    self._read(sock, key.data)
+
+    def _accept(self, listener: socket.socket) -> None:
+        try:
+            conn, _ = listener.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        self._selector.register(conn, selectors.EVENT_READ, bytearray())
+
+    def _read(self, conn: socket.socket, buf: bytearray) -> None:
+        try:
+            data = conn.recv(MAX_RECORD_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(conn)
+            return
+        buf.extend(data)
+        start = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end < 0:
+                break
+            try:
+                record = json.loads(buf[start:end].decode("utf-8"))
+            except ValueError:
+                record = None
+            if isinstance(record, dict):
+                self.collector.ingest(record)
+            else:
+                self.collector.invalid += 1
+            start = end + 1
+        del buf[:start]
+        if len(buf) > MAX_RECORD_SIZE:
+            logger.debug("dropping connection sending a too long record")
+            self._close(conn)
+
+    def _close(self, conn: socket.socket) -> None:
+        self._selector.unregister(conn)
+        conn.close()
+
+    def close(self) -> None:
+        for key in list(self._selector.get_map().values()):
+            cast(socket.socket, key.fileobj).close()
+        self._selector.close()
+        for address in self.addresses:
+            if isinstance(address, str) and os.path.exists(address):
+                os.unlink(address)
+
+
+class RecordSender:
+    """Sends agent records to the collector, over a connection kept open
+    between the records.
+    """
+
+    def __init__(self, address: str, timeout: float = 5):
+        self.address = address  # type: str
+        self.timeout = timeout  # type: float
+        self._sock = None  # type: Optional[socket.socket]
+
+    def _connect(self) -> socket.socket:
+        if "/" in self.address:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.address)
+            except OSError:
+                sock.close()
+                raise
+            return sock
+        host, _, port = self.address.rpartition(":")
+        return socket.create_connection((host.strip("[]"), int(port)), self.timeout)
+
+    def send(self, record: Dict[str, Any]) -> None:
+        """Send the record, reconnecting once if the connection was closed.
+
+        :raises: ConnectionError if the record could not be sent
+        """
+        line = json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+        for attempt in range(2):
+            try:
+                if self._sock is None:
+                    self._sock = self._connect()
+                self._sock.sendall(line)
+                return
+            except OSError as err:
+                self.close()
+                if attempt:
+                    raise ConnectionError(
+                        "failed to send record to {}: {}".format(self.address, err)
+                    )
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
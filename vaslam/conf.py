@@ -1,4 +1,5 @@
-from vaslam.system import get_name_servers, get_gateway_ipv4
+from vaslam.system import get_name_servers, get_gateway_ipv4, get_gateway_ipv6
+from vaslam.trace import span
 
 
 default_hostnames = [
@@ -14,6 +15,21 @@ default_ipv4_echo_urls = [
     "http://ifconfig.io/ip",
     "http://ifconfig.me/ip",
 ]
+default_https_echo_urls = [
+    "https://icanhazip.com/",
+    "https://ifconfig.me/ip",
+    "https://ifconfig.io/ip",
+]
+default_ipv6_name_servers = ["2606:4700:4700::1111", "2001:4860:4860::8888"]
+default_ipv6_ping_hosts = [
+    "2606:4700:4700::1111",
+    "2001:4860:4860::8888",
+    "2620:fe::fe",
+]
+default_ipv6_echo_urls = [
+    "http://ipv6.icanhazip.com/",
+    "http://v6.ident.me/",
+]
 
 
 class Conf:
@@ -24,14 +40,65 @@ class Conf:
         self.ipv4_default_name_servers = []  # type: List[str]
         self.ipv4_ping_hosts = []  # type: List[str]
         self.ipv4_echo_urls = []  # type: List[str]
+        # probe HTTPS with the first working of these visible IP URLs, empty
+        # to skip
+        self.https_echo_urls = []  # type: List[str]
+        # run the IPv6 checks concurrently with IPv4
+        self.ipv6 = False  # type: bool
+        self.ipv6_gateway = ""  # type: str
+        self.ipv6_default_name_servers = []  # type: List[str]
+        self.ipv6_ping_hosts = []  # type: List[str]
+        self.ipv6_echo_urls = []  # type: List[str]
+        # name server to query for AAAA records, empty uses the system resolver
+        self.ipv6_resolver = ""  # type: str
+        # seconds to wait for the remaining checks of an IP family that failed
+        # to reach the Internet, after the other family is found working
+        self.family_grace = 1.0  # type: float
+        # name server to query for DNS checks, empty uses the system resolver
+        self.resolver = ""  # type: str
+        self.resolver_port = 53  # type: int
+        self.resolver_timeout = 5  # type: float
+        # measure cold and warm resolution of this domain, empty to skip
+        self.dns_measure_domain = ""  # type: str
+        # URIs of DNS over TCP, TLS or HTTPS name servers to query
+        self.dns_transports = []  # type: List[str]
+        # port of a UDP echo service to ping, 0 pings with ICMP
+        self.ping_port = 0  # type: int
+        self.ping_timeout = 15  # type: int
+        # trace the path to the Internet hosts to find which hop adds latency
+        self.trace_path = False  # type: bool
+        self.trace_timeout = 2  # type: float
+        # find the path MTU to the gateway and the Internet hosts, to detect
+        # MTU blackholes
+        self.path_mtu = False  # type: bool
+        # HTTP or raw TCP (tcp://host:port) endpoints to measure throughput,
+        # empty to skip
+        self.throughput_download_url = ""  # type: str
+        self.throughput_upload_url = ""  # type: str
+        self.throughput_duration = 10  # type: float
+        self.throughput_streams = 4  # type: int
+        # UDP echo service to probe with packet trains for the path capacity,
+        # empty host to skip
+        self.capacity_host = ""  # type: str
+        self.capacity_port = 7  # type: int
+        # bind the probes to the network interface and/or source address,
+        # empty to use the routing table
+        self.interface = ""  # type: str
+        self.source_address = ""  # type: str
 
 
 def default_conf() -> Conf:
-    conf = Conf()
-    conf.hostnames = default_hostnames
-    conf.name_servers = get_name_servers()
-    conf.ipv4_default_name_servers = default_ipv4_name_servers
-    conf.ipv4_ping_hosts = default_ipv4_ping_hosts
-    conf.ipv4_gateway = get_gateway_ipv4()
-    conf.ipv4_echo_urls = default_ipv4_echo_urls
+    with span("default_conf"):
+        conf = Conf()
+        conf.hostnames = default_hostnames
+        conf.name_servers = get_name_servers()
+        conf.ipv4_default_name_servers = default_ipv4_name_servers
+        conf.ipv4_ping_hosts = default_ipv4_ping_hosts
+        conf.ipv4_gateway = get_gateway_ipv4()
+        conf.ipv4_echo_urls = default_ipv4_echo_urls
+        conf.ipv6_gateway = get_gateway_ipv6()
+        conf.ipv6 = conf.ipv6_gateway != ""
+        conf.ipv6_default_name_servers = default_ipv6_name_servers
+        conf.ipv6_ping_hosts = default_ipv6_ping_hosts
+        conf.ipv6_echo_urls = default_ipv6_echo_urls
     return conf
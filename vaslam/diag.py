@@ -1,31 +1,87 @@
+from copy import copy
+from time import time
+from socket import AF_INET, AF_INET6
 from logging import getLogger
-from queue import Queue
+from queue import Queue, Empty
 from collections import deque
-from threading import Thread, Event
-from typing import List, Mapping, Callable, Optional
+from threading import Thread, Event, Lock
+from typing import Any, Dict, List, Callable, Optional, Tuple
 from vaslam.conf import Conf
-from vaslam.check import check_dns, check_ping_ipv4, get_visible_ipv4
-from vaslam.net import PingStats
-
-
-LOCALNET_UNKNOWN = 101  # type :int
-LOCALNET_GATEWAY_UNREACHABLE = 102  # type :int
-LOCALNET_PACKET_LOSS_HIGH = 103  # type :int
-LOCALNET_LATENCY_HIGH = 104  # type :int
-LOCALNET_PACKET_LOSS = 105  # type :int
-LOCALNET_LATENCY = 106  # type :int
-INTERNET_UNKNOWN = 201  # type :int
-INTERNET_UNREACHABLE = 202  # type :int
-INTERNET_PACKET_LOSS_HIGH = 203  # type :int
-INTERNET_LATENCY_HIGH = 204  # type :int
-INTERNET_PACKET_LOSS = 205  # type :int
-INTERNET_LATENCY = 206  # type :int
-DNS_FAIL = 300  # type :int
-HTTP_FAIL = 400  # type :int
+from vaslam.check import (
+    check_dns,
+    check_dns_cold_warm,
+    check_dns_transport,
+    check_https,
+    check_ping_ipv4,
+    check_ping_ipv6,
+    check_capacity,
+    check_path,
+    check_path_mtu,
+    check_throughput,
+    get_visible_ipv4,
+    get_visible_ipv6,
+)
+from vaslam.dns import DnsCache
+from vaslam.dnstransport import TransportPool, TransportStats
+from vaslam.tls import HttpsStats, TlsSessions
+from vaslam.pmtu import MtuStats
+from vaslam.net import PingStats, CapacityStats, Binding
+from vaslam.traceroute import Hop, analyze_path
+from vaslam.throughput import ThroughputStats, DOWNLOAD, UPLOAD
+from vaslam.baseline import BaselineStore
+from vaslam.system import Counters, Route, get_interface_ipv4
+from vaslam.trace import span
+from vaslam.scheduler import scheduler
+from vaslam.issues import (
+    LOCALNET_UNKNOWN,
+    LOCALNET_GATEWAY_UNREACHABLE,
+    LOCALNET_PACKET_LOSS_HIGH,
+    LOCALNET_LATENCY_HIGH,
+    LOCALNET_PACKET_LOSS,
+    LOCALNET_LATENCY,
+    LOCALNET_INTERFACE_ERRORS,
+    LOCALNET_RETRANSMITS,
+    LOCALNET_UPLINK_DOWN,
+    INTERNET_UNKNOWN,
+    INTERNET_UNREACHABLE,
+    INTERNET_PACKET_LOSS_HIGH,
+    INTERNET_LATENCY_HIGH,
+    INTERNET_PACKET_LOSS,
+    INTERNET_LATENCY,
+    INTERNET_ISP_PACKET_LOSS,
+    INTERNET_ISP_LATENCY,
+    INTERNET_UPSTREAM_PACKET_LOSS,
+    INTERNET_UPSTREAM_LATENCY,
+    INTERNET_MTU_BLACKHOLE,
+    DNS_FAIL,
+    DNS_LATENCY,
+    DNS_TRANSPORT_FAIL,
+    DNS_TRANSPORT_SLOW,
+    HTTP_FAIL,
+    HTTPS_FAIL,
+    HTTPS_CERT_UNTRUSTED,
+    HTTPS_HANDSHAKE_SLOW,
+    BANDWIDTH_LOW,
+    BANDWIDTH_UPLOAD_LOW,
+    BANDWIDTH_CAPACITY_LOW,
+    BANDWIDTH_BUFFERBLOAT,
+    IPV6_UNREACHABLE,
+    IPV6_DNS_FAIL,
+    IPV6_HTTP_FAIL,
+    IPV6_PACKET_LOSS,
+    IPV6_LATENCY,
+    IPV6_GATEWAY_UNREACHABLE,
+    IPV4_UNREACHABLE,
+    issue_message,
+)
 
 
 logger = getLogger(__name__)
 
+# progress observer of the diagnosis, receives the total steps and the step
+# counter, and returns False to stop the diagnosis
+Observer = Callable[[int, int], Optional[bool]]
+
 
 class Result:
     """Represents the results of diagnosis"""
@@ -34,6 +90,20 @@ class Result:
     default_packet_loss_threshold = 5
     default_latency_high_threshold = 700
     default_latency_threshold = 300
+    default_dns_latency_threshold = 500
+    # DNS transports slower than the ratio of the fastest, by at least the diff
+    default_dns_transport_slow_ratio = 3
+    default_dns_transport_slow_diff = 50
+    default_tls_handshake_threshold = 500
+    default_hop_latency_threshold = 100
+    # Mbit/s
+    default_download_threshold = 10
+    default_upload_threshold = 2
+    default_capacity_threshold = 10
+    default_queueing_delay_threshold = 100
+    # percent of TCP segments retransmitted, of at least the min segments
+    default_retransmit_threshold = 5
+    default_retransmit_min_segments = 100
 
     def __init__(self):
         self.internet = False  # type: bool
@@ -42,8 +112,79 @@ class Result:
         self.local_dns = False  # type: bool
         self.http = False  # type: bool
         self.ipv4 = ""  # type: str
+        self.gateway = ""  # type: str
+        # the route has no gateway (e.g. of VPN tunnels), so the local network
+        # is not checked
+        self.on_link = False  # type: bool
+        self.internet_host = ""  # type: str
+        self.dns_time = 0  # type: float
+        self.dns_cold_time = 0  # type: float
+        self.dns_warm_time = 0  # type: float
+        self.http_time = 0  # type: float
+        # queries over the DNS transports (TCP, TLS, HTTPS)
+        self.dns_transports = []  # type: List[TransportStats]
+        self.https_stats = HttpsStats()  # type: HttpsStats
         self.gateway_ping_stats = PingStats()  # type: PingStats
         self.internet_ping_stats = PingStats()  # type: PingStats
+        self.path_hops = []  # type: List[Hop]
+        # path MTU to the gateway and the Internet hosts
+        self.mtu_stats = []  # type: List[MtuStats]
+        self.download_stats = ThroughputStats(DOWNLOAD)  # type: ThroughputStats
+        self.upload_stats = ThroughputStats(UPLOAD)  # type: ThroughputStats
+        self.capacity_stats = CapacityStats()  # type: CapacityStats
+        # changes of the kernel network counters, when sampled
+        self.counters = Counters()  # type: Counters
+        # results of each uplink, when diagnosing multiple uplinks
+        self.uplinks = []  # type: List[Uplink]
+        self.ipv6 = ""  # type: str
+        # results of the IPv6 checks, when diagnosing dual-stack
+        self.ipv6_result = None  # type: Optional[Result]
+        # checks abandoned before they completed (gw, internet, dns, http),
+        # their results are unknown rather than failed
+        self.unknown = []  # type: List[str]
+        # miliseconds the probes waited for the scheduler, excluded from timings
+        self.scheduler_wait = 0  # type: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the result as a dict of JSON serializable values"""
+        data = dict(vars(self))
+        for name in _stats_fields:
+            data[name] = dict(vars(getattr(self, name)))
+        data["path_hops"] = [dict(vars(hop)) for hop in self.path_hops]
+        data["dns_transports"] = [dict(vars(t)) for t in self.dns_transports]
+        data["mtu_stats"] = [dict(vars(m)) for m in self.mtu_stats]
+        data["uplinks"] = [
+            {"route": vars(u.route), "source": u.source, "result": u.result.to_dict()}
+            for u in self.uplinks
+        ]
+        if self.ipv6_result is not None:
+            data["ipv6_result"] = self.ipv6_result.to_dict()
+        return data
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "Result":
+        """Return a Result from the dict of to_dict(), unknown keys are ignored"""
+        rsl = Result()
+        for name, val in data.items():
+            if name in _stats_fields:
+                _set_attrs(getattr(rsl, name), val)
+            elif name == "path_hops":
+                rsl.path_hops = [_set_attrs(Hop(h["ttl"]), h) for h in val]
+            elif name == "dns_transports":
+                rsl.dns_transports = [_set_attrs(TransportStats(), t) for t in val]
+            elif name == "mtu_stats":
+                rsl.mtu_stats = [_set_attrs(MtuStats(), m) for m in val]
+            elif name == "uplinks":
+                for attrs in val:
+                    route = _set_attrs(Route(), attrs["route"])
+                    uplink = Uplink(route, attrs["source"])
+                    uplink.result = Result.from_dict(attrs["result"])
+                    rsl.uplinks.append(uplink)
+            elif name == "ipv6_result":
+                rsl.ipv6_result = Result.from_dict(val) if val else None
+            elif hasattr(rsl, name):
+                setattr(rsl, name, val)
+        return rsl
 
     @staticmethod
     def new_all_ok():
@@ -55,9 +196,12 @@ class Result:
         rsl.http = True
         return rsl
 
-    def get_issues(self) -> List[int]:
+    def get_issues(self, baselines: Optional[BaselineStore] = None) -> List[int]:
         """Returns a list of issues codes for the current Result.
         Empty list means there is no issue.
+        If baselines are provided, latency and packet loss are also compared
+        against the normal values of each target, to report issues that
+        are under the fixed thresholds but unusual for that target.
         """
         issues = []
         if self.localnet:
@@ -69,16 +213,32 @@ class Result:
                 issues.append(LOCALNET_PACKET_LOSS_HIGH)
             elif gw_loss > self.default_packet_loss_threshold:
                 issues.append(LOCALNET_PACKET_LOSS)
+            elif baselines and baselines.packet_loss_anomalous(self.gateway, gw_loss):
+                issues.append(LOCALNET_PACKET_LOSS)
 
             if gw_rtt > self.default_latency_high_threshold:
                 issues.append(LOCALNET_LATENCY_HIGH)
             elif gw_rtt > self.default_latency_threshold:
                 issues.append(LOCALNET_LATENCY)
+            elif baselines and baselines.latency_anomalous(self.gateway, gw_rtt):
+                issues.append(LOCALNET_LATENCY)
+        elif self.on_link:
+            pass
         elif self.gateway_ping_stats.packets_sent < 1:
             issues.append(LOCALNET_UNKNOWN)
         else:
             issues.append(LOCALNET_GATEWAY_UNREACHABLE)
 
+        if self.internet and any(not u.result.internet for u in self.uplinks):
+            issues.append(LOCALNET_UPLINK_DOWN)
+        if self.counters.interface_errors > 0:
+            issues.append(LOCALNET_INTERFACE_ERRORS)
+        if (
+            self.counters.tcp_out_segs >= self.default_retransmit_min_segments
+            and self.counters.retransmit_pct > self.default_retransmit_threshold
+        ):
+            issues.append(LOCALNET_RETRANSMITS)
+
         if self.internet:
             in_loss, in_rtt = (
                 self.internet_ping_stats.packet_loss_pct,
@@ -88,142 +248,554 @@ class Result:
                 issues.append(INTERNET_PACKET_LOSS_HIGH)
             elif in_loss > self.default_packet_loss_threshold:
                 issues.append(INTERNET_PACKET_LOSS)
+            elif baselines and baselines.packet_loss_anomalous(
+                self.internet_host, in_loss
+            ):
+                issues.append(INTERNET_PACKET_LOSS)
 
             if in_rtt > self.default_latency_high_threshold:
                 issues.append(INTERNET_LATENCY_HIGH)
             elif in_rtt > self.default_latency_threshold:
                 issues.append(INTERNET_LATENCY)
+            elif baselines and baselines.latency_anomalous(self.internet_host, in_rtt):
+                issues.append(INTERNET_LATENCY)
         elif self.internet_ping_stats.packets_sent < 1:
             issues.append(INTERNET_UNKNOWN)
         else:
             issues.append(INTERNET_UNREACHABLE)
 
+        if self.path_hops:
+            path = analyze_path(self.path_hops)
+            if path.isp_packet_loss_pct > self.default_packet_loss_threshold:
+                issues.append(INTERNET_ISP_PACKET_LOSS)
+            if path.isp_latency > self.default_hop_latency_threshold:
+                issues.append(INTERNET_ISP_LATENCY)
+            if path.upstream_packet_loss_pct > self.default_packet_loss_threshold:
+                issues.append(INTERNET_UPSTREAM_PACKET_LOSS)
+            if path.upstream_latency > self.default_hop_latency_threshold:
+                issues.append(INTERNET_UPSTREAM_LATENCY)
+        if any(m.blackhole for m in self.mtu_stats):
+            issues.append(INTERNET_MTU_BLACKHOLE)
+
+        dns_time = max(self.dns_time, self.dns_cold_time)
         if not self.dns:
-            issues.append(DNS_FAIL)
+            if "dns" not in self.unknown:
+                issues.append(DNS_FAIL)
+        elif dns_time > self.default_dns_latency_threshold:
+            issues.append(DNS_LATENCY)
+
+        issues.extend(self._dns_transport_issues())
 
-        if not self.http:
+        if not self.http and "http" not in self.unknown:
             issues.append(HTTP_FAIL)
+        https = self.https_stats
+        if https.cert_error:
+            issues.append(HTTPS_CERT_UNTRUSTED)
+        elif https.url and not https.ok and self.http:
+            issues.append(HTTPS_FAIL)
+        elif https.handshake_time > self.default_tls_handshake_threshold:
+            issues.append(HTTPS_HANDSHAKE_SLOW)
+
+        for stats, threshold, code in (
+            (self.download_stats, self.default_download_threshold, BANDWIDTH_LOW),
+            (self.upload_stats, self.default_upload_threshold, BANDWIDTH_UPLOAD_LOW),
+        ):
+            if stats.bytes > 0 and stats.goodput_mbps < threshold:
+                issues.append(code)
+
+        capacity = self.capacity_stats
+        if (
+            capacity.capacity
+            and capacity.capacity_mbps < self.default_capacity_threshold
+        ):
+            issues.append(BANDWIDTH_CAPACITY_LOW)
+        if capacity.queueing_delay > self.default_queueing_delay_threshold:
+            issues.append(BANDWIDTH_BUFFERBLOAT)
+
+        if self.ipv6_result is not None:
+            if self.ipv6_result.works and not self.works:
+                issues.append(IPV4_UNREACHABLE)
+            issues.extend(self._ipv6_issues(self.ipv6_result))
 
         return issues
 
+    @property
+    def works(self) -> bool:
+        """If the Internet hosts were reachable, regardless of the DNS"""
+        return self.internet_ping_stats.packets_recv > 0 or self.http
 
-def issue_message(code: int) -> str:
-    """Return human readable message regarding the issue code.
-    Return emptyr string for unknown codes.
-    """
-    messages = {
-        LOCALNET_UNKNOWN: "Local network connection quality is unknown",
-        LOCALNET_GATEWAY_UNREACHABLE: "Local network gateway is unreachable",
-        LOCALNET_PACKET_LOSS_HIGH: "Local network has high packet loss",
-        LOCALNET_LATENCY_HIGH: "Local network has high latency",
-        LOCALNET_PACKET_LOSS: "Local network has packet loss",
-        LOCALNET_LATENCY: "Local network has latency",
-        INTERNET_UNKNOWN: "Quality of connection to the Internet is unknown",
-        INTERNET_UNREACHABLE: "Internet is unreachable",
-        INTERNET_PACKET_LOSS_HIGH: "Connection to the Internet has high packet loss",
-        INTERNET_LATENCY_HIGH: "Connection to the Internet has high latency",
-        INTERNET_PACKET_LOSS: "Connection to the Internet has packet loss",
-        INTERNET_LATENCY: "Connection to the Internet has latency",
-        DNS_FAIL: "Name resolution failed, DNS issue",
-        HTTP_FAIL: "Web access failed",
-    }  # type: Mapping[int, str]
-    return messages.get(code, "")
+    def _dns_transport_issues(self) -> List[int]:
+        """Issues of the DNS transports compared to each other, and to UDP"""
+        issues = []  # type: List[int]
+        times = [t.query_time for t in self.dns_transports if t.ok]
+        if self.dns:
+            times.append(self.dns_time)
+        if not times:
+            return issues
+        if any(not t.ok for t in self.dns_transports):
+            issues.append(DNS_TRANSPORT_FAIL)
+        fastest = min(times)
+        slow = max(
+            fastest * self.default_dns_transport_slow_ratio,
+            fastest + self.default_dns_transport_slow_diff,
+        )
+        if any(t.ok and t.query_time > slow for t in self.dns_transports):
+            issues.append(DNS_TRANSPORT_SLOW)
+        return issues
+
+    def _ipv6_issues(self, v6: "Result") -> List[int]:
+        issues = []  # type: List[int]
+        if v6.gateway_ping_stats.packets_sent > 0 and not v6.localnet:
+            issues.append(IPV6_GATEWAY_UNREACHABLE)
+        if not v6.works:
+            issues.append(IPV6_UNREACHABLE)
+            return issues
+        if v6.internet:
+            stats = v6.internet_ping_stats
+            if stats.packet_loss_pct > self.default_packet_loss_threshold:
+                issues.append(IPV6_PACKET_LOSS)
+            if stats.rtt_avg > self.default_latency_threshold:
+                issues.append(IPV6_LATENCY)
+        if not v6.dns and "dns" not in v6.unknown:
+            issues.append(IPV6_DNS_FAIL)
+        if not v6.http and "http" not in v6.unknown:
+            issues.append(IPV6_HTTP_FAIL)
+        return issues
+
+    def update_baselines(self, baselines: BaselineStore) -> None:
+        """Update the baselines of the pinged targets with the current stats.
+        Targets that are anomalous are skipped, so incidents don't become the
+        normal values.
+        """
+        for target, stats in (
+            (self.gateway, self.gateway_ping_stats),
+            (self.internet_host, self.internet_ping_stats),
+        ):
+            if not target or stats.packets_recv < 1:
+                continue
+            rtt, loss = stats.rtt_avg, stats.packet_loss_pct
+            if baselines.latency_anomalous(target, rtt):
+                continue
+            if baselines.packet_loss_anomalous(target, loss):
+                continue
+            baselines.update(target, rtt, loss)
+
+
+# fields of Result holding stats objects
+_stats_fields = (
+    "gateway_ping_stats",
+    "internet_ping_stats",
+    "download_stats",
+    "upload_stats",
+    "capacity_stats",
+    "counters",
+    "https_stats",
+)  # type: Tuple[str, ...]
+
+
+def _set_attrs(obj: Any, attrs: Dict[str, Any]) -> Any:
+    for name, val in attrs.items():
+        if hasattr(obj, name):
+            setattr(obj, name, val)
+    return obj
+
+
+class Uplink:
+    """Diagnosis of the network path through a default route"""
+
+    def __init__(self, route: Route, source: str = ""):
+        self.route = route  # type: Route
+        self.source = source  # type: str
+        self.result = Result()  # type: Result
 
 
 def diagnose_network(
-    conf: Conf, observer: Callable[[int, int], Optional[bool]] = None
+    conf: Conf,
+    observer: Optional[Observer] = None,
+    dns_cache: Optional[DnsCache] = None,
+    transports: Optional[TransportPool] = None,
+    tls_sessions: Optional[TlsSessions] = None,
 ) -> Result:
     """Diagnose network and Internet connection using the provided configuration.
     Runs checks concurrently. Returns the results as a Result instance.
     Accepts an observer function to notify the progress. The observer receives
     the total steps, step counter.
     If the observer returns False, it's a signal to stop the diagnosis.
+    A DNS cache can be provided to keep resolved names between diagnosis, so
+    the web access check skips redundant lookups.
+    A pool of DNS transports can be provided to keep their connections open
+    between diagnosis, and TLS sessions to resume them.
     """
 
     steps_done = Queue()  # type: Queue
     results = deque()  # type: deque
     result = Result()  # type: Result
-    # total steps: dns + http + ping gateway + ping internet
-    total = 4  # type: int
+    families = [AF_INET6, AF_INET] if conf.ipv6 else [AF_INET]
+    family_results = {family: deque() for family in families}  # type: Dict
+    family_stops = {family: Event() for family in families}  # type: Dict
+    # steps of each family: dns + http + ping gateway + ping internet
+    family_steps = 4  # type: int
+    total = family_steps * len(families)  # type: int
     step_counter = 0  # type: int
     event_stop = Event()  # type: Event
+    scheduler_wait = scheduler.total_wait  # type: float
 
-    def _ns_ipv4(names: List[str], urls: List[str], rq: deque, dq: Queue, stop: Event):
+    def _ns(
+        family: int,
+        names: List[str],
+        urls: List[str],
+        rq: deque,
+        dq: Queue,
+        stop: Event,
+    ):
         # @TODO: pass stop event to check commands
-        name, _, _, _ = check_dns(names, stop)
-        dq.put("dns")
+        name_server = conf.resolver if family == AF_INET else conf.ipv6_resolver
+        name, _, dns_time, _ = check_dns(
+            names,
+            stop,
+            name_server,
+            conf.resolver_port,
+            conf.resolver_timeout,
+            dns_cache,
+            family,
+        )
         rq.append(("dns", True if name else False))
+        rq.append(("dns_time", dns_time))
+        dq.put((family, "dns", bool(name)))
         if stop.is_set():
             return
         # @TODO: pass stop event to check commands
-        ipv4, _ = get_visible_ipv4(urls) if name else "", 0
-        dq.put("http")
-        rq.append(("ipv4", ipv4))
-        rq.append(("http", True if ipv4 else False))
+        get_visible_ip = get_visible_ipv6 if family == AF_INET6 else get_visible_ipv4
+        ip, http_time = "", 0.0
+        if name:
+            ip, http_time = get_visible_ip(
+                urls, stop, dns_cache, name_server, conf.resolver_port
+            )
+        rq.append(("ipv6" if family == AF_INET6 else "ipv4", ip))
+        rq.append(("http_time", http_time))
+        rq.append(("http", True if ip else False))
+        dq.put((family, "http", bool(ip)))
 
-    def _ping_gw(gw: str, rq: deque, dq: Queue, stop: Event):
+    def _ping_gw(family: int, gw: str, rq: deque, dq: Queue, stop: Event):
         # @TODO: pass stop event to check commands
-        host, ping_stats = check_ping_ipv4([gw], stop)
-        dq.put("gw")
+        check_ping = check_ping_ipv6 if family == AF_INET6 else check_ping_ipv4
+        host, ping_stats = "", PingStats()
+        if gw:
+            host, ping_stats = check_ping([gw], stop, conf.ping_port, conf.ping_timeout)
         rq.append(("gw", (host, ping_stats)))
+        dq.put((family, "gw", bool(host)))
 
-    def _ping_in(hosts: List[str], rq: deque, dq: Queue, stop: Event):
+    def _ping_in(family: int, hosts: List[str], rq: deque, dq: Queue, stop: Event):
         # @TODO: pass stop event to check commands
-        host, ping_stats = check_ping_ipv4(hosts, stop)
-        dq.put("internet")
+        check_ping = check_ping_ipv6 if family == AF_INET6 else check_ping_ipv4
+        host, ping_stats = check_ping(hosts, stop, conf.ping_port, conf.ping_timeout)
         rq.append(("internet", (host, ping_stats)))
+        dq.put((family, "internet", bool(host)))
+
+    def _measure_dns(name_server: str, domain: str, rq: deque):
+        cold, warm = check_dns_cold_warm(
+            name_server, domain, conf.resolver_port, conf.resolver_timeout
+        )
+        rq.append(("dns_cold_warm", (cold, warm)))
+
+    def _probe_capacity(host: str, port: int, rq: deque):
+        rq.append(("capacity", check_capacity(host, port)))
+
+    def _query_transport(uri: str, pool: TransportPool, rq: deque):
+        try:
+            transport = pool.get(uri, conf.resolver_timeout)
+        except ValueError as err:
+            logger.warning("{}".format(err))
+            return
+        rq.append(("dns_transport", check_dns_transport(transport, conf.hostnames)))
+
+    def _probe_https(urls: List[str], sessions: TlsSessions, rq: deque):
+        rq.append(("https", check_https(urls, event_stop, sessions)))
+
+    def _trace_path(hosts: List[str], rq: deque):
+        _, hops = check_path(hosts, conf.trace_timeout)
+        rq.append(("path", hops))
+
+    def _probe_mtu(host: str, rq: deque):
+        rq.append(("mtu", check_path_mtu(host, conf.ping_port)))
+
+    def _bound(target: Callable, family: int = AF_INET) -> Callable:
+        # bind probes of the check thread to the interface of the conf,
+        # the source address is only for IPv4
+        source = conf.source_address if family == AF_INET else ""
+
+        def _run(*args):
+            with Binding(conf.interface, source):
+                target(*args)
+
+        return _run
 
     # @TODO: pass an event to stop the check threads
     check_threads = []  # type: List[Thread]
-    check_threads.append(
-        Thread(
-            target=_ping_gw, args=(conf.ipv4_gateway, results, steps_done, event_stop)
+    name_servers = [conf.resolver] + conf.name_servers + conf.ipv4_default_name_servers
+    name_servers = [n for n in name_servers if n]
+    if conf.dns_measure_domain and name_servers:
+        check_threads.append(
+            Thread(
+                target=_bound(_measure_dns),
+                args=(name_servers[0], conf.dns_measure_domain, results),
+            )
+        )
+    if conf.capacity_host:
+        check_threads.append(
+            Thread(
+                target=_bound(_probe_capacity),
+                args=(conf.capacity_host, conf.capacity_port, results),
+            )
         )
-    )
-    check_threads.append(
-        Thread(
-            target=_ping_in,
-            args=(conf.ipv4_ping_hosts, results, steps_done, event_stop),
+    pool = transports or TransportPool()
+    for uri in conf.dns_transports:
+        check_threads.append(
+            Thread(target=_bound(_query_transport), args=(uri, pool, results))
         )
-    )
-    check_threads.append(
-        Thread(
-            target=_ns_ipv4,
-            args=(conf.hostnames, conf.ipv4_echo_urls, results, steps_done, event_stop),
+    if conf.https_echo_urls:
+        check_threads.append(
+            Thread(
+                target=_bound(_probe_https),
+                args=(conf.https_echo_urls, tls_sessions or TlsSessions(), results),
+            )
+        )
+    if conf.trace_path:
+        check_threads.append(
+            Thread(target=_bound(_trace_path), args=(conf.ipv4_ping_hosts, results))
         )
-    )
+    if conf.path_mtu:
+        mtu_hosts = [conf.ipv4_gateway] if conf.ipv4_gateway else []
+        for host in mtu_hosts + conf.ipv4_ping_hosts:
+            check_threads.append(
+                Thread(target=_bound(_probe_mtu), args=(host, results))
+            )
+    # checks of each IP family run as daemons, so the rest of the checks of
+    # a failing family can be abandoned once the other is known to work
+    family_threads = {}  # type: Dict[int, List[Thread]]
+    for family in families:
+        if family == AF_INET6:
+            gateway, hosts, urls = (
+                conf.ipv6_gateway,
+                conf.ipv6_ping_hosts,
+                conf.ipv6_echo_urls,
+            )
+        else:
+            gateway, hosts, urls = (
+                conf.ipv4_gateway,
+                conf.ipv4_ping_hosts,
+                conf.ipv4_echo_urls,
+            )
+        rq, stop = family_results[family], family_stops[family]
+        family_threads[family] = [
+            Thread(
+                target=_bound(target, family),
+                args=(family,) + args + (rq, steps_done, stop),
+                daemon=True,
+            )
+            for target, args in (
+                (_ping_gw, (gateway,)),
+                (_ping_in, (hosts,)),
+                (_ns, (conf.hostnames, urls)),
+            )
+        ]
+        check_threads.extend(family_threads[family])
     for th in check_threads:
         th.start()
 
+    # steps of each family done, and if they succeeded
+    family_done = {family: {} for family in families}  # type: Dict[int, Dict]
+    # results of the abandoned families, as they were when abandoned
+    abandoned = {}  # type: Dict[int, deque]
+
+    def _family_works(family: int) -> bool:
+        done = family_done[family]
+        return len(done) == family_steps and any(
+            done.get(step) for step in ("internet", "http")
+        )
+
+    def _family_fails(family: int) -> bool:
+        done = family_done[family]
+        reached = [done[step] for step in ("internet", "http") if step in done]
+        return len(done) < family_steps and bool(reached) and not any(reached)
+
+    def _unknown_steps(family: int) -> List[str]:
+        if family not in abandoned:
+            return []
+        steps = ("gw", "internet", "dns", "http")
+        return [step for step in steps if step not in family_done[family]]
+
+    grace_deadline = 0.0
     while step_counter < total:
-        _ = steps_done.get()
+        try:
+            timeout = max(0.0, grace_deadline - time()) if grace_deadline else None
+            family, step, ok = steps_done.get(timeout=timeout)
+        except Empty:
+            # happy eyeballs: a family works, don't wait for the remaining
+            # checks of the family that already failed to reach the Internet
+            grace_deadline = 0.0
+            for family in families:
+                if family in abandoned or not _family_fails(family):
+                    continue
+                logger.info("abandoning checks of failed family {}".format(family))
+                family_stops[family].set()
+                abandoned[family] = deque(family_results[family])
+                check_threads = [
+                    th for th in check_threads if th not in family_threads[family]
+                ]
+                step_counter += family_steps - len(family_done[family])
+            if observer:
+                observer(total, step_counter)
+            continue
+        if family in abandoned:
+            continue
         step_counter += 1
+        family_done[family][step] = ok
         if observer and observer(total, step_counter) == False:
             event_stop.set()
+            for stop in family_stops.values():
+                stop.set()
             break
+        if (
+            not grace_deadline
+            and any(_family_works(f) for f in families)
+            and any(_family_fails(f) and f not in abandoned for f in families)
+        ):
+            grace_deadline = time() + conf.family_grace
 
     for th in check_threads:
         th.join()
 
+    # measure throughput after the other checks, since saturating the link
+    # affects their latency
+    for direction, url in (
+        (DOWNLOAD, conf.throughput_download_url),
+        (UPLOAD, conf.throughput_upload_url),
+    ):
+        if url and not event_stop.is_set():
+            with Binding(conf.interface, conf.source_address):
+                stats = check_throughput(
+                    direction, url, conf.throughput_duration, conf.throughput_streams
+                )
+            results.append((direction, stats))
+
+    if transports is None:
+        pool.close()
+
+    with span("diagnose_network.merge"):
+        result.scheduler_wait = (scheduler.total_wait - scheduler_wait) * 1000
+        _merge(result, results)
+        _merge(result, abandoned.get(AF_INET, family_results[AF_INET]))
+        result.unknown = _unknown_steps(AF_INET)
+        if conf.ipv6:
+            result.ipv6_result = Result()
+            _merge(
+                result.ipv6_result, abandoned.get(AF_INET6, family_results[AF_INET6])
+            )
+            result.ipv6_result.unknown = _unknown_steps(AF_INET6)
+            result.ipv6 = result.ipv6_result.ipv6
+
+    # even if ping didn't work, since DNS worked it's safe to say
+    # Internet connection works
+    if result.dns:
+        result.internet = True
+        result.localnet = True
+
+    return result
+
+
+def _merge(result: Result, results: deque) -> None:
+    """Merge the results of the checks into the Result"""
     while len(results):
-        type_, val = results.pop()
+        type_, val = results.popleft()
         if type_ == "dns":
             result.dns = bool(val)
+        elif type_ == "dns_time":
+            result.dns_time = float(val)
+        elif type_ == "dns_cold_warm":
+            result.dns_cold_time, result.dns_warm_time = val
+        elif type_ == "http_time":
+            result.http_time = float(val)
         elif type_ == "ipv4":
             result.ipv4 = str(val)
+        elif type_ == "ipv6":
+            result.ipv6 = str(val)
         elif type_ == "http":
             result.http = bool(val)
         elif type_ == "gw":
-            gateway, result.gateway_ping_stats = val
-            result.localnet = gateway != ""
+            result.gateway, result.gateway_ping_stats = val
+            result.localnet = result.gateway != ""
         elif type_ == "internet":
-            remote_host, result.internet_ping_stats = val
-            result.internet = remote_host != ""
+            result.internet_host, result.internet_ping_stats = val
+            result.internet = result.internet_host != ""
+        elif type_ == "path":
+            result.path_hops = val
+        elif type_ == "mtu":
+            result.mtu_stats.append(val)
+        elif type_ == "dns_transport":
+            result.dns_transports.append(val)
+        elif type_ == "https":
+            result.https_stats = val
+        elif type_ == "capacity":
+            result.capacity_stats = val
+        elif type_ == DOWNLOAD:
+            result.download_stats = val
+        elif type_ == UPLOAD:
+            result.upload_stats = val
 
-    # even if ping didn't work, since DNS worked it's safe to say
-    # Internet connection works
-    if result.dns:
-        result.internet = True
-        result.localnet = True
 
+def diagnose_uplinks(
+    conf: Conf,
+    routes: List[Route],
+    observer: Optional[Observer] = None,
+) -> Result:
+    """Diagnose the network paths through all the routes concurrently, binding
+    the probes of each path to the interface of the route, so health of all
+    the uplinks is known within the same diagnosis window.
+    Names are resolved with the configured name servers, since the system
+    resolver can't be bound to an interface.
+    Returns the overall Result, which is the result of the preferred uplink
+    (first in routes) with Internet access, with results of all the uplinks.
+    The observer is notified of the total progress of all the uplinks.
+    """
+    uplinks = []  # type: List[Uplink]
+    progress = {}  # type: Dict[int, int]
+    lock = Lock()
+
+    def _observe(idx: int) -> Callable[[int, int], Optional[bool]]:
+        def _on_progress(total: int, step: int) -> Optional[bool]:
+            with lock:
+                progress[idx] = step
+                done = sum(progress.values())
+            return observer(total * len(routes), done) if observer else None
+
+        return _on_progress
+
+    def _diagnose(idx: int, uplink: Uplink, uplink_conf: Conf):
+        uplink.result = diagnose_network(uplink_conf, _observe(idx))
+        uplink.result.on_link = not uplink.route.gateway
+
+    name_servers = conf.name_servers + conf.ipv4_default_name_servers
+    threads = []  # type: List[Thread]
+    for idx, route in enumerate(routes):
+        uplink = Uplink(route, get_interface_ipv4(route.interface))
+        uplink_conf = copy(conf)
+        uplink_conf.interface = route.interface
+        uplink_conf.source_address = uplink.source
+        uplink_conf.ipv4_gateway = route.gateway
+        # routes are IPv4, the IPv6 checks can't be bound to their sources
+        uplink_conf.ipv6 = False
+        if not uplink_conf.resolver and name_servers:
+            uplink_conf.resolver = name_servers[0]
+        uplinks.append(uplink)
+        threads.append(Thread(target=_diagnose, args=(idx, uplink, uplink_conf)))
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+    working = [u for u in uplinks if u.result.internet]
+    preferred = working[0] if working else (uplinks[0] if uplinks else None)
+    result = copy(preferred.result) if preferred else Result()
+    result.uplinks = uplinks
     return result
@@ -0,0 +1,346 @@
+"""
+vaslam.dns
+==========
+
+minimal DNS messages encoding/decoding and queries to name servers
+"""
+import struct
+import socket
+from time import time
+from random import randint
+from threading import Lock
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from vaslam.net import DnsConError, new_socket
+from vaslam.recorder import record
+from vaslam.scheduler import scheduler
+
+
+TYPE_A = 1  # type: int
+TYPE_CNAME = 5  # type: int
+TYPE_AAAA = 28  # type: int
+CLASS_IN = 1  # type: int
+RCODE_NOERROR = 0  # type: int
+RCODE_SERVFAIL = 2  # type: int
+RCODE_NXDOMAIN = 3  # type: int
+
+_FLAG_QR = 0x8000
+_FLAG_RD = 0x0100
+_FLAG_RA = 0x0080
+_HEADER = struct.Struct("!HHHHHH")
+
+
+class DnsRecord:
+    def __init__(self, name: str = "", type_: int = TYPE_A, ttl: int = 0, data=""):
+        self.name = name  # type: str
+        self.type = type_  # type: int
+        self.ttl = ttl  # type: int
+        self.data = data  # type: str
+
+
+class DnsMessage:
+    def __init__(self):
+        self.id = 0  # type: int
+        self.flags = 0  # type: int
+        self.questions = []  # type: List[Tuple[str, int]]
+        self.answers = []  # type: List[DnsRecord]
+
+    @property
+    def rcode(self) -> int:
+        return self.flags & 0xF
+
+    @property
+    def is_response(self) -> bool:
+        return bool(self.flags & _FLAG_QR)
+
+    def addresses(self, type_: int = TYPE_A) -> List[str]:
+        return [r.data for r in self.answers if r.type == type_]
+
+    def min_ttl(self) -> int:
+        return min([r.ttl for r in self.answers] or [0])
+
+
+def _encode_name(name: str) -> bytes:
+    parts = []
+    for label in name.rstrip(".").split("."):
+        if not label:
+            continue
+        encoded = label.encode("idna")
+        if len(encoded) > 63:
+            raise ValueError("DNS label is too long: {}".format(label))
+        parts.append(bytes((len(encoded),)) + encoded)
+    return b"".join(parts) + b"\x00"
+
+
+def _decode_name(data: bytes, offset: int) -> Tuple[str, int]:
+    """Decode a possibly compressed name from data at offset.
+    Return the name and the offset after the name.
+    """
+    labels = []
+    end = -1
+    jumps = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("truncated DNS name")
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(data):
+                raise ValueError("truncated DNS name pointer")
+            if end < 0:
+                end = offset + 2
+            jumps += 1
+            if jumps > 64:
+                raise ValueError("DNS name compression loop")
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset : offset + length].decode("ascii", "replace"))
+        offset += length
+    return ".".join(labels), (end if end >= 0 else offset)
+
+
+def encode_query(name: str, type_: int = TYPE_A, msg_id: int = -1) -> bytes:
+    """Encode a recursive query message for the name"""
+    if msg_id < 0:
+        msg_id = randint(0, 0xFFFF)
+    header = _HEADER.pack(msg_id, _FLAG_RD, 1, 0, 0, 0)
+    return header + _encode_name(name) + struct.pack("!HH", type_, CLASS_IN)
+
+
+def encode_response(
+    query: DnsMessage, answers: List[DnsRecord], rcode: int = RCODE_NOERROR
+) -> bytes:
+    """Encode a response message to the query with the answers"""
+    flags = _FLAG_QR | _FLAG_RA | (query.flags & _FLAG_RD) | (rcode & 0xF)
+    parts = [_HEADER.pack(query.id, flags, len(query.questions), len(answers), 0, 0)]
+    for name, type_ in query.questions:
+        parts.append(_encode_name(name) + struct.pack("!HH", type_, CLASS_IN))
+    for rec in answers:
+        if rec.type == TYPE_A:
+            rdata = socket.inet_pton(socket.AF_INET, rec.data)
+        elif rec.type == TYPE_AAAA:
+            rdata = socket.inet_pton(socket.AF_INET6, rec.data)
+        elif rec.type == TYPE_CNAME:
+            rdata = _encode_name(rec.data)
+        else:
+            rdata = rec.data.encode("utf-8")
+        parts.append(
+            _encode_name(rec.name)
+            + struct.pack("!HHIH", rec.type, CLASS_IN, rec.ttl, len(rdata))
+            + rdata
+        )
+    return b"".join(parts)
+
+
+def decode(data: bytes) -> DnsMessage:
+    """Decode a DNS message.
+
+    :raises: ValueError if the message is malformed
+    """
+    if len(data) < _HEADER.size:
+        raise ValueError("DNS message is too short")
+    msg = DnsMessage()
+    msg.id, msg.flags, qdcount, ancount, _, _ = _HEADER.unpack_from(data)
+    offset = _HEADER.size
+    for _ in range(qdcount):
+        name, offset = _decode_name(data, offset)
+        if offset + 4 > len(data):
+            raise ValueError("truncated DNS question")
+        type_, _ = struct.unpack_from("!HH", data, offset)
+        offset += 4
+        msg.questions.append((name, type_))
+    for _ in range(ancount):
+        name, offset = _decode_name(data, offset)
+        if offset + 10 > len(data):
+            raise ValueError("truncated DNS answer")
+        type_, _, ttl, rdlength = struct.unpack_from("!HHIH", data, offset)
+        offset += 10
+        rdata = data[offset : offset + rdlength]
+        if len(rdata) != rdlength:
+            raise ValueError("truncated DNS answer data")
+        if type_ == TYPE_A and rdlength == 4:
+            value = socket.inet_ntop(socket.AF_INET, rdata)
+        elif type_ == TYPE_AAAA and rdlength == 16:
+            value = socket.inet_ntop(socket.AF_INET6, rdata)
+        elif type_ == TYPE_CNAME:
+            value, _ = _decode_name(data, offset)
+        else:
+            value = rdata.hex()
+        offset += rdlength
+        msg.answers.append(DnsRecord(name, type_, ttl, value))
+    return msg
+
+
+def query(
+    name_server: str,
+    name: str,
+    type_: int = TYPE_A,
+    port: int = 53,
+    timeout: float = 5,
+) -> Tuple[DnsMessage, float]:
+    """Query the name server for the name over UDP.
+    Return the response message and the miliseconds it took.
+
+    :raises: DnsConError on timeout or invalid responses
+    """
+    family = socket.AF_INET6 if ":" in name_server else socket.AF_INET
+    msg_id = randint(0, 0xFFFF)
+    request = encode_query(name, type_, msg_id)
+    try:
+        sock = new_socket(family, socket.SOCK_DGRAM)
+    except OSError as err:
+        raise DnsConError(
+            "failed to query {} from {}: {}".format(name, name_server, err)
+        )
+    with sock, scheduler.slot(name_server):
+        sock.settimeout(timeout)
+        try:
+            sock.connect((name_server, port))
+            start = time()
+            deadline = start + timeout
+            sock.send(request)
+            while True:
+                data = sock.recv(4096)
+                dur = (time() - start) * 1000
+                try:
+                    msg = decode(data)
+                except ValueError:
+                    msg = None
+                if msg and msg.id == msg_id and msg.is_response:
+                    return msg, dur
+                remaining = deadline - time()
+                if remaining <= 0:
+                    raise socket.timeout()
+                sock.settimeout(remaining)
+        except OSError as err:
+            raise DnsConError(
+                "failed to query {} from {}: {}".format(name, name_server, err)
+            )
+
+
+class DnsCache:
+    """Cache of resolved addresses, expiring entries after their TTL.
+    Answers of the system resolver have no TTL, and are cached for default_ttl.
+    Least recently used entries are evicted when there are max_entries.
+    """
+
+    def __init__(self, max_entries: int = 256, default_ttl: int = 60):
+        self.max_entries = max_entries  # type: int
+        self.default_ttl = default_ttl  # type: int
+        self.hits = 0  # type: int
+        self.misses = 0  # type: int
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = Lock()
+
+    def get(self, name: str, type_: int = TYPE_A, now: float = 0) -> List[str]:
+        """Return cached addresses of the name, empty if not cached or expired"""
+        key = (name.lower().rstrip("."), type_)
+        now = now or time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return []
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def put(
+        self, name: str, type_: int, addrs: List[str], ttl: int, now: float = 0
+    ) -> None:
+        if not addrs or ttl <= 0:
+            return
+        key = (name.lower().rstrip("."), type_)
+        with self._lock:
+            self._entries[key] = ((now or time()) + ttl, list(addrs))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(
+        self,
+        name: str,
+        name_server: str = "",
+        port: int = 53,
+        timeout: float = 5,
+        type_: int = TYPE_A,
+    ) -> str:
+        """Return an address of the name (IPv4 for A, IPv6 for AAAA type),
+        from the cache if possible.
+        Resolves the name by querying the name server if specified, or the system
+        resolver, and caches the answer.
+        Returns empty string if the name could not be resolved.
+        """
+        addrs = self.get(name, type_)
+        if addrs:
+            return addrs[0]
+        if name_server:
+            host, addr, _, _ = resolve_any_hostname(
+                [name], name_server, port, timeout, self, type_
+            )
+            return addr
+        try:
+            if type_ == TYPE_AAAA:
+                addr = str(socket.getaddrinfo(name, None, socket.AF_INET6)[0][4][0])
+            else:
+                addr = socket.gethostbyname(name)
+        except (OSError, IndexError):
+            return ""
+        self.put(name, type_, [addr], self.default_ttl)
+        return addr
+
+
+def resolve_any_hostname(
+    hostnames: List[str],
+    name_server: str,
+    port: int = 53,
+    timeout: float = 5,
+    cache: Optional[DnsCache] = None,
+    type_: int = TYPE_A,
+) -> Tuple[str, str, float, str]:
+    """Resolve IPv4 (or IPv6 for AAAA type) of the provided hostnames
+    querying the name server.
+    Return a tuple of info of:
+        - the first resolved hostname
+        - the resolved address
+        - miliseconds that took to resolve
+        - IP address of the resolver
+    Returns empty strings and zero numerics if none could be resolved.
+    Answers are always queried, and stored in the cache if provided.
+    """
+    for hostname in hostnames:
+        try:
+            msg, dur = query(name_server, hostname, type_, port, timeout)
+        except DnsConError as err:
+            record("dns_error", hostname, err)
+            continue
+        addrs = msg.addresses(type_)
+        record("dns", hostname, (addrs, msg.rcode, msg.min_ttl(), dur, name_server))
+        if cache is not None:
+            cache.put(hostname, type_, addrs, msg.min_ttl())
+        if addrs:
+            return hostname, addrs[0], dur, name_server
+    return "", "", 0, ""
+
+
+def measure_resolver(
+    name_server: str, domain: str, port: int = 53, timeout: float = 5
+) -> Tuple[float, float]:
+    """Measure miliseconds the name server takes to resolve names of the domain,
+    when the answer is not cached (cold) and when it is cached (warm).
+    Cold resolution queries a unique sub domain, so the name server has to do
+    the full recursive lookup. Warm resolution queries the domain after it's
+    been resolved once.
+    Return a tuple of cold and warm durations.
+
+    :raises: DnsConError on timeout or invalid responses
+    """
+    unique = "vaslam-{:08x}.{}".format(randint(0, 0xFFFFFFFF), domain)
+    _, cold = query(name_server, unique, TYPE_A, port, timeout)
+    query(name_server, domain, TYPE_A, port, timeout)
+    _, warm = query(name_server, domain, TYPE_A, port, timeout)
+    return cold, warm
@@ -0,0 +1,128 @@
+"""
+vaslam.dnsbench
+===============
+
+benchmark and rank name servers
+"""
+from random import randint
+from logging import getLogger
+from threading import Thread
+from typing import List
+from vaslam.dns import query, TYPE_A, RCODE_NOERROR, RCODE_NXDOMAIN
+from vaslam.net import DnsConError
+
+
+logger = getLogger(__name__)
+
+SYSTEM = "system"  # type: str
+PUBLIC = "public"  # type: str
+
+
+class ResolverStats:
+    """Benchmark results of a name server. Latencies are in miliseconds"""
+
+    def __init__(self, name_server: str, source: str = ""):
+        self.name_server = name_server  # type: str
+        self.source = source  # type: str
+        self.queries = 0  # type: int
+        self.timeouts = 0  # type: int
+        self.incorrect = 0  # type: int
+        self.latencies = []  # type: List[float]
+
+    def percentile(self, pct: float) -> float:
+        if not self.latencies:
+            return 0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+    @property
+    def median(self) -> float:
+        return self.percentile(50)
+
+    @property
+    def error_rate(self) -> float:
+        if not self.queries:
+            return 1.0
+        return (self.timeouts + self.incorrect) / float(self.queries)
+
+
+def _bench_resolver(
+    stats: ResolverStats,
+    hostnames: List[str],
+    rounds: int,
+    port: int,
+    timeout: float,
+    offset: int,
+) -> None:
+    for i in range(rounds):
+        # rotate names, and every few rounds check a name that doesn't exist
+        # to detect name servers hijacking NXDOMAIN answers
+        hostname = hostnames[(i + offset) % len(hostnames)]
+        exists = i % 4 != 3
+        if not exists:
+            hostname = "vaslam-{:08x}.{}".format(randint(0, 0xFFFFFFFF), hostname)
+        stats.queries += 1
+        try:
+            msg, dur = query(stats.name_server, hostname, TYPE_A, port, timeout)
+        except DnsConError as err:
+            logger.debug("name server benchmark query failed: {}".format(err))
+            stats.timeouts += 1
+            continue
+        stats.latencies.append(dur)
+        if exists:
+            correct = msg.rcode == RCODE_NOERROR and bool(msg.addresses(TYPE_A))
+        else:
+            correct = msg.rcode == RCODE_NXDOMAIN
+        if not correct:
+            stats.incorrect += 1
+
+
+def bench_resolvers(
+    system_name_servers: List[str],
+    public_name_servers: List[str],
+    hostnames: List[str],
+    rounds: int = 8,
+    port: int = 53,
+    timeout: float = 2,
+) -> List[ResolverStats]:
+    """Query all the name servers concurrently, rotating the hostnames.
+    Return the stats of the name servers ranked from the best.
+    Name servers with more than 20% errors are ranked after the rest.
+    """
+    all_stats = []  # type: List[ResolverStats]
+    seen = set()
+    for source, name_servers in (
+        (SYSTEM, system_name_servers),
+        (PUBLIC, public_name_servers),
+    ):
+        for name_server in name_servers:
+            if name_server not in seen:
+                seen.add(name_server)
+                all_stats.append(ResolverStats(name_server, source))
+    threads = [
+        Thread(
+            target=_bench_resolver,
+            args=(stats, hostnames, rounds, port, timeout, offset),
+        )
+        for offset, stats in enumerate(all_stats)
+    ]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return sorted(all_stats, key=lambda s: (s.error_rate > 0.2, s.median))
+
+
+def slow_system_resolver(
+    ranked: List[ResolverStats], ratio: float = 2.0, min_delta: float = 20.0
+) -> bool:
+    """Return True if the best system name server is much slower than the
+    best public one, by ratio times and at least min_delta miliseconds.
+    """
+    working = [s for s in ranked if s.error_rate <= 0.2]
+    system = [s for s in working if s.source == SYSTEM]
+    public = [s for s in working if s.source == PUBLIC]
+    if not system or not public:
+        return False
+    sys_median, pub_median = system[0].median, public[0].median
+    return sys_median - pub_median >= min_delta and sys_median >= pub_median * ratio
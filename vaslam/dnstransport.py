@@ -0,0 +1,284 @@
+"""
+vaslam.dnstransport
+===================
+
+DNS queries over TCP, TLS (DoT) and HTTPS (DoH), keeping the connections open
+between the queries
+"""
+import ssl
+import socket
+import struct
+from time import time
+from random import randint
+from logging import getLogger
+from threading import Lock
+from http.client import HTTPConnection, HTTPException
+from urllib.parse import urlsplit
+from typing import Dict, Optional, Tuple
+from vaslam.net import DnsConError, connect_tcp
+from vaslam.dns import DnsMessage, TYPE_A, decode, encode_query
+from vaslam.recorder import record
+from vaslam.scheduler import scheduler
+
+
+logger = getLogger(__name__)
+
+TCP = "tcp"  # type: str
+TLS = "tls"  # type: str
+HTTPS = "https"  # type: str
+
+DOH_CONTENT_TYPE = "application/dns-message"  # type: str
+
+
+class TransportStats:
+    """Timings of a DNS query over a transport, in miliseconds.
+    Connect and handshake times are zero if the query reused the connection.
+    """
+
+    def __init__(self, transport: str = "", server: str = ""):
+        self.transport = transport  # type: str
+        self.server = server  # type: str
+        self.ok = False  # type: bool
+        self.reused = False  # type: bool
+        self.connect_time = 0  # type: float
+        self.handshake_time = 0  # type: float
+        self.query_time = 0  # type: float
+        self.error = ""  # type: str
+
+
+class DnsTransport:
+    """Queries a name server over TCP, keeping the connection open for the next
+    queries. If a reused connection was closed by the name server, the query
+    is retried on a new connection.
+    """
+
+    transport = TCP  # type: str
+    default_port = 53  # type: int
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 0,
+        timeout: float = 5,
+        context: Optional[ssl.SSLContext] = None,
+    ):
+        self.host = host  # type: str
+        self.port = port or self.default_port  # type: int
+        self.timeout = timeout  # type: float
+        self.context = context  # type: Optional[ssl.SSLContext]
+        self.connections = 0  # type: int
+        self._sock = None  # type: Optional[socket.socket]
+        self._lock = Lock()
+
+    @property
+    def server(self) -> str:
+        return "{}://{}:{}".format(self.transport, self.host, self.port)
+
+    def query(
+        self, name: str, type_: int = TYPE_A
+    ) -> Tuple[DnsMessage, TransportStats]:
+        """Query the name server for the name.
+        Return the response message and the stats of the query.
+
+        :raises: DnsConError on timeout or invalid responses
+        """
+        stats = TransportStats(self.transport, self.server)
+        msg_id = randint(0, 0xFFFF)
+        request = encode_query(name, type_, msg_id)
+        with self._lock, scheduler.slot(self.host):
+            for attempt in range(2):
+                stats.reused = self._sock is not None
+                try:
+                    if self._sock is None:
+                        self._connect(stats)
+                    start = time()
+                    msg = decode(self._exchange(request))
+                    stats.query_time = (time() - start) * 1000
+                    if msg.id != msg_id or not msg.is_response:
+                        raise ValueError("invalid response message")
+                except (OSError, HTTPException, ValueError) as err:
+                    self._close()
+                    if stats.reused and not attempt:
+                        logger.debug(
+                            "retrying on a new connection to {}: {}".format(
+                                self.server, err
+                            )
+                        )
+                        continue
+                    record("dns_transport_error", name, (self.server, err))
+                    raise DnsConError(
+                        "failed to query {} from {}: {}".format(name, self.server, err)
+                    )
+                break
+        stats.ok = True
+        record("dns_transport", name, vars(stats))
+        return msg, stats
+
+    def _connect(self, stats: TransportStats) -> None:
+        start = time()
+        sock = connect_tcp((self.host, self.port), self.timeout)
+        stats.connect_time = (time() - start) * 1000
+        if self.context is not None:
+            start = time()
+            try:
+                sock = self.context.wrap_socket(sock, server_hostname=self.host)
+            except OSError:
+                sock.close()
+                raise
+            stats.handshake_time = (time() - start) * 1000
+        self._sock = sock
+        self.connections += 1
+
+    def _exchange(self, request: bytes) -> bytes:
+        """Send the request message, return the response message"""
+        sock = self._sock
+        if sock is None:
+            raise ConnectionResetError("not connected to the name server")
+        sock.sendall(struct.pack("!H", len(request)) + request)
+        (length,) = struct.unpack("!H", self._recv(sock, 2))
+        return self._recv(sock, length)
+
+    def _recv(self, sock: socket.socket, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionResetError("connection closed by the name server")
+            data += chunk
+        return data
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+
+class TlsTransport(DnsTransport):
+    """Queries a name server over TLS (DoT), verifying the certificate of the
+    host with the context, or the system CAs by default.
+    """
+
+    transport = TLS
+    default_port = 853
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 0,
+        timeout: float = 5,
+        context: Optional[ssl.SSLContext] = None,
+    ):
+        super().__init__(host, port, timeout, context or ssl.create_default_context())
+
+
+class HttpsTransport(TlsTransport):
+    """Queries a name server over HTTPS (DoH), POSTing the messages to the URL
+    on a keep-alive connection.
+    """
+
+    transport = HTTPS
+    default_port = 443
+
+    def __init__(
+        self, url: str, timeout: float = 5, context: Optional[ssl.SSLContext] = None
+    ):
+        parts = urlsplit(url)
+        super().__init__(parts.hostname or "", parts.port or 0, timeout, context)
+        self.url = url  # type: str
+        self.path = parts.path or "/dns-query"  # type: str
+        self._conn = None  # type: Optional[HTTPConnection]
+
+    @property
+    def server(self) -> str:
+        return self.url
+
+    def _connect(self, stats: TransportStats) -> None:
+        super()._connect(stats)
+        self._conn = HTTPConnection(self.host, self.port, timeout=self.timeout)
+        self._conn.sock = self._sock
+
+    def _exchange(self, request: bytes) -> bytes:
+        conn = self._conn
+        if conn is None:
+            raise ConnectionResetError("not connected to the name server")
+        headers = {"Content-Type": DOH_CONTENT_TYPE, "Accept": DOH_CONTENT_TYPE}
+        conn.request("POST", self.path, request, headers)
+        resp = conn.getresponse()
+        body = resp.read()
+        if conn.sock is None:
+            # the name server closes the connection after the response
+            self._sock = None
+        if resp.status != 200:
+            raise ValueError("unexpected HTTP status {}".format(resp.status))
+        return body
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        super()._close()
+
+
+def new_transport(
+    uri: str, timeout: float = 5, context: Optional[ssl.SSLContext] = None
+) -> DnsTransport:
+    """Return the transport of the URI, tcp://host[:port], tls://host[:port]
+    or the https:// URL of a DoH name server.
+
+    :raises: ValueError on unsupported URIs
+    """
+    parts = urlsplit(uri)
+    if parts.scheme == HTTPS:
+        return HttpsTransport(uri, timeout, context)
+    if not parts.hostname:
+        raise ValueError("no host in DNS transport {}".format(uri))
+    if parts.scheme == TCP:
+        return DnsTransport(parts.hostname, parts.port or 0, timeout)
+    if parts.scheme == TLS:
+        return TlsTransport(parts.hostname, parts.port or 0, timeout, context)
+    raise ValueError("unsupported DNS transport {}".format(uri))
+
+
+def query_transport(
+    transport: DnsTransport, name: str, type_: int = TYPE_A
+) -> TransportStats:
+    """Query the name server of the transport for the name.
+    Return the stats of the query.
+
+    :raises: DnsConError on timeout or invalid responses
+    """
+    _, stats = transport.query(name, type_)
+    return stats
+
+
+class TransportPool:
+    """Transports by their URI, so the connections are reused across the
+    diagnosis cycles
+    """
+
+    def __init__(self, context: Optional[ssl.SSLContext] = None):
+        self.context = context  # type: Optional[ssl.SSLContext]
+        self._transports = {}  # type: Dict[str, DnsTransport]
+        self._lock = Lock()
+
+    def get(self, uri: str, timeout: float = 5) -> DnsTransport:
+        """Return the transport of the URI.
+
+        :raises: ValueError on unsupported URIs
+        """
+        with self._lock:
+            transport = self._transports.get(uri)
+            if transport is None:
+                transport = new_transport(uri, timeout, self.context)
+                self._transports[uri] = transport
+            return transport
+
+    def close(self) -> None:
+        with self._lock:
+            for transport in self._transports.values():
+                transport.close()
+            self._transports = {}
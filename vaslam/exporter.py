@@ -0,0 +1,331 @@
+"""
+vaslam.exporter
+===============
+
+export diagnosis results as Prometheus metrics
+"""
+import socket
+from bisect import bisect_left
+from logging import getLogger
+from threading import Lock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from vaslam.diag import Result, issue_message
+from vaslam.watch import Cycle
+from vaslam.system import Counters
+
+
+logger = getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"  # type: str
+
+HTTPS_PHASES = ("connect", "handshake", "first_byte")  # type: Tuple[str, ...]
+
+# bucket upper bounds in seconds
+default_latency_buckets = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)  # type: Tuple[float, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{{{}}}".format(
+        ",".join('{}="{}"'.format(name, _escape(val)) for name, val in labels)
+    )
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets"""
+
+    def __init__(self, buckets: Tuple[float, ...] = default_latency_buckets):
+        self.buckets = buckets  # type: Tuple[float, ...]
+        self.counts = [0] * (len(buckets) + 1)  # type: List[int]
+        self.sum = 0.0  # type: float
+        self.count = 0  # type: int
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: Tuple[Tuple[str, str], ...]) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(
+                "{}_bucket{} {}".format(
+                    name, _labels(labels + (("le", repr(bound)),)), cumulative
+                )
+            )
+        lines.append(
+            "{}_bucket{} {}".format(
+                name, _labels(labels + (("le", "+Inf"),)), self.count
+            )
+        )
+        lines.append("{}_sum{} {!r}".format(name, _labels(labels), self.sum))
+        lines.append("{}_count{} {}".format(name, _labels(labels), self.count))
+        return lines
+
+
+class Metrics:
+    """Pre-aggregated metrics of the diagnosis results.
+    Results are aggregated and rendered when updated, so getting the
+    metrics never probes the network nor does any aggregation.
+    """
+
+    def __init__(self):
+        self.lock = Lock()  # type: Lock
+        self.rtt = {}  # type: Dict[Tuple[str, str], Histogram]
+        self.packets_sent = {}  # type: Dict[Tuple[str, str], int]
+        self.packets_lost = {}  # type: Dict[Tuple[str, str], int]
+        self.dns_duration = Histogram()  # type: Histogram
+        self.http_duration = Histogram()  # type: Histogram
+        # durations of the phases of HTTPS requests
+        self.https_duration = {
+            phase: Histogram() for phase in HTTPS_PHASES
+        }  # type: Dict[str, Histogram]
+        self.status = {}  # type: Dict[str, int]
+        self.goodput = {}  # type: Dict[str, float]
+        self.capacity = 0.0  # type: float
+        self.queueing_delay = 0.0  # type: float
+        self.issues = {}  # type: Dict[int, int]
+        self.kernel_counters = {}  # type: Dict[str, int]
+        self.cycles = 0  # type: int
+        self.probe_duration = 0.0  # type: float
+        self.probe_cpu_seconds = 0.0  # type: float
+        self.probe_interval = 0.0  # type: float
+        self.rendered = self._render().encode("utf-8")  # type: bytes
+
+    def update(
+        self, result: Result, cycle: Cycle, issues: Optional[List[int]] = None
+    ) -> None:
+        """Aggregate the Result of the cycle, with its issues (the issues of
+        the Result by default)
+        """
+        if issues is None:
+            issues = result.get_issues()
+        with self.lock:
+            for path, target, ping_stats in (
+                ("gateway", result.gateway, result.gateway_ping_stats),
+                ("internet", result.internet_host, result.internet_ping_stats),
+            ):
+                if not target or ping_stats.packets_sent < 1:
+                    continue
+                key = (path, target)
+                if ping_stats.packets_recv > 0:
+                    if key not in self.rtt:
+                        self.rtt[key] = Histogram()
+                    self.rtt[key].observe(ping_stats.rtt_avg / 1000.0)
+                self.packets_sent[key] = (
+                    self.packets_sent.get(key, 0) + ping_stats.packets_sent
+                )
+                self.packets_lost[key] = self.packets_lost.get(key, 0) + (
+                    ping_stats.packets_sent - ping_stats.packets_recv
+                )
+            if result.dns:
+                self.dns_duration.observe(result.dns_time / 1000.0)
+            if result.http:
+                self.http_duration.observe(result.http_time / 1000.0)
+            https = result.https_stats
+            if https.ok:
+                durations = (
+                    https.connect_time,
+                    https.handshake_time,
+                    https.first_byte_time,
+                )
+                for phase, duration in zip(HTTPS_PHASES, durations):
+                    self.https_duration[phase].observe(duration / 1000.0)
+            for throughput in (result.download_stats, result.upload_stats):
+                if throughput.bytes > 0:
+                    self.goodput[throughput.direction] = throughput.goodput
+            if result.capacity_stats.capacity:
+                self.capacity = result.capacity_stats.capacity
+                self.queueing_delay = result.capacity_stats.queueing_delay / 1000.0
+            self.status = {
+                "localnet": int(result.localnet),
+                "internet": int(result.internet),
+                "dns": int(result.dns),
+                "http": int(result.http),
+            }
+            for code in self.issues:
+                self.issues[code] = 0
+            for code in issues:
+                self.issues[code] = 1
+            self.cycles += 1
+            self.probe_duration = cycle.duration
+            self.probe_cpu_seconds += cycle.cpu_time
+            self.probe_interval = cycle.interval
+            self.rendered = self._render().encode("utf-8")
+
+    def update_counters(self, counters: Counters) -> None:
+        """Add the changes of the kernel network counters to the totals"""
+        with self.lock:
+            for name, val in vars(counters).items():
+                if name not in ("sampled", "interval"):
+                    self.kernel_counters[name] = self.kernel_counters.get(name, 0) + val
+            self.rendered = self._render().encode("utf-8")
+
+    def _render(self) -> str:
+        lines = [
+            "# HELP vaslam_rtt_avg_seconds Average round trip time of the ping "
+            "probes of each cycle",
+            "# TYPE vaslam_rtt_avg_seconds histogram",
+        ]  # type: List[str]
+        for (path, target), hist in sorted(self.rtt.items()):
+            lines.extend(
+                hist.render(
+                    "vaslam_rtt_avg_seconds", (("path", path), ("target", target))
+                )
+            )
+        lines.append("# HELP vaslam_ping_packets_sent_total Ping packets sent")
+        lines.append("# TYPE vaslam_ping_packets_sent_total counter")
+        for (path, target), count in sorted(self.packets_sent.items()):
+            lines.append(
+                "vaslam_ping_packets_sent_total{} {}".format(
+                    _labels((("path", path), ("target", target))), count
+                )
+            )
+        lines.append("# HELP vaslam_ping_packets_lost_total Ping packets lost")
+        lines.append("# TYPE vaslam_ping_packets_lost_total counter")
+        for (path, target), count in sorted(self.packets_lost.items()):
+            lines.append(
+                "vaslam_ping_packets_lost_total{} {}".format(
+                    _labels((("path", path), ("target", target))), count
+                )
+            )
+        lines.append("# HELP vaslam_dns_duration_seconds Name resolution duration")
+        lines.append("# TYPE vaslam_dns_duration_seconds histogram")
+        lines.extend(self.dns_duration.render("vaslam_dns_duration_seconds", ()))
+        lines.append("# HELP vaslam_http_duration_seconds HTTP request duration")
+        lines.append("# TYPE vaslam_http_duration_seconds histogram")
+        lines.extend(self.http_duration.render("vaslam_http_duration_seconds", ()))
+        lines.append(
+            "# HELP vaslam_https_duration_seconds Duration of the phases of HTTPS "
+            "requests"
+        )
+        lines.append("# TYPE vaslam_https_duration_seconds histogram")
+        for phase in HTTPS_PHASES:
+            lines.extend(
+                self.https_duration[phase].render(
+                    "vaslam_https_duration_seconds", (("phase", phase),)
+                )
+            )
+        if self.goodput:
+            lines.append("# HELP vaslam_goodput_bits_per_second Last goodput")
+            lines.append("# TYPE vaslam_goodput_bits_per_second gauge")
+            for direction, val in sorted(self.goodput.items()):
+                lines.append(
+                    "vaslam_goodput_bits_per_second{} {}".format(
+                        _labels((("direction", direction),)), val
+                    )
+                )
+        if self.capacity:
+            lines.append("# HELP vaslam_capacity_bits_per_second Path capacity")
+            lines.append("# TYPE vaslam_capacity_bits_per_second gauge")
+            lines.append("vaslam_capacity_bits_per_second {}".format(self.capacity))
+            lines.append(
+                "# HELP vaslam_queueing_delay_seconds Queueing delay on the path"
+            )
+            lines.append("# TYPE vaslam_queueing_delay_seconds gauge")
+            lines.append("vaslam_queueing_delay_seconds {}".format(self.queueing_delay))
+        if self.kernel_counters:
+            lines.append(
+                "# HELP vaslam_kernel_counter_total Network counters of the kernel"
+            )
+            lines.append("# TYPE vaslam_kernel_counter_total counter")
+            for name, val in sorted(self.kernel_counters.items()):
+                lines.append(
+                    "vaslam_kernel_counter_total{} {}".format(
+                        _labels((("counter", name),)), val
+                    )
+                )
+        lines.append("# HELP vaslam_up Status of the checks, 1 if working")
+        lines.append("# TYPE vaslam_up gauge")
+        for check, val in sorted(self.status.items()):
+            lines.append("vaslam_up{} {}".format(_labels((("check", check),)), val))
+        lines.append("# HELP vaslam_issue Diagnosed issues, 1 if currently present")
+        lines.append("# TYPE vaslam_issue gauge")
+        for code, val in sorted(self.issues.items()):
+            labels = (("code", str(code)), ("issue", issue_message(code)))
+            lines.append("vaslam_issue{} {}".format(_labels(labels), val))
+        lines.append("# HELP vaslam_probe_cycles_total Diagnosis cycles")
+        lines.append("# TYPE vaslam_probe_cycles_total counter")
+        lines.append("vaslam_probe_cycles_total {}".format(self.cycles))
+        lines.append(
+            "# HELP vaslam_probe_duration_seconds Duration of the last diagnosis"
+        )
+        lines.append("# TYPE vaslam_probe_duration_seconds gauge")
+        lines.append("vaslam_probe_duration_seconds {!r}".format(self.probe_duration))
+        lines.append(
+            "# HELP vaslam_probe_cpu_seconds_total CPU time spent on diagnosis"
+        )
+        lines.append("# TYPE vaslam_probe_cpu_seconds_total counter")
+        lines.append(
+            "vaslam_probe_cpu_seconds_total {!r}".format(self.probe_cpu_seconds)
+        )
+        lines.append(
+            "# HELP vaslam_probe_interval_seconds Seconds to the next diagnosis"
+        )
+        lines.append("# TYPE vaslam_probe_interval_seconds gauge")
+        lines.append("vaslam_probe_interval_seconds {!r}".format(self.probe_interval))
+        lines.append("")
+        return "\n".join(lines)
+
+
+def _handler_class(metrics: Metrics):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.rendered
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("exporter: {}".format(format % args))
+
+    return MetricsHandler
+
+
+class _HTTPServer6(ThreadingHTTPServer):
+    address_family = socket.AF_INET6
+
+
+def split_address(address: str) -> Tuple[str, int]:
+    """Return the host and the port of the [host:]port address. IPv6 hosts
+    are in brackets, as in [::1]:9650.
+
+    :raises: ValueError on invalid ports
+    """
+    host, _, port = address.rpartition(":")
+    return host.strip("[]"), int(port)
+
+
+def new_server(metrics: Metrics, host: str = "", port: int = 9650):
+    """Return an HTTP server serving the metrics on /metrics, of the IPv4
+    or IPv6 host. Call serve_forever() of the server to start serving.
+    """
+    server_class = _HTTPServer6 if ":" in host else ThreadingHTTPServer
+    return server_class((host, port), _handler_class(metrics))
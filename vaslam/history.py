@@ -0,0 +1,360 @@
+"""
+vaslam.history
+==============
+
+long-term history of results, rolled up into minute, hour and day buckets
+"""
+import json
+from os import path, remove, replace
+from time import time
+from logging import getLogger
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterator, List, Optional
+from vaslam.sketch import LatencySketch
+
+
+logger = getLogger(__name__)
+
+RAW = 0  # type: int
+MINUTE = 60  # type: int
+HOUR = 3600  # type: int
+DAY = 86400  # type: int
+RESOLUTIONS = (MINUTE, HOUR, DAY)  # type: tuple
+
+# seconds the raw records and the buckets of each resolution are kept
+default_retention = {
+    RAW: DAY,
+    MINUTE: 2 * DAY,
+    HOUR: 35 * DAY,
+    DAY: 400 * DAY,
+}  # type: Dict[int, int]
+
+GATEWAY = "gateway"  # type: str
+INTERNET = "internet"  # type: str
+DNS = "dns"  # type: str
+HTTP = "http"  # type: str
+
+
+class Bucket:
+    """Rollup of the results in width seconds from start: count of results,
+    packets sent and lost on the gateway and Internet paths, sketches of
+    the latency (miliseconds) of the paths, DNS and HTTP, and count of each
+    issue. Raw records are buckets of a single result, with zero width.
+    """
+
+    def __init__(self, start: float = 0, width: float = RAW):
+        self.start = start  # type: float
+        self.width = width  # type: float
+        self.count = 0  # type: int
+        self.packets_sent = {}  # type: Dict[str, int]
+        self.packets_lost = {}  # type: Dict[str, int]
+        self.latency = {}  # type: Dict[str, LatencySketch]
+        self.issues = {}  # type: Dict[int, int]
+
+    @staticmethod
+    def from_result(
+        result: Any, now: float, issues: Optional[List[int]] = None
+    ) -> "Bucket":
+        """Return the raw record of the Result, with its issues (the issues of
+        the Result by default)
+        """
+        record = Bucket(now)
+        record.count = 1
+        for name, stats in (
+            (GATEWAY, result.gateway_ping_stats),
+            (INTERNET, result.internet_ping_stats),
+        ):
+            if stats.packets_sent > 0:
+                record.packets_sent[name] = stats.packets_sent
+                record.packets_lost[name] = stats.packets_sent - stats.packets_recv
+            if stats.packets_recv > 0:
+                record._sketch(name).add(stats.rtt_avg, stats.packets_recv)
+        if result.dns:
+            record._sketch(DNS).add(result.dns_time)
+        if result.http:
+            record._sketch(HTTP).add(result.http_time)
+        if issues is None:
+            issues = result.get_issues()
+        for issue in issues:
+            record.issues[issue] = record.issues.get(issue, 0) + 1
+        return record
+
+    def _sketch(self, name: str) -> LatencySketch:
+        if name not in self.latency:
+            self.latency[name] = LatencySketch()
+        return self.latency[name]
+
+    def merge(self, other: "Bucket") -> None:
+        """Add the results of the other bucket"""
+        self.count += other.count
+        _add_totals(self.packets_sent, other.packets_sent)
+        _add_totals(self.packets_lost, other.packets_lost)
+        _add_totals(self.issues, other.issues)
+        for name, sketch in other.latency.items():
+            self._sketch(name).merge(sketch)
+
+    def packet_loss_pct(self, name: str) -> float:
+        sent = self.packets_sent.get(name, 0)
+        return self.packets_lost.get(name, 0) * 100 / sent if sent else 0.0
+
+    def quantile(self, name: str, q: float) -> float:
+        """Return the latency of the path (or DNS, HTTP) at the quantile,
+        0 if unknown
+        """
+        sketch = self.latency.get(name)
+        return sketch.quantile(q) if sketch else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "s": self.start,
+            "w": self.width,
+            "n": self.count,
+            "ps": self.packets_sent,
+            "pl": self.packets_lost,
+            "l": {name: s.to_list() for name, s in self.latency.items()},
+            "i": {str(issue): count for issue, count in self.issues.items()},
+        }
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "Bucket":
+        """Return the bucket of the dict of to_dict().
+
+        :raises: ValueError, TypeError or KeyError on invalid data
+        """
+        bucket = Bucket(float(data["s"]), float(data["w"]))
+        bucket.count = int(data["n"])
+        bucket.packets_sent = {k: int(v) for k, v in data["ps"].items()}
+        bucket.packets_lost = {k: int(v) for k, v in data["pl"].items()}
+        bucket.latency = {k: LatencySketch.from_list(v) for k, v in data["l"].items()}
+        bucket.issues = {int(k): int(v) for k, v in data["i"].items()}
+        return bucket
+
+
+def _add_totals(totals: Dict[Any, int], other: Dict[Any, int]) -> None:
+    for key, val in other.items():
+        totals[key] = totals.get(key, 0) + val
+
+
+def _align(timestamp: float, width: int) -> float:
+    return float(int(timestamp // width) * width)
+
+
+class HistoryStore:
+    """History of results, keeping the raw records and rollups of them in
+    minute, hour and day buckets. Each result is folded into the current
+    bucket of every resolution as it's added, and records and buckets older
+    than the retention of their resolution are dropped, so storage is bounded
+    by the retention, regardless of how long the history is kept.
+    Queries use the coarsest resolution that is fine enough for the step and
+    still covers the start, so they read a bounded number of buckets.
+    Persisted as a JSON file between runs if a path is provided. Saving
+    appends the new records to a JSON lines journal next to the file, and
+    only rewrites the whole file every snapshot interval, so saving each
+    result doesn't grow with the retention.
+    """
+
+    # seconds between rewriting the whole history file
+    snapshot_interval = 900  # type: float
+
+    def __init__(self, file_path: str = "", retention: Optional[Dict[int, int]] = None):
+        self.path = file_path  # type: str
+        self.retention = dict(default_retention)  # type: Dict[int, int]
+        self.retention.update(retention or {})
+        self.raw = deque()  # type: deque
+        self.buckets = {
+            width: OrderedDict() for width in RESOLUTIONS
+        }  # type: Dict[int, OrderedDict]
+        # start of the latest record folded into the history
+        self._until = 0.0  # type: float
+        self._unsaved = []  # type: List[Bucket]
+        self._snapshot_time = 0.0  # type: float
+
+    @property
+    def journal_path(self) -> str:
+        return "{}.log".format(self.path)
+
+    def add(
+        self, result: Any, now: float = 0, issues: Optional[List[int]] = None
+    ) -> None:
+        """Fold the Result and its issues into the history, then compact it"""
+        now = now or time()
+        record = Bucket.from_result(result, now, issues)
+        self.add_record(record)
+        if self.path:
+            self._unsaved.append(record)
+        self.compact(now)
+
+    def add_record(self, record: Bucket) -> None:
+        self._until = max(self._until, record.start)
+        if self.retention[RAW] > 0:
+            self.raw.append(record)
+        for width in RESOLUTIONS:
+            start = _align(record.start, width)
+            buckets = self.buckets[width]
+            if start not in buckets:
+                buckets[start] = Bucket(start, width)
+            buckets[start].merge(record)
+
+    def compact(self, now: float = 0) -> None:
+        """Drop the raw records and buckets older than their retention"""
+        now = now or time()
+        oldest = now - self.retention[RAW]
+        while self.raw and self.raw[0].start <= oldest:
+            self.raw.popleft()
+        for width, buckets in self.buckets.items():
+            oldest = now - self.retention[width]
+            while buckets:
+                start = next(iter(buckets))
+                if start + width > oldest:
+                    break
+                del buckets[start]
+
+    def resolution(self, start: float, step: float, now: float = 0) -> int:
+        """Return the coarsest resolution (RAW for raw records) of at most
+        step seconds that covers the start, else the finest that covers it
+        """
+        now = now or time()
+        covering = [
+            width
+            for width in (RAW,) + RESOLUTIONS
+            if now - self.retention[width] <= start
+        ]
+        if not covering:
+            return DAY
+        fine_enough = [width for width in covering if width <= step]
+        return max(fine_enough) if fine_enough else min(covering)
+
+    def trend(
+        self, start: float, end: float, points: int = 24, now: float = 0
+    ) -> List[Bucket]:
+        """Return the rollups of the results from start to end, in points of
+        equal steps. Steps are at least the width of the resolution, and
+        buckets are counted in the step they start in.
+        """
+        points = max(1, points)
+        step = (end - start) / points
+        width = self.resolution(start, step, now)
+        if width > step:
+            step = float(width)
+            points = max(1, int((end - start + width - 1) // width))
+        trend = [Bucket(start + idx * step, step) for idx in range(points)]
+        for bucket in self._read(width, start, end):
+            idx = int((bucket.start - start) // step)
+            trend[min(max(idx, 0), points - 1)].merge(bucket)
+        return trend
+
+    def summary(self, start: float, end: float, now: float = 0) -> Bucket:
+        """Return the rollup of all the results from start to end"""
+        return self.trend(start, end, 1, now)[0]
+
+    def _read(self, width: int, start: float, end: float) -> Iterator[Bucket]:
+        if width == RAW:
+            # raw records are in time order, and queried for the recent past
+            for record in reversed(self.raw):
+                if record.start < start:
+                    break
+                if record.start < end:
+                    yield record
+            return
+        buckets = self.buckets[width]
+        bucket_start = _align(start, width)
+        while bucket_start < end:
+            bucket = buckets.get(bucket_start)
+            if bucket is not None:
+                yield bucket
+            bucket_start += width
+
+    def load(self, now: float = 0) -> None:
+        """Load the history from the file, fold in the records of the journal
+        added after the file was saved, then compact it.
+        Missing or invalid files, and invalid records of the journal are ignored.
+        """
+        if not self.path:
+            return
+        if path.isfile(self.path):
+            self._load_file()
+        if path.isfile(self.journal_path):
+            self._load_journal()
+        self.compact(now)
+
+    def _load_file(self) -> None:
+        try:
+            with open(self.path, "rt") as fh:
+                data = json.load(fh)
+            raw = deque(Bucket.from_dict(b) for b in data["raw"])
+            buckets = {}  # type: Dict[int, OrderedDict]
+            for width in RESOLUTIONS:
+                buckets[width] = OrderedDict()
+                for attrs in data["buckets"].get(str(width), []):
+                    bucket = Bucket.from_dict(attrs)
+                    buckets[width][bucket.start] = bucket
+            until = float(data.get("until", 0))
+        except (OSError, ValueError, TypeError, KeyError, AttributeError) as err:
+            logger.warning("ignoring invalid history in {}: {}".format(self.path, err))
+            return
+        self.raw, self.buckets, self._until = raw, buckets, until
+
+    def _load_journal(self) -> None:
+        # records up to the start of the file were saved in the file before
+        # the journal was removed
+        until = self._until
+        try:
+            with open(self.journal_path, "rt") as fh:
+                for num, line in enumerate(fh, 1):
+                    try:
+                        record = Bucket.from_dict(json.loads(line))
+                    except (ValueError, TypeError, KeyError, AttributeError) as err:
+                        logger.warning(
+                            "skipping invalid history record on line {}: {}".format(
+                                num, err
+                            )
+                        )
+                        continue
+                    if record.start > until:
+                        self.add_record(record)
+        except OSError as err:
+            logger.warning(
+                "ignoring history journal {}: {}".format(self.journal_path, err)
+            )
+
+    def save(self, now: float = 0) -> None:
+        """Append the records added since the last save to the journal.
+        Every snapshot interval, the whole history is saved to the file
+        instead, and the journal is removed.
+        """
+        if not self.path:
+            return
+        now = now or time()
+        if now - self._snapshot_time >= self.snapshot_interval:
+            self.snapshot()
+            self._snapshot_time = now
+            return
+        if not self._unsaved:
+            return
+        with open(self.journal_path, "at") as fh:
+            for record in self._unsaved:
+                fh.write(json.dumps(record.to_dict()))
+                fh.write("\n")
+        self._unsaved = []
+
+    def snapshot(self) -> None:
+        """Save the whole history to the file, replacing it atomically, then
+        remove the journal
+        """
+        if not self.path:
+            return
+        data = {
+            "until": self._until,
+            "raw": [record.to_dict() for record in self.raw],
+            "buckets": {
+                str(width): [b.to_dict() for b in buckets.values()]
+                for width, buckets in self.buckets.items()
+            },
+        }  # type: Dict[str, Any]
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "wt") as fh:
+            json.dump(data, fh)
+        replace(tmp_path, self.path)
+        if path.isfile(self.journal_path):
+            remove(self.journal_path)
+        self._unsaved = []
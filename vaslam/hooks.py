@@ -0,0 +1,188 @@
+"""
+vaslam.hooks
+============
+
+notify hooks of the changes of the network state, when continuously diagnosing
+"""
+import os
+from time import time
+from queue import Full, Queue
+from logging import getLogger
+from threading import Thread
+from subprocess import run, TimeoutExpired
+from typing import Callable, Dict, List, Optional, Union
+from vaslam.diag import Result
+from vaslam.issues import issue_message
+
+
+logger = getLogger(__name__)
+
+ISSUE_RAISED = "issue_raised"  # type: str
+ISSUE_CLEARED = "issue_cleared"  # type: str
+IPV4_CHANGED = "ipv4_changed"  # type: str
+GATEWAY_CHANGED = "gateway_changed"  # type: str
+
+
+class Transition:
+    """A change of the network state, raised or cleared issue, or a changed
+    value (old and new) of the visible IPv4 or the gateway
+    """
+
+    def __init__(self, kind: str, issue: int = 0, old: str = "", new: str = ""):
+        self.kind = kind  # type: str
+        self.issue = issue  # type: int
+        self.old = old  # type: str
+        self.new = new  # type: str
+        self.time = time()  # type: float
+
+    @property
+    def message(self) -> str:
+        if self.issue:
+            return issue_message(self.issue)
+        return "{} changed from {} to {}".format(
+            self.kind.split("_")[0], self.old or "none", self.new
+        )
+
+    def env(self) -> Dict[str, str]:
+        """Return the transition as environment variables of hook commands"""
+        return {
+            "VASLAM_EVENT": self.kind,
+            "VASLAM_ISSUE": str(self.issue) if self.issue else "",
+            "VASLAM_MESSAGE": self.message,
+            "VASLAM_OLD": self.old,
+            "VASLAM_NEW": self.new,
+            "VASLAM_TIME": "{:.3f}".format(self.time),
+        }
+
+
+class TransitionTracker:
+    """Tracks the issues and the values of the results across the cycles, and
+    returns the transitions.
+    Changes are debounced, issues are raised and values changed only after
+    being seen in debounce consecutive cycles. Issues have hysteresis too,
+    they're cleared only after missing from clear after consecutive cycles,
+    so flapping issues are not raised and cleared every cycle.
+    """
+
+    def __init__(self, debounce: int = 2, clear_after: int = 3):
+        self.debounce = max(1, debounce)  # type: int
+        self.clear_after = max(1, clear_after)  # type: int
+        self.issues = set()  # type: set
+        self.values = {}  # type: Dict[str, str]
+        # consecutive cycles each pending change was seen
+        self._pending_issues = {}  # type: Dict[int, int]
+        self._pending = {}  # type: Dict[str, int]
+        self._candidates = {}  # type: Dict[str, str]
+
+    def update(
+        self, result: Result, issues: Optional[List[int]] = None
+    ) -> List[Transition]:
+        """Return the transitions of the Result of the cycle, and its issues
+        (the issues of the Result by default)
+        """
+        transitions = []  # type: List[Transition]
+        current = set(result.get_issues() if issues is None else issues)
+        pending, self._pending_issues = self._pending_issues, {}
+        for issue in sorted(current ^ self.issues):
+            present = issue in current
+            seen = pending.get(issue, 0) + 1
+            if seen < (self.debounce if present else self.clear_after):
+                self._pending_issues[issue] = seen
+                continue
+            if present:
+                self.issues.add(issue)
+                transitions.append(Transition(ISSUE_RAISED, issue))
+            else:
+                self.issues.discard(issue)
+                transitions.append(Transition(ISSUE_CLEARED, issue))
+
+        for kind, val in (
+            (IPV4_CHANGED, result.ipv4),
+            (GATEWAY_CHANGED, result.gateway),
+        ):
+            old = self.values.get(kind, "")
+            if not old:
+                # the first value is the initial state, not a change
+                if val:
+                    self.values[kind] = val
+                continue
+            # missing values are reported by the issues
+            if not val or val == old:
+                self._pending.pop(kind, None)
+                self._candidates.pop(kind, None)
+                continue
+            if self._candidates.get(kind) != val:
+                self._candidates[kind] = val
+                self._pending[kind] = 0
+            self._pending[kind] += 1
+            if self._pending[kind] < self.debounce:
+                continue
+            del self._pending[kind], self._candidates[kind]
+            self.values[kind] = val
+            transitions.append(Transition(kind, old=old, new=val))
+        return transitions
+
+
+Hook = Union[Callable[[Transition], None], str]
+
+
+class HookRunner:
+    """Runs the hooks for the transitions on a worker thread, so slow hooks
+    don't delay the diagnosis. Hooks are Python callables receiving the
+    Transition, or shell commands receiving it as environment variables.
+    Transitions are dropped if max pending are waiting for the hooks.
+    """
+
+    def __init__(self, hooks: List[Hook], timeout: float = 30, max_pending: int = 100):
+        self.hooks = hooks  # type: List[Hook]
+        self.timeout = timeout  # type: float
+        self.dropped = 0  # type: int
+        self._queue = Queue(max_pending)  # type: Queue
+        self._thread = None  # type: Optional[Thread]
+
+    def start(self) -> None:
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def dispatch(self, transitions: List[Transition]) -> None:
+        """Queue the transitions for the hooks, without waiting for them"""
+        for transition in transitions:
+            try:
+                self._queue.put_nowait(transition)
+            except Full:
+                self.dropped += 1
+                logger.warning("hooks are too slow, dropped {}".format(transition.kind))
+
+    def stop(self) -> None:
+        """Stop the worker after running hooks of the pending transitions"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(self.timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            transition = self._queue.get()
+            if transition is None:
+                return
+            for hook in self.hooks:
+                self._call(hook, transition)
+
+    def _call(self, hook: Hook, transition: Transition) -> None:
+        if callable(hook):
+            try:
+                hook(transition)
+            except Exception as err:
+                logger.warning("hook failed on {}: {}".format(transition.kind, err))
+            return
+        env = dict(os.environ)
+        env.update(transition.env())
+        try:
+            proc = run(hook, shell=True, env=env, timeout=self.timeout)
+        except (OSError, TimeoutExpired) as err:
+            logger.warning("hook command {} failed: {}".format(hook, err))
+            return
+        if proc.returncode != 0:
+            logger.warning(
+                "hook command {} exited with {}".format(hook, proc.returncode)
+            )
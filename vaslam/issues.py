@@ -0,0 +1,96 @@
+"""
+vaslam.issues
+=============
+
+codes and messages of the issues found by diagnosis
+"""
+from typing import Mapping
+
+
+LOCALNET_UNKNOWN = 101  # type :int
+LOCALNET_GATEWAY_UNREACHABLE = 102  # type :int
+LOCALNET_PACKET_LOSS_HIGH = 103  # type :int
+LOCALNET_LATENCY_HIGH = 104  # type :int
+LOCALNET_PACKET_LOSS = 105  # type :int
+LOCALNET_LATENCY = 106  # type :int
+LOCALNET_INTERFACE_ERRORS = 107  # type :int
+LOCALNET_RETRANSMITS = 108  # type :int
+LOCALNET_UPLINK_DOWN = 109  # type :int
+INTERNET_UNKNOWN = 201  # type :int
+INTERNET_UNREACHABLE = 202  # type :int
+INTERNET_PACKET_LOSS_HIGH = 203  # type :int
+INTERNET_LATENCY_HIGH = 204  # type :int
+INTERNET_PACKET_LOSS = 205  # type :int
+INTERNET_LATENCY = 206  # type :int
+INTERNET_ISP_PACKET_LOSS = 207  # type :int
+INTERNET_ISP_LATENCY = 208  # type :int
+INTERNET_UPSTREAM_PACKET_LOSS = 209  # type :int
+INTERNET_UPSTREAM_LATENCY = 210  # type :int
+INTERNET_MTU_BLACKHOLE = 211  # type :int
+DNS_FAIL = 300  # type :int
+DNS_LATENCY = 301  # type :int
+DNS_TRANSPORT_FAIL = 302  # type :int
+DNS_TRANSPORT_SLOW = 303  # type :int
+HTTP_FAIL = 400  # type :int
+HTTPS_FAIL = 401  # type :int
+HTTPS_CERT_UNTRUSTED = 402  # type :int
+HTTPS_HANDSHAKE_SLOW = 403  # type :int
+BANDWIDTH_LOW = 500  # type :int
+BANDWIDTH_UPLOAD_LOW = 501  # type :int
+BANDWIDTH_CAPACITY_LOW = 502  # type :int
+BANDWIDTH_BUFFERBLOAT = 503  # type :int
+IPV6_UNREACHABLE = 601  # type :int
+IPV6_DNS_FAIL = 602  # type :int
+IPV6_HTTP_FAIL = 603  # type :int
+IPV6_PACKET_LOSS = 604  # type :int
+IPV6_LATENCY = 605  # type :int
+IPV6_GATEWAY_UNREACHABLE = 606  # type :int
+IPV4_UNREACHABLE = 607  # type :int
+
+
+def issue_message(code: int) -> str:
+    """Return human readable message regarding the issue code.
+    Return emptyr string for unknown codes.
+    """
+    messages = {
+        LOCALNET_UNKNOWN: "Local network connection quality is unknown",
+        LOCALNET_GATEWAY_UNREACHABLE: "Local network gateway is unreachable",
+        LOCALNET_PACKET_LOSS_HIGH: "Local network has high packet loss",
+        LOCALNET_LATENCY_HIGH: "Local network has high latency",
+        LOCALNET_PACKET_LOSS: "Local network has packet loss",
+        LOCALNET_LATENCY: "Local network has latency",
+        LOCALNET_INTERFACE_ERRORS: "Network interfaces have errors",
+        LOCALNET_RETRANSMITS: "Many TCP segments are retransmitted",
+        LOCALNET_UPLINK_DOWN: "An uplink has no Internet access",
+        INTERNET_UNKNOWN: "Quality of connection to the Internet is unknown",
+        INTERNET_UNREACHABLE: "Internet is unreachable",
+        INTERNET_PACKET_LOSS_HIGH: "Connection to the Internet has high packet loss",
+        INTERNET_LATENCY_HIGH: "Connection to the Internet has high latency",
+        INTERNET_PACKET_LOSS: "Connection to the Internet has packet loss",
+        INTERNET_LATENCY: "Connection to the Internet has latency",
+        INTERNET_ISP_PACKET_LOSS: "Internet service provider network has packet loss",
+        INTERNET_ISP_LATENCY: "Internet service provider network adds latency",
+        INTERNET_UPSTREAM_PACKET_LOSS: "Upstream Internet providers have packet loss",
+        INTERNET_UPSTREAM_LATENCY: "Upstream Internet providers add latency",
+        INTERNET_MTU_BLACKHOLE: "Large packets are silently dropped (MTU blackhole)",
+        DNS_FAIL: "Name resolution failed, DNS issue",
+        DNS_LATENCY: "Name resolution is slow",
+        DNS_TRANSPORT_FAIL: "Name resolution over TCP, TLS or HTTPS failed",
+        DNS_TRANSPORT_SLOW: "Name resolution over TCP, TLS or HTTPS is much slower",
+        HTTP_FAIL: "Web access failed",
+        HTTPS_FAIL: "Secure web access (HTTPS) failed",
+        HTTPS_CERT_UNTRUSTED: "HTTPS certificate is untrusted, TLS may be intercepted",
+        HTTPS_HANDSHAKE_SLOW: "TLS handshake of HTTPS is slow",
+        BANDWIDTH_LOW: "Download bandwidth is low",
+        BANDWIDTH_UPLOAD_LOW: "Upload bandwidth is low",
+        BANDWIDTH_CAPACITY_LOW: "Capacity of the network path is low",
+        BANDWIDTH_BUFFERBLOAT: "Network path has high queueing delay (bufferbloat)",
+        IPV6_UNREACHABLE: "Internet is unreachable over IPv6",
+        IPV6_DNS_FAIL: "IPv6 name resolution (AAAA) failed",
+        IPV6_HTTP_FAIL: "Web access over IPv6 failed",
+        IPV6_PACKET_LOSS: "Connection to the Internet over IPv6 has packet loss",
+        IPV6_LATENCY: "Connection to the Internet over IPv6 has latency",
+        IPV6_GATEWAY_UNREACHABLE: "Local network IPv6 gateway is unreachable",
+        IPV4_UNREACHABLE: "Internet is unreachable over IPv4, IPv6 works",
+    }  # type: Mapping[int, str]
+    return messages.get(code, "")
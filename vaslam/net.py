@@ -1,11 +1,35 @@
 from os import path
 import re
+import struct
+import select
+import socket
 from time import time
 from socket import gethostbyname
-from urllib.request import urlopen
+from http.client import HTTPException
+from urllib.request import urlopen, Request
+from urllib.parse import urlsplit, urlunsplit
 from urllib.error import URLError
-from typing import List, Tuple
+from logging import getLogger
+from threading import local
+from http.client import HTTPConnection
+from urllib.request import HTTPHandler, build_opener
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from subprocess import run, TimeoutExpired
+from vaslam.trace import span
+from vaslam.recorder import record
+from vaslam.scheduler import scheduler
+
+
+logger = getLogger(__name__)
+
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)  # type: int
+# IPv4 and UDP headers, to count packet sizes on the wire
+UDP_OVERHEAD = 28  # type: int
+
+SO_BINDTODEVICE = getattr(socket, "SO_BINDTODEVICE", 25)  # type: int
+
+_timespec = struct.Struct("=qq")
+_local = local()
 
 
 class ConnectionError(RuntimeError):
@@ -16,6 +40,94 @@ class HttpConError(ConnectionError):
     pass
 
 
+class DnsConError(ConnectionError):
+    pass
+
+
+class Binding:
+    """Network interface and source address the probes of the current thread
+    are bound to, while in context. Empty values don't bind.
+    """
+
+    def __init__(self, interface: str = "", source: str = ""):
+        self.interface = interface  # type: str
+        self.source = source  # type: str
+        self._previous = None  # type: Optional[Binding]
+
+    def __enter__(self):
+        self._previous = getattr(_local, "binding", None)
+        _local.binding = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.binding = self._previous
+        return False
+
+
+def current_binding() -> Binding:
+    """Return the binding of probes of the current thread"""
+    return getattr(_local, "binding", None) or Binding()
+
+
+def new_socket(family: int = socket.AF_INET, type_: int = socket.SOCK_DGRAM):
+    """Return a new socket, bound to the interface of the current binding,
+    or its source address if binding to the device is not permitted.
+    """
+    binding = current_binding()
+    sock = socket.socket(family, type_)
+    try:
+        if binding.interface:
+            try:
+                sock.setsockopt(
+                    socket.SOL_SOCKET, SO_BINDTODEVICE, binding.interface.encode()
+                )
+            except PermissionError:
+                if not binding.source:
+                    raise
+                logger.debug(
+                    "not permitted to bind to {}, binding to {}".format(
+                        binding.interface, binding.source
+                    )
+                )
+                sock.bind((binding.source, 0))
+        elif binding.source:
+            sock.bind((binding.source, 0))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def connect_tcp(address: Tuple[str, int], timeout: float):
+    """Return a TCP socket connected to the address, bound as new_socket()"""
+    last_err = None  # type: Optional[OSError]
+    with scheduler.slot(address[0]):
+        for family, _, _, _, sockaddr in socket.getaddrinfo(
+            address[0], address[1], 0, socket.SOCK_STREAM
+        ):
+            sock = None
+            try:
+                sock = new_socket(family, socket.SOCK_STREAM)
+                sock.settimeout(timeout)
+                sock.connect(sockaddr)
+                return sock
+            except OSError as err:
+                last_err = err
+                if sock is not None:
+                    sock.close()
+    raise last_err or OSError("no addresses for {}".format(address[0]))
+
+
+class _BoundHTTPConnection(HTTPConnection):
+    def connect(self):
+        self.sock = connect_tcp((self.host, self.port), self.timeout)
+
+
+class _BoundHTTPHandler(HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_BoundHTTPConnection, req)
+
+
 class PingStats:
     def __init__(self):
         self.packets_sent = 0  # type: int
@@ -24,6 +136,28 @@ class PingStats:
         self.rtt_min = 0  # type: float
         self.rtt_max = 0  # type: float
         self.rtt_avg = 0  # type: float
+        # miliseconds waited for the probe scheduler, not included in the RTTs
+        self.queue_delay = 0  # type: float
+
+
+class CapacityStats:
+    """Results of packet train probes. Capacity is in bits per second,
+    delays are in miliseconds.
+    """
+
+    def __init__(self):
+        self.trains = 0  # type: int
+        self.packets_sent = 0  # type: int
+        self.packets_recv = 0  # type: int
+        self.packet_size = 0  # type: int
+        self.bytes_sent = 0  # type: int
+        self.capacity = 0.0  # type: float
+        self.rtt_min = 0.0  # type: float
+        self.queueing_delay = 0.0  # type: float
+
+    @property
+    def capacity_mbps(self) -> float:
+        return self.capacity / 1e6
 
 
 def ping_host(host: str, timeout: int = 15, packets: int = 5) -> PingStats:
@@ -32,11 +166,208 @@ def ping_host(host: str, timeout: int = 15, packets: int = 5) -> PingStats:
     :raises: ConnectionError on ping timeout or errors
     """
     # @TODO: support inprocess ICMP packets when the external ping program is not available
-    return _parse_ping_output(_ping_cmd(host, timeout, packets))
+    with scheduler.slot(host, packets) as slot:
+        stats = _parse_ping_output(_ping_cmd(host, timeout, packets))
+    stats.queue_delay = slot.waited * 1000
+    return stats
+
+
+def ping_df(
+    host: str, size: int, timeout: int = 1, packets: int = 2
+) -> Tuple[int, int]:
+    """Ping a remote host with don't-fragment packets of the size (bytes of
+    the IP packet). Return the count of replies, and the MTU reported by
+    a router or the local interface if the packets were too big, else 0.
+
+    :raises: ConnectionError on timeout or failure to run ping
+    """
+    header = 48 if ":" in host else 28
+    options = ["-M", "probe", "-s", str(max(0, size - header)), "-i", "0.2"]
+    with scheduler.slot(host, packets):
+        ping_cmd = _ping_args(host, timeout, packets, options)
+        try:
+            with span("ping_df.subprocess", host):
+                proc = run(
+                    ping_cmd, capture_output=True, text=True, timeout=timeout + 1
+                )
+        except TimeoutExpired:
+            record("ping_timeout", host, timeout)
+            raise ConnectionError("ping host {} timedout".format(host))
+    record("ping_df", host, (size, proc.returncode, proc.stdout, proc.stderr))
+    # "Frag needed and DF set (mtu = 1400)", "local error: message too long, mtu=1400"
+    match = re.search(r"mtu\s*=\s*(\d+)", proc.stdout + proc.stderr, re.IGNORECASE)
+    # exit code 1 is for missing replies, which is expected of big packets
+    if proc.returncode > 1 and not match:
+        raise ConnectionError("failed to ping host {}".format(host))
+    mtu = int(match.group(1)) if match else 0
+    return _parse_ping_output(proc.stdout).packets_recv, mtu
+
+
+def udp_ping_host(
+    host: str, port: int, timeout: float = 15, packets: int = 5, interval: float = 0.2
+) -> PingStats:
+    """Ping a remote host running a UDP echo service on the port, sending
+    a packet every interval seconds and waiting for replies until timeout.
+    Return results as a PingStats instance.
+
+    :raises: ConnectionError on socket errors
+    """
+    with scheduler.slot(host, packets) as slot:
+        payload = struct.Struct("!Id")
+        rtts = {}  # type: Dict[int, float]
+        start = time()
+        deadline = start + timeout
+        sent = 0
+        next_send = start
+        try:
+            family = socket.AF_INET6 if ":" in host else socket.AF_INET
+            with new_socket(family) as sock:
+                sock.connect((host, port))
+                while len(rtts) < packets:
+                    now = time()
+                    if now >= deadline:
+                        break
+                    if sent < packets and now >= next_send:
+                        sock.send(payload.pack(sent, now))
+                        sent += 1
+                        next_send = now + interval
+                    wait_until = (
+                        deadline if sent >= packets else min(next_send, deadline)
+                    )
+                    readable, _, _ = select.select(
+                        [sock], [], [], max(0, wait_until - now)
+                    )
+                    if not readable:
+                        continue
+                    data = sock.recv(1024)
+                    if len(data) < payload.size:
+                        continue
+                    seq, sent_at = payload.unpack_from(data)
+                    if seq < sent and seq not in rtts:
+                        rtts[seq] = (time() - sent_at) * 1000
+        except OSError as err:
+            raise ConnectionError("failed to udp ping host {}: {}".format(host, err))
+    record("udp_ping", host, (sent, rtts))
+    stats = _ping_stats_from_rtts(sent, list(rtts.values()))
+    stats.queue_delay = slot.waited * 1000
+    return stats
+
+
+def _ping_stats_from_rtts(sent: int, rtts: List[float]) -> PingStats:
+    stats = PingStats()
+    stats.packets_sent = sent
+    stats.packets_recv = len(rtts)
+    if sent:
+        stats.packet_loss_pct = int((sent - len(rtts)) * 100 / sent)
+    if rtts:
+        stats.rtt_min = min(rtts)
+        stats.rtt_max = max(rtts)
+        stats.rtt_avg = sum(rtts) / len(rtts)
+    return stats
+
+
+def probe_capacity(
+    host: str,
+    port: int,
+    trains: int = 5,
+    train_length: int = 6,
+    packet_size: int = 800,
+    timeout: float = 2,
+    interval: float = 0.1,
+) -> CapacityStats:
+    """Send trains of back-to-back packets to a UDP echo service on the host,
+    every interval seconds, and measure the dispersion of the replies to
+    estimate the bottleneck capacity of the path (in either direction).
+    Queueing delay is the median RTT of the first packets of the trains above
+    the minimum RTT, the delay added by queues already filled by other traffic.
+    Replies are timestamped by the kernel when available.
+
+    :raises: ConnectionError on socket errors
+    """
+    header = struct.Struct("!HHd")
+    packet_size = max(packet_size, header.size)
+    buf = bytearray(packet_size)
+    recv_buf = bytearray(packet_size + 64)
+    # (train, seq) -> (sent time, receive time)
+    replies = {}  # type: Dict[Tuple[int, int], Tuple[float, float]]
+    stats = CapacityStats()
+    stats.packet_size = packet_size
+
+    def _receive(sock: socket.socket, until: float, expected: int) -> None:
+        while len(replies) < expected:
+            now = time()
+            if now >= until:
+                return
+            readable, _, _ = select.select([sock], [], [], until - now)
+            if not readable:
+                continue
+            size, ancdata, _, _ = sock.recvmsg_into([recv_buf], 64)
+            received = time()
+            for level, type_, data in ancdata:
+                if level == socket.SOL_SOCKET and type_ == SO_TIMESTAMPNS:
+                    sec, nsec = _timespec.unpack_from(data)
+                    received = sec + nsec / 1e9
+            if size < header.size:
+                continue
+            train, seq, sent_at = header.unpack_from(recv_buf)
+            if train < trains and seq < train_length:
+                replies.setdefault((train, seq), (sent_at, received))
 
+    with scheduler.slot(host, trains * train_length):
+        try:
+            with new_socket() as sock:
+                sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+                sock.connect((host, port))
+                for train in range(trains):
+                    next_train = time() + interval
+                    for seq in range(train_length):
+                        header.pack_into(buf, 0, train, seq, time())
+                        sock.send(buf)
+                        stats.packets_sent += 1
+                    stats.trains += 1
+                    _receive(sock, next_train, stats.packets_sent)
+                _receive(sock, time() + timeout, stats.packets_sent)
+        except OSError as err:
+            raise ConnectionError(
+                "failed to probe capacity of {}: {}".format(host, err)
+            )
+
+    stats.packets_recv = len(replies)
+    stats.bytes_sent = stats.packets_sent * packet_size
+    record("capacity", host, (stats.packets_sent, sorted(replies.items())))
+    if not replies:
+        return stats
+    estimates = []  # type: List[float]
+    first_rtts = []  # type: List[float]
+    for train in range(trains):
+        received = sorted(
+            (seq, times) for (t, seq), times in replies.items() if t == train
+        )
+        if not received:
+            continue
+        first_seq, (sent_at, first_recv) = received[0]
+        first_rtts.append((first_recv - sent_at) * 1000)
+        last_seq, (_, last_recv) = received[-1]
+        if last_seq > first_seq and last_recv > first_recv:
+            gap = (last_recv - first_recv) / (last_seq - first_seq)
+            estimates.append((packet_size + UDP_OVERHEAD) * 8 / gap)
+    stats.rtt_min = min((recv - sent) * 1000 for sent, recv in replies.values())
+    stats.queueing_delay = max(0.0, _median(first_rtts) - stats.rtt_min)
+    stats.capacity = _median(estimates)
+    return stats
 
-def resolve_any_hostname(hostnames: List[str]) -> Tuple[str, str, float, str]:
-    """Resolve IPv4 of the provided hostnames.
+
+def _median(values: List[float]) -> float:
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+def resolve_any_hostname(
+    hostnames: List[str], family: int = socket.AF_INET
+) -> Tuple[str, str, float, str]:
+    """Resolve IPv4 (or IPv6 for AF_INET6 family) of the provided hostnames.
     Return a tuple of info of:
         - the first resolved hostname
         - the resolved address
@@ -48,30 +379,55 @@ def resolve_any_hostname(hostnames: List[str]) -> Tuple[str, str, float, str]:
 
     for hostname in hostnames:
         try:
-            start = float(time() * 1000)
-            host = gethostbyname(hostname)
-            dur = float(time() * 1000) - start
+            with scheduler.slot(hostname):
+                start = float(time() * 1000)
+                if family == socket.AF_INET6:
+                    host = str(socket.getaddrinfo(hostname, None, family)[0][4][0])
+                else:
+                    host = gethostbyname(hostname)
+                dur = float(time() * 1000) - start
+            record("dns", hostname, (host, dur))
             return (hostname, host, dur, "")  # @TODO: return resolver IP
         except OSError as err:
+            record("dns_error", hostname, err)
             continue
     return "", "", 0, ""
 
 
-def http_get(url: str, timeout: int = 10) -> Tuple[int, str]:
+def http_get(url: str, timeout: int = 10, address: str = "") -> Tuple[int, str]:
     """Do an HTTP get request to the URL.
+    Connects to the address if specified, instead of resolving the URL host.
     Return a tuple of the HTTP status (int) and body (string)
     """
     code, body = 0, ""
+    request = _request_to_address(url, address) if address else url
+    binding = current_binding()
     try:
-        with urlopen(url, timeout=timeout) as resp:
-            code = int(resp.getcode())
-            body = resp.read().decode("utf-8")
-    except (RuntimeError, URLError) as err:
+        opener = urlopen  # type: Callable[..., Any]
+        if binding.interface or binding.source:
+            opener = build_opener(_BoundHTTPHandler).open
+        with scheduler.slot(urlsplit(url).hostname or url):
+            with opener(request, timeout=timeout) as resp:
+                code = int(resp.getcode())
+                body = resp.read().decode("utf-8")
+    except (RuntimeError, URLError, HTTPException, OSError) as err:
+        record("http_error", url, err)
         raise HttpConError("failed to http get {}: {}".format(url, err))
 
+    record("http", url, (code, body))
     return code, body
 
 
+def _request_to_address(url: str, address: str) -> Request:
+    """Return a request to the URL, connecting to the address"""
+    parts = urlsplit(url)
+    host = "[{}]".format(address) if ":" in address else address
+    netloc = "{}:{}".format(host, parts.port) if parts.port else host
+    return Request(
+        urlunsplit(parts._replace(netloc=netloc)), headers={"Host": parts.netloc}
+    )
+
+
 def _parse_ping_output(out: str) -> PingStats:
     """Parse output from ping command"""
 
@@ -100,29 +456,35 @@ def _parse_ping_output(out: str) -> PingStats:
     return stats
 
 
+def _ping_args(host: str, timeout: int, packets: int, options: List[str]) -> List[str]:
+    """Return the arguments of the external ping command, with the options"""
+
+    if not path.exists("/usr/bin/ping"):
+        raise NotImplementedError()
+
+    ping_cmd = ["/usr/bin/ping", "-6" if ":" in host else "-4"] + options
+    ping_cmd.extend(["-w", str(timeout), "-c", str(packets)])
+    binding = current_binding()
+    if binding.interface or binding.source:
+        ping_cmd.extend(["-I", binding.interface or binding.source])
+    ping_cmd.append(host)
+    return ping_cmd
+
+
 def _ping_cmd(host: str, timeout: int = 15, packets: int = 5) -> str:
     """Ping a remote host using external ping command, return the ping cmd output
 
     :raises :ConnectionError on timeout or failure to ping
     """
 
-    if not path.exists("/usr/bin/ping"):
-        raise NotImplementedError()
-
-    ping_cmd = [
-        "/usr/bin/ping",
-        "-4",
-        "-q",
-        "-w",
-        str(timeout),
-        "-c",
-        str(packets),
-        host,
-    ]
+    ping_cmd = _ping_args(host, timeout, packets, ["-q"])
     try:
-        proc = run(ping_cmd, capture_output=True, text=True, timeout=timeout)
+        with span("ping.subprocess", host):
+            proc = run(ping_cmd, capture_output=True, text=True, timeout=timeout)
     except TimeoutExpired as err:
+        record("ping_timeout", host, timeout)
         raise ConnectionError("ping host {} timedout".format(host))
+    record("ping", host, (proc.returncode, proc.stdout, proc.stderr))
     if proc.returncode != 0 or len(proc.stderr):
         raise ConnectionError("failed to ping host {}".format(host))
     return proc.stdout
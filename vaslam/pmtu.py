@@ -0,0 +1,255 @@
+"""
+vaslam.pmtu
+===========
+
+find the path MTU to hosts with don't-fragment probes of several sizes at once,
+and detect MTU blackholes
+"""
+import errno
+import select
+import socket
+import struct
+from time import time
+from logging import getLogger
+from threading import Thread
+from typing import Callable, Dict, List, Set, Tuple
+from vaslam.net import ConnectionError, UDP_OVERHEAD, new_socket, ping_df
+from vaslam.recorder import record
+from vaslam.scheduler import scheduler
+from vaslam.traceroute import IP_RECVERR, MSG_ERRQUEUE
+
+
+logger = getLogger(__name__)
+
+# Linux socket options, not all are exposed by the socket module
+IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)  # type: int
+# set don't-fragment, ignoring the path MTU already known to the kernel
+IP_PMTUDISC_PROBE = getattr(socket, "IP_PMTUDISC_PROBE", 3)  # type: int
+IP_MTU = getattr(socket, "IP_MTU", 14)  # type: int
+
+MIN_MTU = 576  # type: int
+MAX_MTU = 1500  # type: int
+# MTUs of common links (PPPoE, tunnels, VPNs), probed on the first round
+COMMON_MTUS = (1280, 1400, 1420, 1460, 1480, 1492)  # type: Tuple[int, ...]
+
+_sock_extended_err = struct.Struct("=IBBBBII")
+_probe_header = struct.Struct("!HH")
+
+
+class MtuStats:
+    """Path MTU to a host, in bytes of IPv4 packets. The path MTU is the
+    largest size that got through, max size is the largest size probed
+    (the MTU of the local link). Reported MTU is the MTU of an ICMP
+    "fragmentation needed" error, if a router on the path sent one.
+    Blackhole is when bigger packets vanish while the smaller get through,
+    without a reported MTU, which stalls TCP connections after the handshake.
+    """
+
+    def __init__(self, host: str = ""):
+        self.host = host  # type: str
+        self.ok = False  # type: bool
+        self.mtu = 0  # type: int
+        self.max_size = 0  # type: int
+        self.reported_mtu = 0  # type: int
+        self.blackhole = False  # type: bool
+        self.rounds = 0  # type: int
+        self.packets_sent = 0  # type: int
+        self.error = ""  # type: str
+
+
+# a round probes the sizes at once, returns the sizes that got through and
+# the reported MTU (0 if none)
+_Round = Callable[[List[int]], Tuple[Set[int], int]]
+
+
+def _link_mtu(addr: str) -> int:
+    """Return the MTU of the route to the address, known to the kernel"""
+    with new_socket() as sock:
+        sock.connect((addr, 9))
+        return sock.getsockopt(socket.SOL_IP, IP_MTU)
+
+
+def _ping_round(host: str, packets: int, timeout: float) -> _Round:
+    """Probe the sizes with ICMP echo, a ping process for each size"""
+
+    def _round(sizes: List[int]) -> Tuple[Set[int], int]:
+        replies = {}  # type: Dict[int, Tuple[int, int]]
+        errors = []  # type: List[ConnectionError]
+
+        def _ping(size: int) -> None:
+            try:
+                replies[size] = ping_df(host, size, max(1, int(timeout)), packets)
+            except ConnectionError as err:
+                errors.append(err)
+            except NotImplementedError:
+                errors.append(ConnectionError("ping command is not available"))
+
+        threads = [Thread(target=_ping, args=(size,)) for size in sizes]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        if errors and not replies:
+            raise errors[0]
+        passed = {size for size, (recv, _) in replies.items() if recv > 0}
+        reported = [mtu for _, mtu in replies.values() if mtu]
+        return passed, min(reported) if reported else 0
+
+    return _round
+
+
+def _reported_mtu(ancdata: list) -> int:
+    """Return the MTU of a "message too long" error queue message, else 0"""
+    for level, type_, data in ancdata:
+        if level != socket.SOL_IP or type_ != IP_RECVERR:
+            continue
+        if len(data) >= _sock_extended_err.size:
+            ee_errno, _, _, _, _, ee_info, _ = _sock_extended_err.unpack_from(data)
+            if ee_errno == errno.EMSGSIZE:
+                return ee_info
+    return 0
+
+
+def _udp_echo_round(addr: str, port: int, packets: int, timeout: float) -> _Round:
+    """Probe the sizes with a UDP echo service, on a single socket"""
+
+    def _round(sizes: List[int]) -> Tuple[Set[int], int]:
+        passed = set()  # type: Set[int]
+        reported = 0
+        with scheduler.slot(addr, len(sizes) * packets), new_socket() as sock:
+            sock.setsockopt(socket.SOL_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+            sock.setsockopt(socket.SOL_IP, IP_RECVERR, 1)
+            sock.connect((addr, port))
+            sock.setblocking(False)
+
+            def _drain() -> int:
+                mtu = 0
+                while True:
+                    try:
+                        _, ancdata, _, _ = sock.recvmsg(64, 512, MSG_ERRQUEUE)
+                    except BlockingIOError:
+                        return mtu
+                    mtu = _reported_mtu(ancdata) or mtu
+
+            for seq in range(packets):
+                for size in sizes:
+                    buf = bytearray(max(_probe_header.size, size - UDP_OVERHEAD))
+                    _probe_header.pack_into(buf, 0, size, seq)
+                    try:
+                        sock.send(buf)
+                    except OSError as err:
+                        if err.errno == errno.EMSGSIZE:
+                            # bigger than the local link
+                            reported = sock.getsockopt(socket.SOL_IP, IP_MTU)
+                        elif err.errno != errno.ECONNREFUSED:
+                            raise
+            deadline = time() + timeout
+            while len(passed) < len(sizes):
+                remaining = deadline - time()
+                if remaining <= 0:
+                    break
+                select.select([sock], [], [], remaining)
+                reported = _drain() or reported
+                while True:
+                    try:
+                        data = sock.recv(MAX_MTU)
+                    except BlockingIOError:
+                        break
+                    except OSError as err:
+                        # errors of the probes are read from the error queue
+                        if err.errno not in (errno.ECONNREFUSED, errno.EMSGSIZE):
+                            raise
+                        continue
+                    if len(data) >= _probe_header.size:
+                        passed.add(_probe_header.unpack_from(data)[0])
+        return passed & set(sizes), reported
+
+    return _round
+
+
+def _next_sizes(low: int, high: int, count: int) -> List[int]:
+    """Return up to count sizes evenly spaced between low and high"""
+    gap = high - low
+    if gap <= count + 1:
+        return list(range(low + 1, high))
+    return sorted({low + gap * idx // (count + 1) for idx in range(1, count + 1)})
+
+
+def probe_path_mtu(
+    host: str,
+    port: int = 0,
+    timeout: float = 1,
+    packets: int = 2,
+    sizes_per_round: int = 4,
+    max_rounds: int = 4,
+    min_size: int = MIN_MTU,
+    max_size: int = MAX_MTU,
+) -> MtuStats:
+    """Find the path MTU to the IPv4 host with don't-fragment probes, with ICMP
+    echo, or a UDP echo service if port is specified.
+    Each round probes several sizes at once, packets of each, and waits for
+    replies until timeout seconds. The first round probes the min and max
+    sizes and the common MTUs in between, the next rounds narrow the path MTU
+    between the largest size that got through and the smallest that didn't,
+    which is probed again. Stops after max rounds, so the path MTU may be
+    a lower bound of the actual MTU.
+    Max size is limited to the MTU of the local link to the host.
+
+    :raises: ConnectionError on socket errors
+    """
+    stats = MtuStats(host)
+    try:
+        addr = socket.gethostbyname(host)
+        max_size = min(max_size, _link_mtu(addr))
+    except OSError as err:
+        raise ConnectionError("failed to probe path MTU of {}: {}".format(host, err))
+    stats.max_size = max_size
+    if port:
+        probe_sizes = _udp_echo_round(addr, port, packets, timeout)
+    else:
+        probe_sizes = _ping_round(addr, packets, timeout)
+
+    passed = set()  # type: Set[int]
+    failed = set()  # type: Set[int]
+    sizes = [min_size] + [m for m in COMMON_MTUS if min_size < m < max_size]
+    sizes.append(max_size)
+    while sizes and stats.rounds < max_rounds:
+        try:
+            got_through, reported = probe_sizes(sizes)
+        except OSError as err:
+            raise ConnectionError(
+                "failed to probe path MTU of {}: {}".format(host, err)
+            )
+        stats.rounds += 1
+        stats.packets_sent += len(sizes) * packets
+        if reported:
+            stats.reported_mtu = min(stats.reported_mtu or reported, reported)
+        passed.update(got_through)
+        failed.update(set(sizes) - got_through)
+        # sizes that failed below one that got through were lost, not too big
+        largest = max(passed, default=0)
+        if not largest:
+            break
+        smallest_failed = min((s for s in failed if s > largest), default=0)
+        failed.discard(smallest_failed)
+        if not smallest_failed or stats.reported_mtu == largest:
+            break
+        sizes = _next_sizes(largest, smallest_failed, sizes_per_round)
+        if (
+            stats.reported_mtu
+            and largest < stats.reported_mtu < smallest_failed
+            and stats.reported_mtu not in sizes
+        ):
+            sizes.append(stats.reported_mtu)
+        if sizes:
+            sizes.append(smallest_failed)
+
+    stats.mtu = max(passed, default=0)
+    stats.ok = stats.mtu > 0
+    if not stats.ok:
+        stats.error = "no probes got through"
+    elif stats.mtu < max_size:
+        # the reported MTU explains the missing bigger packets
+        stats.blackhole = stats.mtu < (stats.reported_mtu or max_size)
+    record("path_mtu", host, vars(stats))
+    return stats
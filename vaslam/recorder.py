@@ -0,0 +1,83 @@
+"""
+vaslam.recorder
+===============
+
+in-memory flight recorder of probe events, to dump for post-mortem analysis
+"""
+import json
+from time import time
+from itertools import count
+from logging import getLogger
+from typing import Any, List, Optional, Tuple
+
+
+logger = getLogger(__name__)
+
+Event = Tuple[float, str, str, Any]
+
+
+class FlightRecorder:
+    """Fixed size ring buffer of probe events.
+    Events are stored as they are, formatting is deferred until dumped.
+    Recording is lock free, and a no-op while the recorder is disabled.
+    """
+
+    def __init__(self, size: int = 0):
+        self.enabled = False  # type: bool
+        self.size = 0  # type: int
+        self.events = []  # type: List[Optional[Event]]
+        self._counter = count()
+        if size > 0:
+            self.enable(size)
+
+    def enable(self, size: int = 1024) -> None:
+        self.size = size
+        self.events = [None] * size
+        self._counter = count()
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def record(self, kind: str, target: str, data: Any = None) -> None:
+        if not self.enabled:
+            return
+        self.events[next(self._counter) % self.size] = (time(), kind, target, data)
+
+    def get_events(self) -> List[Event]:
+        """Return recorded events, oldest first"""
+        events = [e for e in self.events if e is not None]
+        events.sort(key=lambda e: e[0])
+        return events
+
+    def dump(self, file_path: str) -> int:
+        """Append recorded events to the file as JSON lines, and clear them
+        so later dumps only contain new events.
+        Return the number of events dumped.
+        """
+        events = self.get_events()
+        self.events = [None] * self.size
+        with open(file_path, "at") as fh:
+            for timestamp, kind, target, data in events:
+                fh.write(
+                    json.dumps(
+                        {
+                            "time": timestamp,
+                            "kind": kind,
+                            "target": target,
+                            "data": data,
+                        },
+                        default=str,
+                    )
+                )
+                fh.write("\n")
+        logger.debug("dumped {} probe events to {}".format(len(events), file_path))
+        return len(events)
+
+
+recorder = FlightRecorder()
+
+
+def record(kind: str, target: str, data: Any = None) -> None:
+    """Record a probe event on the global flight recorder"""
+    recorder.record(kind, target, data)
@@ -0,0 +1,252 @@
+"""
+vaslam.replay
+=============
+
+capture raw probe observations of diagnosis, and replay them offline
+"""
+import json
+from socket import AF_INET6
+from time import time
+from threading import Lock
+from logging import getLogger
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import vaslam.check
+from vaslam.conf import Conf
+from vaslam.diag import Observer, Result, diagnose_network
+from vaslam.dns import TYPE_AAAA
+from vaslam.dnstransport import TransportStats
+from vaslam.net import (
+    PingStats,
+    CapacityStats,
+    ConnectionError,
+    DnsConError,
+    HttpConError,
+)
+from vaslam.pmtu import MtuStats
+from vaslam.tls import HttpsStats
+from vaslam.traceroute import Hop
+from vaslam.throughput import ThroughputStats
+
+
+logger = getLogger(__name__)
+
+# probe functions used by the checks, replaced while capturing or replaying
+PROBES = (
+    "ping_host",
+    "udp_ping_host",
+    "resolve_any_hostname",
+    "resolve_with_name_server",
+    "measure_resolver",
+    "http_get",
+    "trace_path",
+    "measure_throughput",
+    "probe_capacity",
+    "probe_https",
+    "query_transport",
+    "probe_path_mtu",
+)  # type: Tuple[str, ...]
+
+# probes returning stats objects, and the stats classes
+_STATS_PROBES = {
+    "ping_host": PingStats,
+    "udp_ping_host": PingStats,
+    "measure_throughput": ThroughputStats,
+    "probe_capacity": CapacityStats,
+    "probe_https": HttpsStats,
+    "query_transport": TransportStats,
+    "probe_path_mtu": MtuStats,
+}  # type: Dict[str, Callable]
+
+_swap_lock = Lock()
+
+
+class Capture:
+    """Configuration and the raw observations of probes of a single diagnosis.
+    Observations are dicts with "probe", "target", and either "result"
+    or "error" keys.
+    """
+
+    def __init__(self, conf: Optional[Conf] = None, started: float = 0):
+        self.conf = conf or Conf()  # type: Conf
+        self.started = started  # type: float
+        self.observations = []  # type: List[Dict[str, Any]]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "time": self.started,
+            "conf": vars(self.conf),
+            "observations": self.observations,
+        }
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "Capture":
+        conf = Conf()
+        for name, val in data.get("conf", {}).items():
+            if hasattr(conf, name):
+                setattr(conf, name, val)
+        capture = Capture(conf, float(data.get("time", 0)))
+        capture.observations = list(data.get("observations", []))
+        return capture
+
+
+class _ProbeSwap:
+    """Replace the probe functions used by the checks, while in context"""
+
+    def __init__(self, probes: Dict[str, Callable]):
+        self.probes = probes  # type: Dict[str, Callable]
+        self.originals = {}  # type: Dict[str, Callable]
+
+    def __enter__(self):
+        _swap_lock.acquire()
+        for name, func in self.probes.items():
+            self.originals[name] = getattr(vaslam.check, name)
+            setattr(vaslam.check, name, func)
+        return self
+
+    def __exit__(self, *exc):
+        for name, func in self.originals.items():
+            setattr(vaslam.check, name, func)
+        _swap_lock.release()
+        return False
+
+
+def _target(name: str, args: tuple) -> str:
+    target = args[0]
+    if name == "measure_throughput":
+        target = "{} {}".format(args[0], args[1])
+    elif name == "query_transport":
+        target = "{} {}".format(args[0].server, args[1])
+    elif name == "measure_resolver":
+        target = "{} {}".format(args[0], args[1])
+    elif name in ("resolve_any_hostname", "resolve_with_name_server"):
+        target = target[0] if target else ""
+        # AAAA lookups of the same names are different observations
+        if AF_INET6 in args[1:2] or TYPE_AAAA in args[5:6]:
+            target = "{} AAAA".format(target)
+    return str(target)
+
+
+def _encode_result(name: str, result: Any) -> Any:
+    if name in _STATS_PROBES:
+        return vars(result)
+    if name == "trace_path":
+        return [vars(hop) for hop in result]
+    return result
+
+
+def _decode_result(name: str, result: Any) -> Any:
+    if name in _STATS_PROBES:
+        stats = _STATS_PROBES[name]()
+        for attr, val in result.items():
+            setattr(stats, attr, val)
+        return stats
+    if name == "trace_path":
+        hops = []
+        for attrs in result:
+            hop = Hop(attrs["ttl"])
+            for attr, val in attrs.items():
+                setattr(hop, attr, val)
+            hops.append(hop)
+        return hops
+    return tuple(result)
+
+
+def _capturing(name: str, func: Callable, capture: Capture) -> Callable:
+    def _probe(*args, **kwargs):
+        observation = {"probe": name, "target": _target(name, args)}
+        try:
+            result = func(*args, **kwargs)
+        except ConnectionError as err:
+            observation["error"] = str(err)
+            capture.observations.append(observation)
+            raise
+        observation["result"] = _encode_result(name, result)
+        capture.observations.append(observation)
+        return result
+
+    return _probe
+
+
+def capture_diagnosis(
+    conf: Conf, observer: Optional[Observer] = None
+) -> Tuple[Result, Capture]:
+    """Diagnose the network, capturing raw observations of the probes.
+    Return the Result and the Capture.
+    """
+    capture = Capture(conf, time())
+    probes = {
+        name: _capturing(name, getattr(vaslam.check, name), capture) for name in PROBES
+    }
+    with _ProbeSwap(probes):
+        result = diagnose_network(conf, observer)
+    return result, capture
+
+
+class _Replayer:
+    """Answer probes from the observations of a capture, in the captured
+    order per target, without any delay.
+    """
+
+    def __init__(self, capture: Capture):
+        self.lock = Lock()  # type: Lock
+        self.pending = {}  # type: Dict[Tuple[str, str], List[Dict[str, Any]]]
+        for observation in capture.observations:
+            key = (observation["probe"], observation["target"])
+            self.pending.setdefault(key, []).append(observation)
+
+    def _next(self, name: str, target: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            queue = self.pending.get((name, target))
+            return queue.pop(0) if queue else None
+
+    def probe(self, name: str) -> Callable:
+        def _probe(*args, **kwargs):
+            target = _target(name, args)
+            observation = self._next(name, target)
+            if observation is None or "error" in observation:
+                error = observation["error"] if observation else "not captured"
+                if name == "http_get":
+                    raise HttpConError(error)
+                if name in ("query_transport", "measure_resolver"):
+                    raise DnsConError(error)
+                if name == "probe_https":
+                    # HTTPS probes report errors in the stats
+                    stats = HttpsStats(str(args[0]))
+                    stats.error = error
+                    return stats
+                if name in _STATS_PROBES or name == "trace_path":
+                    raise ConnectionError(error)
+                return "", "", 0, ""
+            return _decode_result(name, observation["result"])
+
+        return _probe
+
+
+def replay(capture: Capture) -> Result:
+    """Run the diagnosis of the capture again, with probes answered
+    from the captured observations.
+    """
+    replayer = _Replayer(capture)
+    with _ProbeSwap({name: replayer.probe(name) for name in PROBES}):
+        return diagnose_network(capture.conf)
+
+
+def save_capture(capture: Capture, file_path: str) -> None:
+    """Append the capture to the file as a JSON line"""
+    with open(file_path, "at") as fh:
+        fh.write(json.dumps(capture.to_dict()))
+        fh.write("\n")
+
+
+def load_captures(file_path: str) -> Iterator[Capture]:
+    """Iterate over captures saved in the file"""
+    with open(file_path, "rt") as fh:
+        for num, line in enumerate(fh, 1):
+            if not line.strip():
+                continue
+            try:
+                yield Capture.from_dict(json.loads(line))
+            except (ValueError, TypeError, AttributeError) as err:
+                logger.warning(
+                    "skipping invalid capture on line {}: {}".format(num, err)
+                )
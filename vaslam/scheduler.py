@@ -0,0 +1,173 @@
+"""
+vaslam.scheduler
+================
+
+schedule the probes, limiting their rate and concurrency so probing doesn't
+cause the loss and latency it measures
+"""
+from time import monotonic, sleep
+from random import Random
+from logging import getLogger
+from threading import BoundedSemaphore, Lock, local
+from typing import Dict, Optional
+from vaslam.recorder import record
+
+
+logger = getLogger(__name__)
+
+MAX_DESTINATIONS = 1024  # type: int
+
+
+class TokenBucket:
+    """Allows rate tokens per second, with bursts up to burst tokens.
+    Reservations can overdraw the bucket, making the next ones wait longer.
+    """
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate  # type: float
+        self.burst = max(1.0, burst)  # type: float
+        self.tokens = self.burst  # type: float
+        self.updated = monotonic()  # type: float
+
+    def reserve(self, cost: float = 1, now: float = 0) -> float:
+        """Reserve the tokens, return seconds to wait before using them"""
+        now = now or monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= cost
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class _Slot:
+    """Permission to send a probe, while in context"""
+
+    def __init__(self, scheduler: "ProbeScheduler", destination: str, cost: float):
+        self.scheduler = scheduler  # type: ProbeScheduler
+        self.destination = destination  # type: str
+        self.cost = cost  # type: float
+        # seconds waited for the scheduler before the probe
+        self.waited = 0.0  # type: float
+        self._semaphore = None  # type: Optional[BoundedSemaphore]
+
+    def __enter__(self):
+        state = self.scheduler._local
+        depth = getattr(state, "depth", 0)
+        # probes of probes (e.g. the connection of an HTTP request) are
+        # scheduled with their parent
+        if depth == 0 and self.scheduler.enabled:
+            self.waited, self._semaphore = self.scheduler._wait(
+                self.destination, self.cost
+            )
+        state.depth = depth + 1
+        state.waited = getattr(state, "waited", 0.0) + self.waited
+        return self
+
+    def __exit__(self, *exc):
+        self.scheduler._local.depth -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+        return False
+
+
+class ProbeScheduler:
+    """Schedules the probes with a global token bucket, and a token bucket
+    per destination, bounding the probes in flight. Start of the probes are
+    jittered, so concurrent checks don't send their probes at the same time.
+    Unlimited (a no-op) unless configured.
+    Time waited for the scheduler is reported, and probes measure the network
+    time after being scheduled.
+    """
+
+    def __init__(self):
+        self.rate = 0.0  # type: float
+        self.burst = 1.0  # type: float
+        self.destination_rate = 0.0  # type: float
+        self.destination_burst = 1.0  # type: float
+        self.max_in_flight = 0  # type: int
+        self.jitter = 0.0  # type: float
+        self.enabled = False  # type: bool
+        # probes scheduled, and total and max seconds they waited
+        self.scheduled = 0  # type: int
+        self.total_wait = 0.0  # type: float
+        self.max_wait = 0.0  # type: float
+        self._lock = Lock()
+        self._bucket = None  # type: Optional[TokenBucket]
+        self._buckets = {}  # type: Dict[str, TokenBucket]
+        self._semaphore = None  # type: Optional[BoundedSemaphore]
+        self._random = Random()
+        self._local = local()
+
+    def configure(
+        self,
+        rate: float = 0,
+        burst: float = 1,
+        destination_rate: float = 0,
+        destination_burst: float = 1,
+        max_in_flight: int = 0,
+        jitter: float = 0,
+    ) -> None:
+        """Set the limits, rates are probes per second and jitter is the max
+        seconds to delay each probe. Zero values don't limit.
+        """
+        with self._lock:
+            self.rate, self.burst = rate, burst
+            self.destination_rate = destination_rate
+            self.destination_burst = destination_burst
+            self.max_in_flight = max_in_flight
+            self.jitter = jitter
+            self._bucket = TokenBucket(rate, burst) if rate > 0 else None
+            self._buckets = {}
+            self._semaphore = (
+                BoundedSemaphore(max_in_flight) if max_in_flight > 0 else None
+            )
+            self.enabled = (
+                rate > 0 or destination_rate > 0 or max_in_flight > 0 or jitter > 0
+            )
+
+    def slot(self, destination: str, cost: float = 1) -> _Slot:
+        """Return the context to send probes costing the tokens to the
+        destination in. Entering the context waits for the scheduler.
+        """
+        return _Slot(self, destination, cost)
+
+    def thread_wait(self) -> float:
+        """Return total seconds the probes of the current thread waited, so
+        timings spanning many probes can exclude the waits.
+        """
+        return getattr(self._local, "waited", 0.0)
+
+    def _reserve(self, destination: str, cost: float) -> float:
+        now = monotonic()
+        with self._lock:
+            delay = self._bucket.reserve(cost, now) if self._bucket else 0.0
+            if self.destination_rate > 0:
+                bucket = self._buckets.pop(destination, None)
+                if bucket is None:
+                    bucket = TokenBucket(self.destination_rate, self.destination_burst)
+                self._buckets[destination] = bucket
+                if len(self._buckets) > MAX_DESTINATIONS:
+                    del self._buckets[next(iter(self._buckets))]
+                delay = max(delay, bucket.reserve(cost, now))
+            if self.jitter > 0:
+                delay += self._random.uniform(0, self.jitter)
+        return delay
+
+    def _wait(self, destination: str, cost: float):
+        started = monotonic()
+        delay = self._reserve(destination, cost)
+        if delay > 0:
+            sleep(delay)
+        semaphore = self._semaphore
+        if semaphore is not None:
+            semaphore.acquire()
+        waited = monotonic() - started
+        with self._lock:
+            self.scheduled += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        if waited > 0.001:
+            record("scheduler_wait", destination, waited)
+        return waited, semaphore
+
+
+scheduler = ProbeScheduler()
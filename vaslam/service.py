@@ -0,0 +1,145 @@
+"""
+vaslam.service
+==============
+
+serve diagnosis to local processes over a Unix domain socket, coalescing
+concurrent requests into a single diagnosis
+"""
+import os
+import json
+import socket
+from time import time
+from logging import getLogger
+from threading import Condition
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from typing import Callable, Optional, Tuple
+from vaslam.conf import Conf
+from vaslam.diag import Result, diagnose_network
+from vaslam.dns import DnsCache
+from vaslam.net import ConnectionError
+from vaslam.status import default_runtime_path, existing_runtime_path
+
+
+logger = getLogger(__name__)
+
+SOCKET_NAME = "vaslam.sock"  # type: str
+MAX_REQUEST_SIZE = 4096  # type: int
+
+
+class DiagnosisService:
+    """Diagnoses the network on demand, sharing the results between requests.
+    Requests accept results up to their max age seconds old. Requests that
+    can't use the last result wait for the diagnosis in flight, or start one
+    if there is none, so concurrent requests cause a single diagnosis.
+    """
+
+    def __init__(self, conf: Conf, diagnose: Optional[Callable[..., Result]] = None):
+        self.conf = conf  # type: Conf
+        self.diagnoses = 0  # type: int
+        if diagnose is None:
+            diagnose = diagnose_network
+        self._diagnose = diagnose  # type: Callable[..., Result]
+        self._dns_cache = DnsCache()
+        self._cond = Condition()
+        self._result = None  # type: Optional[Result]
+        self._updated = 0.0  # type: float
+        self._in_flight = False  # type: bool
+
+    def get(self, max_age: float) -> Tuple[Result, float]:
+        """Return a Result at most max age seconds old, and its age"""
+        with self._cond:
+            while True:
+                age = time() - self._updated
+                if self._result is not None and age <= max_age:
+                    return self._result, age
+                if not self._in_flight:
+                    self._in_flight = True
+                    break
+                self._cond.wait()
+        result = None
+        try:
+            result = self._diagnose(self.conf, None, self._dns_cache)
+        finally:
+            with self._cond:
+                if result is not None:
+                    self._result, self._updated = result, time()
+                    self.diagnoses += 1
+                self._in_flight = False
+                self._cond.notify_all()
+        return result, 0.0
+
+
+class _RequestHandler(StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline(MAX_REQUEST_SIZE)
+        try:
+            request = json.loads(line.decode("utf-8"))
+            max_age = float(request.get("max_age", 0))
+            result, age = self.server.service.get(max_age)
+            response = {"result": result.to_dict(), "age": age}
+        except (ValueError, AttributeError) as err:
+            response = {"error": "invalid request: {}".format(err)}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class ServiceServer(ThreadingUnixStreamServer):
+    """Unix domain socket server of the diagnosis service.
+    Requests and responses are single lines of JSON. Requests have the max age
+    of the result, responses have the result and its age, or an error.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, service: DiagnosisService, socket_path: str = ""):
+        self.service = service  # type: DiagnosisService
+        socket_path = socket_path or default_runtime_path(SOCKET_NAME)
+        _remove_stale_socket(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+        # let processes of all the users share the diagnosis
+        os.chmod(socket_path, 0o666)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def _remove_stale_socket(socket_path: str) -> None:
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            logger.debug("removing stale service socket {}".format(socket_path))
+            os.unlink(socket_path)
+            return
+    raise OSError("diagnosis service is already running on {}".format(socket_path))
+
+
+def request_diagnosis(
+    max_age: float, socket_path: str = "", timeout: float = 120
+) -> Tuple[Result, float]:
+    """Request a diagnosis from the service, accepting a result up to max age
+    seconds old. Return the Result and its age.
+
+    :raises: ConnectionError if the service is not running or fails
+    """
+    socket_path = socket_path or existing_runtime_path(SOCKET_NAME)
+    request = json.dumps({"max_age": max_age}).encode("utf-8") + b"\n"
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(request)
+            with sock.makefile("rb") as fh:
+                response = json.loads(fh.readline().decode("utf-8"))
+    except (OSError, ValueError) as err:
+        raise ConnectionError(
+            "failed to request diagnosis from {}: {}".format(socket_path, err)
+        )
+    if "error" in response:
+        raise ConnectionError("diagnosis service failed: {}".format(response["error"]))
+    return Result.from_dict(response["result"]), float(response["age"])
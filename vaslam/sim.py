@@ -0,0 +1,718 @@
+"""
+vaslam.sim
+==========
+
+simulate a network on the loopback interface, with stand-ins for the
+gateway, Internet hosts, name server and echo IP web service.
+Each stand-in has programmable delay, jitter, packet loss, latency spikes
+and outages, randomized deterministically from a seed.
+"""
+import ssl
+import heapq
+import socket
+import struct
+from os import path
+from subprocess import run, CalledProcessError
+from time import time, sleep
+from random import Random
+from logging import getLogger
+from threading import Thread, Event, Condition, Lock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import BaseRequestHandler, ThreadingTCPServer
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+from vaslam.conf import Conf
+from vaslam import dns
+from vaslam.net import UDP_OVERHEAD
+
+
+logger = getLogger(__name__)
+
+LOCAL_HOST = "127.0.0.1"  # type: str
+# loopback addresses standing in for the gateway and the Internet host
+GATEWAY_HOST = "127.0.0.1"  # type: str
+INTERNET_HOST = "127.0.0.2"  # type: str
+# the IPv6 loopback address stands in for all the IPv6 hosts
+LOCAL_HOST6 = "::1"  # type: str
+
+
+class Impairment:
+    """Conditions of a simulated link.
+    Delays and durations are in seconds, loss is the probability of dropping
+    a packet (0 to 1). Outages and spikes are offsets from the time the
+    impairment is started; during outages all packets are dropped, during
+    spikes the extra delay is added. Rate is the bytes per second of a
+    bottleneck link queueing the packets, 0 for no limit. Packets bigger than
+    the MTU (bytes of IPv4 packets) are dropped silently, as by an MTU
+    blackhole, 0 for no limit.
+    """
+
+    def __init__(
+        self,
+        delay: float = 0.0,
+        jitter: float = 0.0,
+        loss: float = 0.0,
+        outages: Optional[List[Tuple[float, float]]] = None,
+        spikes: Optional[List[Tuple[float, float, float]]] = None,
+        seed: int = 0,
+        rate: float = 0.0,
+        mtu: int = 0,
+    ):
+        self.delay = delay  # type: float
+        self.jitter = jitter  # type: float
+        self.loss = loss  # type: float
+        self.outages = outages or []  # type: List[Tuple[float, float]]
+        self.spikes = spikes or []  # type: List[Tuple[float, float, float]]
+        self.rate = rate  # type: float
+        self.mtu = mtu  # type: int
+        self.started = time()  # type: float
+        self._random = Random(seed)
+        self._lock = Lock()
+        self._link_free = 0.0
+
+    def start(self) -> None:
+        self.started = time()
+
+    def in_outage(self, now: float = 0) -> bool:
+        offset = (now or time()) - self.started
+        return any(start <= offset < start + dur for start, dur in self.outages)
+
+    def drop(self) -> bool:
+        """Return True if the next packet should be dropped"""
+        if self.in_outage():
+            return True
+        if self.loss <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.loss
+
+    def too_big(self, size: int) -> bool:
+        """Return True if a datagram of the size is bigger than the MTU"""
+        return self.mtu > 0 and size + UDP_OVERHEAD > self.mtu
+
+    def next_delay(self) -> float:
+        """Return seconds to delay the next packet"""
+        delay = self.delay
+        if self.jitter:
+            with self._lock:
+                delay += self._random.uniform(-self.jitter, self.jitter)
+        offset = time() - self.started
+        for start, dur, extra in self.spikes:
+            if start <= offset < start + dur:
+                delay += extra
+        return max(0.0, delay)
+
+    def queue_delay(self, size: int) -> float:
+        """Return seconds a packet of the size waits for the bottleneck link"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time()
+            self._link_free = max(now, self._link_free) + size / self.rate
+            return self._link_free - now
+
+
+class _DelayedSender:
+    """Sends datagrams after their delay, from a single thread"""
+
+    def __init__(self):
+        self._queue = []  # type: List[Tuple[float, int, socket.socket, bytes, tuple]]
+        self._counter = 0
+        self._cond = Condition()
+        self._stopped = False
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def send(self, delay: float, sock: socket.socket, data: bytes, addr) -> None:
+        with self._cond:
+            self._counter += 1
+            heapq.heappush(
+                self._queue, (time() + delay, self._counter, sock, data, addr)
+            )
+            self._cond.notify()
+
+    def _run(self) -> None:
+        with self._cond:
+            while not self._stopped:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                due = self._queue[0][0]
+                now = time()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                _, _, sock, data, addr = heapq.heappop(self._queue)
+                try:
+                    sock.sendto(data, addr)
+                except OSError as err:
+                    logger.debug("simulator failed to send to {}: {}".format(addr, err))
+
+
+class _UdpServer:
+    """Base of the UDP stand-ins. Subclasses implement reply()"""
+
+    def __init__(self, host: str, port: int, impairment: Impairment):
+        self.impairment = impairment  # type: Impairment
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(0.05)
+        self.address = self.sock.getsockname()[:2]  # type: Tuple[str, int]
+        self.received = 0  # type: int
+        self._sender = _DelayedSender()
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def reply(self, data: bytes) -> Optional[bytes]:
+        raise NotImplementedError()
+
+    def respond(self, data: bytes) -> Tuple[Optional[bytes], float]:
+        """Return the reply to the datagram, and seconds to delay the reply
+        in addition to the impairment
+        """
+        return self.reply(data), 0.0
+
+    def start(self) -> None:
+        self.impairment.start()
+        self._sender.start()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._sender.stop()
+        self.sock.close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.received += 1
+            if self.impairment.too_big(len(data)) or self.impairment.drop():
+                continue
+            response, extra_delay = self.respond(data)
+            if response is not None:
+                delay = self.impairment.next_delay() + extra_delay
+                delay += self.impairment.queue_delay(len(response))
+                self._sender.send(delay, self.sock, response, addr)
+
+
+class UdpEchoTarget(_UdpServer):
+    """UDP echo service, standing in for a pinged host"""
+
+    def reply(self, data: bytes) -> Optional[bytes]:
+        return data
+
+
+class DnsResponder(_UdpServer):
+    """Name server answering A queries from the records, and AAAA queries
+    from the IPv6 records. A "*" record answers any name, other names
+    get NXDOMAIN.
+    Names queried for the first time are delayed by cold_delay seconds,
+    simulating a recursive lookup, later queries are answered as cached.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        impairment: Impairment,
+        records: Dict[str, str],
+        ttl: int = 300,
+        cold_delay: float = 0.0,
+        records6: Optional[Dict[str, str]] = None,
+    ):
+        super().__init__(host, port, impairment)
+        self.records = records  # type: Dict[str, str]
+        self.records6 = records6 or {}  # type: Dict[str, str]
+        self.ttl = ttl  # type: int
+        self.cold_delay = cold_delay  # type: float
+        self.queried = set()  # type: Set[str]
+        # queries are answered by the threads of the TCP and DoH servers too
+        self._lock = Lock()
+
+    def reply(self, data: bytes) -> Optional[bytes]:
+        return self.respond(data)[0]
+
+    def respond(self, data: bytes) -> Tuple[Optional[bytes], float]:
+        try:
+            query = dns.decode(data)
+        except ValueError:
+            return None, 0.0
+        if not query.questions:
+            return None, 0.0
+        name, type_ = query.questions[0]
+        with self._lock:
+            delay = 0.0 if name in self.queried else self.cold_delay
+            self.queried.add(name)
+        return self._answer(query, name, type_), delay
+
+    def _answer(self, query: dns.DnsMessage, name: str, type_: int) -> bytes:
+        addr = self.records.get(name.lower().rstrip("."), self.records.get("*"))
+        if addr is None:
+            return dns.encode_response(query, [], dns.RCODE_NXDOMAIN)
+        answers = []
+        if type_ == dns.TYPE_A:
+            answers.append(dns.DnsRecord(name, dns.TYPE_A, self.ttl, addr))
+        elif type_ == dns.TYPE_AAAA:
+            key = name.lower().rstrip(".")
+            addr6 = self.records6.get(key, self.records6.get("*"))
+            if addr6 is not None:
+                answers.append(dns.DnsRecord(name, dns.TYPE_AAAA, self.ttl, addr6))
+        return dns.encode_response(query, answers)
+
+
+def _echo_ip_handler(impairment: Impairment):
+    class EchoIpHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if impairment.drop():
+                self.close_connection = True
+                return
+            sleep(impairment.next_delay())
+            body = self.client_address[0].encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return EchoIpHandler
+
+
+class _HTTPServer6(ThreadingHTTPServer):
+    address_family = socket.AF_INET6
+
+
+def _http_server(host: str, port: int, handler) -> ThreadingHTTPServer:
+    server_class = _HTTPServer6 if ":" in host else ThreadingHTTPServer
+    server = server_class((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def _server_address(server) -> Tuple[str, int]:
+    """Return the host and the port the socket server is bound to"""
+    host, port = server.server_address[:2]
+    return str(host), port
+
+
+def _http_url(address: tuple, path: str) -> str:
+    host = "[{}]".format(address[0]) if ":" in address[0] else address[0]
+    return "http://{}:{}{}".format(host, address[1], path)
+
+
+def self_signed_contexts(directory: str) -> Tuple[ssl.SSLContext, ssl.SSLContext]:
+    """Return the server and the client SSL contexts of a new self signed
+    certificate of the loopback address, created in the directory with the
+    openssl command.
+
+    :raises: OSError if the certificate could not be created
+    """
+    cert, key = path.join(directory, "cert.pem"), path.join(directory, "key.pem")
+    cmd = ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1"]
+    cmd += ["-subj", "/CN=localhost", "-addext", "subjectAltName=IP:" + LOCAL_HOST]
+    try:
+        run(cmd + ["-keyout", key, "-out", cert], check=True, capture_output=True)
+    except CalledProcessError as err:
+        raise OSError("failed to create certificate: {}".format(err.stderr))
+    server = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server.load_cert_chain(cert, key)
+    return server, ssl.create_default_context(cafile=cert)
+
+
+class EchoIpHttpServer:
+    """Web service responding with the IP address of the client, over HTTPS
+    if the server SSL context is provided
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        impairment: Impairment,
+        context: Optional[ssl.SSLContext] = None,
+    ):
+        self.impairment = impairment  # type: Impairment
+        self.server = _http_server(host, port, _echo_ip_handler(impairment))
+        self.tls = context is not None  # type: bool
+        if context is not None:
+            self.server.socket = context.wrap_socket(
+                self.server.socket, server_side=True
+            )
+        self.address = _server_address(self.server)  # type: Tuple[str, int]
+        self._thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        url = _http_url(self.address, "/ip")
+        return url.replace("http", "https", 1) if self.tls else url
+
+    def start(self) -> None:
+        self.impairment.start()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+
+def _bulk_handler(impairment: Impairment, rate: float):
+    class BulkHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _throttle(self, started: float, transferred: int) -> None:
+            if rate > 0:
+                ahead = transferred / rate - (time() - started)
+                if ahead > 0:
+                    sleep(ahead)
+
+        def do_GET(self):
+            """Send the size bytes in the query, or until the client closes"""
+            if impairment.drop():
+                self.close_connection = True
+                return
+            sleep(impairment.next_delay())
+            query = parse_qs(urlsplit(self.path).query)
+            size = int(query.get("bytes", [0])[0])
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            if size:
+                self.send_header("Content-Length", str(size))
+            self.send_header("Connection", "close")
+            self.end_headers()
+            chunk = bytes(16 * 1024)
+            started, sent = time(), 0
+            while not size or sent < size:
+                data = chunk if not size else chunk[: size - sent]
+                try:
+                    self.wfile.write(data)
+                except OSError:
+                    break
+                sent += len(data)
+                self._throttle(started, sent)
+            self.close_connection = True
+
+        def do_POST(self):
+            """Read and discard the (chunked) request body"""
+            started, received = time(), 0
+            chunked = "chunked" in self.headers.get("Transfer-Encoding", "")
+            remaining = int(self.headers.get("Content-Length", 0))
+            while chunked or remaining > 0:
+                if chunked:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    size = int(line.strip() or b"0", 16)
+                    if not size:
+                        self.rfile.readline()
+                        break
+                    received += len(self.rfile.read(size + 2)) - 2
+                else:
+                    data = self.rfile.read(min(remaining, 16 * 1024))
+                    if not data:
+                        return
+                    remaining -= len(data)
+                    received += len(data)
+                self._throttle(started, received)
+            body = str(received).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return BulkHandler
+
+
+class BulkHttpServer(EchoIpHttpServer):
+    """Web service for throughput measurements, sending data for GET requests
+    and discarding bodies of POST requests, limited to rate bytes per second
+    (0 for no limit) per connection.
+    """
+
+    def __init__(self, host: str, port: int, impairment: Impairment, rate: float = 0):
+        self.impairment = impairment  # type: Impairment
+        self.rate = rate  # type: float
+        self.server = _http_server(host, port, _bulk_handler(impairment, rate))
+        self.address = _server_address(self.server)  # type: Tuple[str, int]
+        self._thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return _http_url(self.address, "/bulk")
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return b""
+        data += chunk
+    return data
+
+
+def _dns_stream_handler(server: "DnsStreamServer"):
+    class DnsStreamHandler(BaseRequestHandler):
+        def handle(self):
+            sock = self.request
+            try:
+                if server.context is not None:
+                    sock = server.context.wrap_socket(sock, server_side=True)
+                sock.settimeout(server.idle_timeout)
+                server.connections += 1
+                while True:
+                    header = _recv_exact(sock, 2)
+                    if not header:
+                        return
+                    data = _recv_exact(sock, struct.unpack("!H", header)[0])
+                    if server.impairment.drop():
+                        continue
+                    response, extra_delay = server.responder.respond(data)
+                    if response is None:
+                        continue
+                    sleep(server.impairment.next_delay() + extra_delay)
+                    sock.sendall(struct.pack("!H", len(response)) + response)
+            except OSError:
+                return
+
+    return DnsStreamHandler
+
+
+class _TCPServer6(ThreadingTCPServer):
+    address_family = socket.AF_INET6
+
+
+class DnsStreamServer:
+    """Name server over TCP, or TLS (DoT) with the server SSL context,
+    answering the queries with the responder. Connections are kept open for
+    many queries, until idle for idle timeout seconds.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        impairment: Impairment,
+        responder: DnsResponder,
+        context: Optional[ssl.SSLContext] = None,
+        idle_timeout: float = 5.0,
+    ):
+        self.impairment = impairment  # type: Impairment
+        self.responder = responder  # type: DnsResponder
+        self.context = context  # type: Optional[ssl.SSLContext]
+        self.idle_timeout = idle_timeout  # type: float
+        self.connections = 0  # type: int
+        server_class = _TCPServer6 if ":" in host else ThreadingTCPServer
+        self.server = server_class((host, port), _dns_stream_handler(self))
+        self.server.daemon_threads = True
+        self.address = _server_address(self.server)  # type: Tuple[str, int]
+        self._thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def uri(self) -> str:
+        scheme = "tcp" if self.context is None else "tls"
+        return _http_url(self.address, "").replace("http", scheme, 1)
+
+    def start(self) -> None:
+        self.impairment.start()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+
+def _doh_handler(server: "DohHttpServer"):
+    class DohHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        timeout = server.idle_timeout
+
+        def setup(self):
+            super().setup()
+            server.connections += 1
+
+        def do_POST(self):
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if server.impairment.drop():
+                self.close_connection = True
+                return
+            response, extra_delay = server.responder.respond(data)
+            if response is None:
+                self.send_error(400)
+                return
+            sleep(server.impairment.next_delay() + extra_delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/dns-message")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format, *args):
+            pass
+
+    return DohHandler
+
+
+class DohHttpServer(EchoIpHttpServer):
+    """Name server over HTTPS (DoH) with the server SSL context, answering the
+    queries POSTed to /dns-query with the responder, on keep-alive connections
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        impairment: Impairment,
+        responder: DnsResponder,
+        context: ssl.SSLContext,
+        idle_timeout: float = 5.0,
+    ):
+        self.impairment = impairment  # type: Impairment
+        self.responder = responder  # type: DnsResponder
+        self.idle_timeout = idle_timeout  # type: float
+        self.connections = 0  # type: int
+        self.server = _http_server(host, port, _doh_handler(self))
+        self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+        self.address = _server_address(self.server)  # type: Tuple[str, int]
+        self._thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return _http_url(self.address, "/dns-query").replace("http", "https", 1)
+
+
+class Simulator:
+    """Runs the stand-ins of a network on the loopback interface.
+    Use conf() to get a Conf pointing the checks at the simulated network.
+    Simulated hosts are echoed over UDP instead of ICMP, since ICMP replies
+    are sent by the kernel and can not be impaired without privileges.
+    Bandwidth limits the bytes per second of each throughput stream.
+    If the IPv6 impairment is provided, the network is dual-stack and the
+    IPv6 stand-ins run on the IPv6 loopback address, which is the gateway,
+    Internet host, name server and the echo IP web service of IPv6.
+    If the DNS over TCP impairment is provided, the name server also answers
+    over TCP, as a DNS transport of the conf.
+    If the server SSL context is provided, the echo IP web service is served
+    over HTTPS too.
+    """
+
+    def __init__(
+        self,
+        gateway: Optional[Impairment] = None,
+        internet: Optional[Impairment] = None,
+        name_server: Optional[Impairment] = None,
+        http: Optional[Impairment] = None,
+        hostnames: Optional[List[str]] = None,
+        dns_cold_delay: float = 0.0,
+        bandwidth: float = 0.0,
+        ipv6: Optional[Impairment] = None,
+        dns_tcp: Optional[Impairment] = None,
+        tls_context: Optional[ssl.SSLContext] = None,
+    ):
+        self.hostnames = hostnames or ["www.example.org"]  # type: List[str]
+        records = {h: INTERNET_HOST for h in self.hostnames}
+        self.gateway = UdpEchoTarget(GATEWAY_HOST, 0, gateway or Impairment())
+        port = self.gateway.address[1]
+        self.internet = UdpEchoTarget(INTERNET_HOST, port, internet or Impairment())
+        records["*"] = INTERNET_HOST
+        self.name_server = DnsResponder(
+            LOCAL_HOST,
+            0,
+            name_server or Impairment(),
+            records,
+            cold_delay=dns_cold_delay,
+        )
+        self.http = EchoIpHttpServer(LOCAL_HOST, 0, http or Impairment())
+        self.bulk = BulkHttpServer(LOCAL_HOST, 0, Impairment(), bandwidth)
+        self.https = None  # type: Optional[EchoIpHttpServer]
+        if tls_context is not None:
+            self.https = EchoIpHttpServer(
+                LOCAL_HOST, 0, http or Impairment(), tls_context
+            )
+        self.dns_tcp = None  # type: Optional[DnsStreamServer]
+        if dns_tcp is not None:
+            self.dns_tcp = DnsStreamServer(LOCAL_HOST, 0, dns_tcp, self.name_server)
+        self.ipv6 = ipv6  # type: Optional[Impairment]
+        self.ipv6_servers = []  # type: list
+        if ipv6 is not None:
+            self.ipv6_servers = [
+                UdpEchoTarget(LOCAL_HOST6, port, ipv6),
+                DnsResponder(
+                    LOCAL_HOST6,
+                    self.name_server.address[1],
+                    ipv6,
+                    records,
+                    cold_delay=dns_cold_delay,
+                    records6={"*": LOCAL_HOST6},
+                ),
+                EchoIpHttpServer(LOCAL_HOST6, 0, ipv6),
+            ]
+
+    def _servers(self) -> tuple:
+        return (
+            self.gateway,
+            self.internet,
+            self.name_server,
+            self.http,
+            self.bulk,
+        ) + tuple(self.ipv6_servers + [s for s in (self.dns_tcp, self.https) if s])
+
+    def start(self) -> None:
+        for server in self._servers():
+            server.start()
+
+    def stop(self) -> None:
+        for server in self._servers():
+            server.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def conf(self, ping_timeout: int = 2) -> Conf:
+        conf = Conf()
+        conf.hostnames = list(self.hostnames)
+        conf.name_servers = [self.name_server.address[0]]
+        conf.resolver, conf.resolver_port = self.name_server.address
+        conf.resolver_timeout = ping_timeout
+        conf.ipv4_gateway = GATEWAY_HOST
+        conf.ipv4_ping_hosts = [INTERNET_HOST]
+        conf.ping_port = self.gateway.address[1]
+        conf.ping_timeout = ping_timeout
+        conf.ipv4_echo_urls = [self.http.url]
+        if self.dns_tcp:
+            conf.dns_transports = [self.dns_tcp.uri]
+        if self.https:
+            conf.https_echo_urls = [self.https.url]
+        if self.ipv6_servers:
+            conf.ipv6 = True
+            conf.ipv6_gateway = LOCAL_HOST6
+            conf.ipv6_ping_hosts = [LOCAL_HOST6]
+            conf.ipv6_resolver = LOCAL_HOST6
+            conf.ipv6_echo_urls = [self.ipv6_servers[2].url]
+        return conf
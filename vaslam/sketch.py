@@ -0,0 +1,117 @@
+"""
+vaslam.sketch
+=============
+
+mergeable latency sketches with bounded memory and relative accuracy
+"""
+from math import ceil, log
+from typing import Dict, List
+
+
+class LatencySketch:
+    """Histogram of values in logarithmic buckets, so quantiles are within
+    the relative accuracy of the real values (e.g. 1%). Sketches of the same
+    accuracy can be merged, e.g. from many agents.
+    Memory is bounded by max buckets, when exceeded the lowest buckets are
+    collapsed, keeping the higher quantiles accurate.
+    Values at or below the min value (e.g. zero latency) are counted apart.
+    """
+
+    def __init__(
+        self,
+        relative_accuracy: float = 0.01,
+        max_buckets: int = 512,
+        min_value: float = 1e-3,
+    ):
+        self.relative_accuracy = relative_accuracy  # type: float
+        self.max_buckets = max_buckets  # type: int
+        self.min_value = min_value  # type: float
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)  # type: float
+        self.buckets = {}  # type: Dict[int, int]
+        self.zeros = 0  # type: int
+        self.count = 0  # type: int
+        self._log_gamma = log(self.gamma)
+
+    def add(self, value: float, count: int = 1) -> None:
+        if count <= 0:
+            return
+        self.count += count
+        if value <= self.min_value:
+            self.zeros += count
+            return
+        idx = int(ceil(log(value) / self._log_gamma))
+        self.buckets[idx] = self.buckets.get(idx, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def merge(self, other: "LatencySketch") -> None:
+        """Add the values of the other sketch, of the same accuracy"""
+        if other.gamma != self.gamma:
+            raise ValueError("can not merge sketches of different accuracy")
+        self.count += other.count
+        self.zeros += other.zeros
+        for idx, count in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self) -> None:
+        indexes = sorted(self.buckets)
+        excess = indexes[: len(indexes) - self.max_buckets + 1]
+        collapsed = sum(self.buckets.pop(idx) for idx in excess)
+        target = indexes[len(excess)]
+        self.buckets[target] += collapsed
+
+    def quantile(self, q: float) -> float:
+        """Return the estimated value at the quantile (0 to 1), 0 if empty"""
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if rank < seen:
+                return self._value(idx)
+        return self._value(max(self.buckets))
+
+    def _value(self, idx: int) -> float:
+        """Return the value of the bucket, within the relative accuracy"""
+        return 2 * self.gamma**idx / (self.gamma + 1)
+
+    def clear(self) -> None:
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+
+    def to_list(self) -> List[int]:
+        """Return compact encoding of the values, the zeros count followed by
+        the index and count of each bucket
+        """
+        encoded = [self.zeros]
+        for idx, count in self.buckets.items():
+            encoded.append(idx)
+            encoded.append(count)
+        return encoded
+
+    @staticmethod
+    def from_list(encoded: List[int], relative_accuracy: float = 0.01):
+        """Return a sketch of the encoded values of to_list().
+
+        :raises: ValueError on invalid encoding
+        """
+        if not encoded or len(encoded) % 2 != 1:
+            raise ValueError("invalid sketch encoding")
+        sketch = LatencySketch(relative_accuracy)
+        sketch.zeros = int(encoded[0])
+        sketch.count = sketch.zeros
+        for pos in range(1, len(encoded), 2):
+            idx, count = int(encoded[pos]), int(encoded[pos + 1])
+            if count <= 0:
+                raise ValueError("invalid sketch bucket count {}".format(count))
+            sketch.buckets[idx] = sketch.buckets.get(idx, 0) + count
+            sketch.count += count
+        if len(sketch.buckets) > sketch.max_buckets:
+            sketch._collapse()
+        return sketch
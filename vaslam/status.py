@@ -0,0 +1,273 @@
+"""
+vaslam.status
+=============
+
+publish the latest diagnosis in a memory mapped file, for local consumers
+to read without probing. Doesn't import the network modules, so reading
+the status is cheap.
+"""
+import os
+import mmap
+import struct
+from time import time
+from tempfile import gettempdir
+from ipaddress import ip_address
+from logging import getLogger
+from typing import Any, List, Optional
+
+
+logger = getLogger(__name__)
+
+FILE_NAME = "vaslam.status"  # type: str
+MAGIC = b"VSLM"  # type: bytes
+LAYOUT_VERSION = 1  # type: int
+MAX_ISSUES = 32  # type: int
+
+# status flags
+INTERNET = 0x01  # type: int
+LOCALNET = 0x02  # type: int
+DNS = 0x04  # type: int
+HTTP = 0x08  # type: int
+IPV6 = 0x10  # type: int
+
+# magic, layout version, reserved, sequence number. The sequence is odd while
+# the payload is being written (seqlock), readers retry until it's even and
+# unchanged after copying the payload.
+_header = struct.Struct("=4sHHQ")
+_seq = struct.Struct("=Q")
+_SEQ_OFFSET = 8
+# updated time, cycle, flags, gateway rtt and loss, Internet rtt and loss,
+# dns and http time, download and upload goodput, ipv4, ipv6, issues
+_payload = struct.Struct("=dII8d16s46sH{}H".format(MAX_ISSUES))
+SIZE = _header.size + _payload.size  # type: int
+
+
+class Status:
+    """Latest published diagnosis. Times are in miliseconds, goodput in bits
+    per second, and updated is the epoch seconds the status was published.
+    """
+
+    def __init__(self):
+        self.updated = 0.0  # type: float
+        self.cycle = 0  # type: int
+        self.flags = 0  # type: int
+        self.gateway_rtt = 0.0  # type: float
+        self.gateway_packet_loss_pct = 0.0  # type: float
+        self.internet_rtt = 0.0  # type: float
+        self.internet_packet_loss_pct = 0.0  # type: float
+        self.dns_time = 0.0  # type: float
+        self.http_time = 0.0  # type: float
+        self.download_goodput = 0.0  # type: float
+        self.upload_goodput = 0.0  # type: float
+        self.ipv4 = ""  # type: str
+        self.ipv6 = ""  # type: str
+        self.issues = []  # type: List[int]
+
+    @property
+    def internet(self) -> bool:
+        return bool(self.flags & INTERNET)
+
+    @property
+    def localnet(self) -> bool:
+        return bool(self.flags & LOCALNET)
+
+    @property
+    def dns(self) -> bool:
+        return bool(self.flags & DNS)
+
+    @property
+    def http(self) -> bool:
+        return bool(self.flags & HTTP)
+
+    @property
+    def age(self) -> float:
+        """Seconds since the status was published"""
+        return max(0.0, time() - self.updated)
+
+
+def runtime_paths(file_name: str) -> List[str]:
+    """Return the paths of the runtime file, system wide first, then in the
+    runtime directory of the user.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or gettempdir()
+    return [os.path.join("/run", file_name), os.path.join(runtime_dir, file_name)]
+
+
+def default_runtime_path(file_name: str) -> str:
+    """Return the path to create the runtime file at, under /run if writable"""
+    paths = runtime_paths(file_name)
+    return paths[0] if os.access("/run", os.W_OK) else paths[1]
+
+
+def existing_runtime_path(file_name: str) -> str:
+    """Return the first existing path of the runtime file, or the last one"""
+    paths = runtime_paths(file_name)
+    for file_path in paths:
+        if os.path.exists(file_path):
+            return file_path
+    return paths[-1]
+
+
+def _encode_address(address: str, size: int) -> bytes:
+    """Return the IP address as ASCII bytes, or empty bytes if it's not a
+    valid address of at most size bytes (e.g. an unexpected response of
+    the visible IP service)
+    """
+    try:
+        ip_address(address)
+    except ValueError:
+        if address:
+            logger.debug("not publishing invalid address {!r}".format(address))
+        return b""
+    encoded = address.encode("ascii")
+    return encoded if len(encoded) <= size else b""
+
+
+def _encode(result: Any, cycle: int, updated: float, issues: List[int]) -> bytes:
+    flags = 0
+    for flag, ok in (
+        (INTERNET, result.internet),
+        (LOCALNET, result.localnet),
+        (DNS, result.dns),
+        (HTTP, result.http),
+        (IPV6, result.ipv6_result is not None and result.ipv6_result.works),
+    ):
+        if ok:
+            flags |= flag
+    issues = issues[:MAX_ISSUES]
+    gateway, internet = result.gateway_ping_stats, result.internet_ping_stats
+    return _payload.pack(
+        updated,
+        cycle,
+        flags,
+        gateway.rtt_avg,
+        gateway.packet_loss_pct,
+        internet.rtt_avg,
+        internet.packet_loss_pct,
+        result.dns_time,
+        result.http_time,
+        result.download_stats.goodput,
+        result.upload_stats.goodput,
+        _encode_address(result.ipv4, 16),
+        _encode_address(result.ipv6, 46),
+        len(issues),
+        *(issues + [0] * (MAX_ISSUES - len(issues)))
+    )
+
+
+def _decode(data: bytes) -> Status:
+    values = _payload.unpack(data)
+    status = Status()
+    (
+        status.updated,
+        status.cycle,
+        status.flags,
+        status.gateway_rtt,
+        status.gateway_packet_loss_pct,
+        status.internet_rtt,
+        status.internet_packet_loss_pct,
+        status.dns_time,
+        status.http_time,
+        status.download_goodput,
+        status.upload_goodput,
+    ) = values[:11]
+    status.ipv4 = values[11].rstrip(b"\0").decode("ascii")
+    status.ipv6 = values[12].rstrip(b"\0").decode("ascii")
+    status.issues = list(values[14 : 14 + values[13]])
+    return status
+
+
+class StatusWriter:
+    """Publishes diagnosis results to the status file.
+    There should be a single writer of a file. Writes never wait for readers.
+    """
+
+    def __init__(self, file_path: str = ""):
+        self.path = file_path or default_runtime_path(FILE_NAME)  # type: str
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != SIZE:
+                os.ftruncate(fd, SIZE)
+            self._map = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        self._seq = 0  # type: int
+        if self._map[:4] == MAGIC:
+            (self._seq,) = _seq.unpack_from(self._map, _SEQ_OFFSET)
+            self._seq += self._seq % 2
+        else:
+            _header.pack_into(self._map, 0, MAGIC, LAYOUT_VERSION, 0, 0)
+
+    def publish(
+        self, result: Any, cycle: int = 0, issues: Optional[List[int]] = None
+    ) -> None:
+        """Publish the Result of the diagnosis cycle, with its issues (the
+        issues of the Result by default)
+        """
+        if issues is None:
+            issues = result.get_issues()
+        payload = _encode(result, cycle, time(), issues)
+        self._seq += 1
+        _seq.pack_into(self._map, _SEQ_OFFSET, self._seq)
+        self._map[_header.size :] = payload
+        self._seq += 1
+        _seq.pack_into(self._map, _SEQ_OFFSET, self._seq)
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class StatusReader:
+    """Reads the published status, lock free. Keep the reader open to read
+    repeatedly without opening the file again.
+    """
+
+    def __init__(self, file_path: str = ""):
+        self.path = file_path or existing_runtime_path(FILE_NAME)  # type: str
+        with open(self.path, "rb") as fh:
+            self._map = mmap.mmap(fh.fileno(), SIZE, access=mmap.ACCESS_READ)
+        magic, version, _, _ = _header.unpack_from(self._map)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            self._map.close()
+            raise ValueError("{} is not a vaslam status file".format(self.path))
+
+    def read(self, retries: int = 100) -> Optional[Status]:
+        """Return the latest status, or None if nothing is published yet or
+        the writer kept updating it during all the retries.
+        """
+        for _ in range(retries):
+            (before,) = _seq.unpack_from(self._map, _SEQ_OFFSET)
+            if before % 2:
+                continue
+            data = self._map[_header.size : SIZE]
+            (after,) = _seq.unpack_from(self._map, _SEQ_OFFSET)
+            if before == after:
+                return _decode(data) if before else None
+        return None
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def read_status(file_path: str = "") -> Optional[Status]:
+    """Return the latest published status, or None if there is none.
+
+    :raises: OSError if the status file can't be read
+    :raises: ValueError if the file is not a status file
+    """
+    with StatusReader(file_path) as reader:
+        return reader.read()
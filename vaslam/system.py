@@ -4,14 +4,25 @@ vaslam.system
 
 provide information from the host operating system
 """
+import os
+import fcntl
+import socket
+import struct
 from os import path
 from subprocess import run
 from logging import getLogger
-from typing import List
+from time import monotonic
+from ipaddress import ip_address
+from typing import Dict, List, Tuple
 
 
 logger = getLogger(__name__)
 
+SIOCGIFADDR = 0x8915  # type: int
+RTF_REJECT = 0x0200  # type: int
+# gateway of on-link routes in /proc, e.g. of point-to-point and VPN tunnels
+_NO_GATEWAY = "00000000"  # type: str
+
 
 def get_name_servers() -> List[str]:
     """Return list of name servers configured to resolve names for the system"""
@@ -22,6 +33,15 @@ def get_name_servers() -> List[str]:
     return name_servers
 
 
+class Route:
+    """A default route of the system"""
+
+    def __init__(self, interface: str = "", gateway: str = "", metric: int = 0):
+        self.interface = interface  # type: str
+        self.gateway = gateway  # type: str
+        self.metric = metric  # type: int
+
+
 def get_gateway_ipv4() -> str:
     """Return system gateway host IPv4 address"""
 
@@ -29,14 +49,97 @@ def get_gateway_ipv4() -> str:
     if not len(gw_addr) == 8:
         logger.warning("found no IPv4 for default gateway from /proc")
         return ""
+    if gw_addr == _NO_GATEWAY:
+        logger.info("default route has no gateway, e.g. of a VPN tunnel")
+        return ""
 
     logger.debug("/proc reports gateway to be: {}".format(gw_addr))
-    # convert hex octets from proc to dot-decimal notation
+    return _hex_to_ipv4(gw_addr)
+
+
+def get_gateway_ipv6() -> str:
+    """Return system gateway host IPv6 address, with the interface as the
+    scope of link-local addresses (e.g. fe80::1%eth0), or empty string
+    """
+    for route in get_default_routes_ipv6():
+        if route.gateway:
+            return route.gateway
+    # common on IPv4-only hosts
+    logger.debug("found no IPv6 for default gateway from /proc")
+    return ""
+
+
+def get_default_routes_ipv6() -> List[Route]:
+    """Return the IPv6 default routes of the system, ordered by metric"""
+    routes = []  # type: List[Route]
+    try:
+        with open("/proc/net/ipv6_route", "rt") as fh:
+            lines = [l.split() for l in fh.readlines() if l.strip()]
+    except OSError as err:
+        logger.debug("can't read IPv6 routes from /proc: {}".format(err))
+        return routes
+
+    # lines are like:
+    # Destination PrefixLen Source PrefixLen NextHop Metric RefCnt Use Flags Iface
+    for words in lines:
+        if len(words) < 10 or int(words[0], 16) != 0 or words[1] != "00":
+            continue
+        if int(words[8], 16) & RTF_REJECT:
+            continue
+        gateway = ""
+        if int(words[4], 16):
+            gateway = str(ip_address(bytes.fromhex(words[4])))
+            if gateway.startswith("fe80:"):
+                gateway = "{}%{}".format(gateway, words[9])
+        routes.append(Route(words[9], gateway, int(words[5], 16)))
+    routes.sort(key=lambda r: r.metric)
+    return routes
+
+
+def get_default_routes_ipv4() -> List[Route]:
+    """Return all the IPv4 default routes of the system, ordered by metric.
+    Hosts with multiple uplinks (e.g. wired and LTE, or VPN tunnels)
+    have a default route per uplink interface. On-link routes (e.g. of
+    point-to-point and VPN tunnels) have no gateway.
+    """
+    routes = []  # type: List[Route]
+    for words in _default_routes_from_procfs():
+        # Iface Destination Gateway Flags RefCnt Use Metric Mask MTU Window IRTT
+        gateway = ""
+        if len(words[2]) == 8 and words[2] != _NO_GATEWAY:
+            gateway = _hex_to_ipv4(words[2])
+        try:
+            metric = int(words[6]) if len(words) > 6 else 0
+        except ValueError:
+            metric = 0
+        routes.append(Route(words[0], gateway, metric))
+    routes.sort(key=lambda r: r.metric)
+    logger.debug("found {} default routes from /proc".format(len(routes)))
+    return routes
+
+
+def get_interface_ipv4(interface: str) -> str:
+    """Return the IPv4 address of the network interface, or empty string"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            ifreq = fcntl.ioctl(
+                sock.fileno(),
+                SIOCGIFADDR,
+                struct.pack("256s", interface[:15].encode("utf-8")),
+            )
+        except OSError as err:
+            logger.debug("found no IPv4 for interface {}: {}".format(interface, err))
+            return ""
+    return socket.inet_ntoa(ifreq[20:24])
+
+
+def _hex_to_ipv4(hex_addr: str) -> str:
+    """Convert the hex address from proc to dot-decimal notation"""
     octets = []
     for i in range(
         8, 1, -2
     ):  # walk back from the end by 2 chars, proc reports addr backwards
-        hex_oct = gw_addr[i - 2 : i]
+        hex_oct = hex_addr[i - 2 : i]
         octets.append(str(int(hex_oct, 16)))
 
     return ".".join(octets)
@@ -45,17 +148,25 @@ def get_gateway_ipv4() -> str:
 def _get_gateway_from_procfs() -> str:
     """Return the raw value for default gateway from profs or empty string"""
 
+    routes = _default_routes_from_procfs()
+    return routes[0][2] if routes else ""
+
+
+def _default_routes_from_procfs() -> List[List[str]]:
+    """Return the words of default route lines of the routing table in /proc"""
+
     with open("/proc/net/route", "rt") as fh:
         lines = [l.strip() for l in fh.readlines() if l.strip()]
 
     if len(lines) < 2:
         logger.warning("can't find gateway from /proc. empty routing table")
-        return ""
+        return []
 
     lines = lines[1:]  # skip the headers
 
     # lines are like:
     # Iface Destination Gateway Flags RefCnt Use Metric Mask MTU Window IRTT
+    routes = []
     for line in lines:
         words = [w.strip() for w in line.split() if w.strip()]
         if len(words) < 3:  # fail safe, shouldn't happen
@@ -63,11 +174,11 @@ def _get_gateway_from_procfs() -> str:
         dst = words[1]
         try:
             if int(dst) == 0:
-                return words[2]
+                routes.append(words)
         except ValueError:
             continue
 
-    return ""
+    return routes
 
 
 def _resolvconf_name_servers() -> List[str]:
@@ -110,3 +221,198 @@ def _network_manager_name_servers() -> List[str]:
     )
     servers = [l.partition(":")[2].strip() for l in lines]
     return [s for s in servers if s]
+
+
+class Counters:
+    """Network counters of the kernel. Interface counters are summed over
+    the interfaces (except the excluded ones, like loopback).
+    Sampled is the monotonic time the counters were read. As deltas,
+    interval is the seconds between the samples.
+    """
+
+    def __init__(self):
+        self.sampled = 0.0  # type: float
+        self.interval = 0.0  # type: float
+        self.rx_packets = 0  # type: int
+        self.rx_errors = 0  # type: int
+        self.rx_dropped = 0  # type: int
+        self.tx_packets = 0  # type: int
+        self.tx_errors = 0  # type: int
+        self.tx_dropped = 0  # type: int
+        self.tcp_out_segs = 0  # type: int
+        self.tcp_retrans_segs = 0  # type: int
+        self.tcp_in_errs = 0  # type: int
+        self.udp_in_errors = 0  # type: int
+        self.udp_rcvbuf_errors = 0  # type: int
+        self.icmp_in_errors = 0  # type: int
+        self.icmp_in_dest_unreachs = 0  # type: int
+
+    @property
+    def interface_errors(self) -> int:
+        return self.rx_errors + self.tx_errors
+
+    @property
+    def retransmit_pct(self) -> float:
+        if not self.tcp_out_segs:
+            return 0
+        return self.tcp_retrans_segs * 100.0 / self.tcp_out_segs
+
+    def delta(self, previous: "Counters") -> "Counters":
+        """Return the changes of the counters since the previous values"""
+        changes = Counters()
+        for name, val in vars(self).items():
+            if name not in ("sampled", "interval"):
+                setattr(changes, name, max(0, val - getattr(previous, name)))
+        changes.sampled = self.sampled
+        changes.interval = self.sampled - previous.sampled
+        return changes
+
+
+# section and field of /proc/net/snmp, and the attribute of Counters
+_snmp_counters = (
+    (b"Tcp", "OutSegs", "tcp_out_segs"),
+    (b"Tcp", "RetransSegs", "tcp_retrans_segs"),
+    (b"Tcp", "InErrs", "tcp_in_errs"),
+    (b"Udp", "InErrors", "udp_in_errors"),
+    (b"Udp", "RcvbufErrors", "udp_rcvbuf_errors"),
+    (b"Icmp", "InErrors", "icmp_in_errors"),
+    (b"Icmp", "InDestUnreachs", "icmp_in_dest_unreachs"),
+)  # type: Tuple[Tuple[bytes, str, str], ...]
+
+
+def _pread(fd: int, buf: bytearray) -> Tuple[memoryview, bytearray]:
+    """Read the whole file from the start into the buffer, doubling the
+    buffer until the file fits. Return the data read and the buffer.
+    """
+    while True:
+        size = os.preadv(fd, [buf], 0)
+        if size < len(buf):
+            return memoryview(buf)[:size], buf
+        buf = bytearray(len(buf) * 2)
+
+
+class CounterSampler:
+    """Sample the kernel network counters, keeping the /proc files open and
+    re-reading them into a preallocated buffer on each sample.
+    """
+
+    def __init__(
+        self,
+        exclude: Tuple[str, ...] = ("lo",),
+        dev_path: str = "/proc/net/dev",
+        snmp_path: str = "/proc/net/snmp",
+    ):
+        self.exclude = {name.encode() for name in exclude}
+        self._dev_fd = os.open(dev_path, os.O_RDONLY | os.O_CLOEXEC)
+        self._snmp_fd = os.open(snmp_path, os.O_RDONLY | os.O_CLOEXEC)
+        self._buf = bytearray(16 * 1024)
+        # line prefix of /proc/net/snmp -> [(field index, attribute)]
+        self._snmp_index = {}  # type: Dict[bytes, List[Tuple[int, str]]]
+
+    def close(self) -> None:
+        os.close(self._dev_fd)
+        os.close(self._snmp_fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def read(self) -> Counters:
+        """Return the current values of the counters"""
+        counters = Counters()
+        counters.sampled = monotonic()
+        data, self._buf = _pread(self._dev_fd, self._buf)
+        # skip the 2 header lines
+        for line in data.tobytes().splitlines()[2:]:
+            name, _, values = line.partition(b":")
+            if name.strip() in self.exclude:
+                continue
+            fields = values.split()
+            if len(fields) < 12:
+                continue
+            counters.rx_packets += int(fields[1])
+            counters.rx_errors += int(fields[2])
+            counters.rx_dropped += int(fields[3])
+            counters.tx_packets += int(fields[9])
+            counters.tx_errors += int(fields[10])
+            counters.tx_dropped += int(fields[11])
+        data, self._buf = _pread(self._snmp_fd, self._buf)
+        lines = data.tobytes().splitlines()
+        if not self._snmp_index:
+            self._index_snmp(lines)
+        # lines come in pairs of field names and values
+        for line in lines[1::2]:
+            prefix, _, values = line.partition(b":")
+            indexes = self._snmp_index.get(prefix)
+            if not indexes:
+                continue
+            fields = values.split()
+            for idx, attr in indexes:
+                if idx < len(fields):
+                    setattr(counters, attr, int(fields[idx]))
+        return counters
+
+    def _index_snmp(self, lines: List[bytes]) -> None:
+        for line in lines[0::2]:
+            prefix, _, names = line.partition(b":")
+            fields = names.decode("ascii", "replace").split()
+            for section, field, attr in _snmp_counters:
+                if section == prefix and field in fields:
+                    self._snmp_index.setdefault(prefix, []).append(
+                        (fields.index(field), attr)
+                    )
+
+
+class RouteSampler:
+    """Sample the default routes, keeping the /proc route files open and
+    re-reading them into a preallocated buffer on each sample, to cheaply
+    detect changes of the routes between the diagnosis.
+    Missing files (e.g. IPv6 disabled) are skipped.
+    """
+
+    def __init__(
+        self,
+        route_path: str = "/proc/net/route",
+        ipv6_route_path: str = "/proc/net/ipv6_route",
+    ):
+        self._fds = []  # type: List[Tuple[int, bool]]
+        for file_path, ipv6 in ((route_path, False), (ipv6_route_path, True)):
+            try:
+                self._fds.append((os.open(file_path, os.O_RDONLY | os.O_CLOEXEC), ipv6))
+            except OSError as err:
+                logger.debug("can't sample routes of {}: {}".format(file_path, err))
+        self._buf = bytearray(16 * 1024)
+
+    def close(self) -> None:
+        for fd, _ in self._fds:
+            os.close(fd)
+        self._fds = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def read(self) -> Tuple[Tuple[bytes, ...], ...]:
+        """Return the interface, gateway, flags and metric of the default
+        routes, in the order of the route tables
+        """
+        routes = []  # type: List[Tuple[bytes, ...]]
+        for fd, ipv6 in self._fds:
+            data, self._buf = _pread(fd, self._buf)
+            lines = data.tobytes().splitlines()
+            for fields in (line.split() for line in lines):
+                if ipv6 and len(fields) >= 10:
+                    # Destination PrefixLen Source PrefixLen NextHop Metric
+                    # RefCnt Use Flags Iface
+                    if int(fields[0], 16) == 0 and fields[1] == b"00":
+                        routes.append((fields[9], fields[4], fields[8], fields[5]))
+                elif not ipv6 and len(fields) >= 8 and fields[1] == b"00000000":
+                    # Iface Destination Gateway Flags RefCnt Use Metric Mask
+                    routes.append((fields[0], fields[2], fields[3], fields[6]))
+        return tuple(routes)
@@ -0,0 +1,260 @@
+"""
+vaslam.throughput
+=================
+
+measure download and upload throughput over HTTP or raw TCP streams
+"""
+import fcntl
+import socket
+import struct
+import termios
+from time import time
+from logging import getLogger
+from threading import Thread, Event
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import urlsplit
+from vaslam.net import ConnectionError, Binding, connect_tcp, current_binding
+from vaslam.recorder import record
+
+
+logger = getLogger(__name__)
+
+DOWNLOAD = "download"  # type: str
+UPLOAD = "upload"  # type: str
+
+BUFFER_SIZE = 64 * 1024  # type: int
+UPLOAD_CHUNK_SIZE = 16 * 1024  # type: int
+TIOCOUTQ = getattr(termios, "TIOCOUTQ", 0x5411)  # type: int
+
+
+class ThroughputStats:
+    """Results of a throughput measurement.
+    Goodput and samples are in bits per second of payload, durations in seconds.
+    Goodput is measured after the ramp-up, the time it took the streams to reach
+    most of the peak throughput (e.g. TCP slow start).
+    """
+
+    def __init__(self, direction: str = "", url: str = ""):
+        self.direction = direction  # type: str
+        self.url = url  # type: str
+        self.streams = 0  # type: int
+        self.bytes = 0  # type: int
+        self.duration = 0.0  # type: float
+        self.ramp_up = 0.0  # type: float
+        self.goodput = 0.0  # type: float
+        self.samples = []  # type: List[float]
+
+    @property
+    def goodput_mbps(self) -> float:
+        return self.goodput / 1e6
+
+
+def _connect(url: str, timeout: float) -> Tuple[socket.socket, str, str]:
+    """Connect to the URL endpoint, return the socket, scheme and HTTP path"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "tcp"):
+        raise ConnectionError("unsupported throughput endpoint {}".format(url))
+    port = parts.port or (80 if parts.scheme == "http" else 0)
+    if not parts.hostname or not port:
+        raise ConnectionError("invalid throughput endpoint {}".format(url))
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    try:
+        sock = connect_tcp((parts.hostname, port), timeout)
+    except OSError as err:
+        raise ConnectionError("failed to connect to {}: {}".format(url, err))
+    return sock, parts.scheme, path
+
+
+def _http_request(method: str, path: str, url: str, headers: str = "") -> bytes:
+    return (
+        "{} {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: vaslam\r\n{}"
+        "Connection: close\r\n\r\n".format(
+            method, path, urlsplit(url).netloc, headers
+        ).encode("ascii")
+    )
+
+
+def _check_http_status(buf: bytearray, url: str) -> None:
+    status_line = bytes(buf[: buf.find(b"\r\n")]).split()
+    if len(status_line) < 2 or not status_line[1].startswith(b"2"):
+        raise ConnectionError(
+            "unexpected response from {}: {}".format(url, status_line[1:2])
+        )
+
+
+class _Streams:
+    """Parallel streams of a measurement, counting the transferred bytes"""
+
+    def __init__(self, count: int):
+        self.counters = [0] * count  # type: List[int]
+        self.socks = [None] * count  # type: List[Optional[socket.socket]]
+        self.errors = []  # type: List[str]
+        self.stop = Event()  # type: Event
+        self.threads = []  # type: List[Thread]
+
+    def start(self, target: Callable, url: str, timeout: float) -> None:
+        binding = current_binding()
+
+        def _stream(idx: int) -> None:
+            try:
+                with Binding(binding.interface, binding.source):
+                    target(url, timeout, self, idx)
+            except (ConnectionError, OSError) as err:
+                logger.debug("throughput stream {} failed: {}".format(idx, err))
+                self.errors.append(str(err))
+
+        self.threads = [
+            Thread(target=_stream, args=(i,), daemon=True)
+            for i in range(len(self.counters))
+        ]
+        for th in self.threads:
+            th.start()
+
+    def alive(self) -> bool:
+        return any(th.is_alive() for th in self.threads)
+
+    def transferred(self) -> int:
+        """Return bytes transferred by all the streams. For uploads, data still
+        in the send queues of the sockets is not counted.
+        """
+        total = sum(self.counters)
+        for sock in self.socks:
+            if sock is not None:
+                total -= _unsent(sock)
+        return max(0, total)
+
+
+def _unsent(sock: socket.socket) -> int:
+    """Return bytes in the socket send queue, not acknowledged by the peer"""
+    try:
+        return struct.unpack("i", fcntl.ioctl(sock, TIOCOUTQ, b"\0" * 4))[0]
+    except (OSError, ValueError):
+        return 0
+
+
+def _download_stream(url: str, timeout: float, streams: _Streams, idx: int) -> None:
+    sock, scheme, path = _connect(url, timeout)
+    buf = bytearray(BUFFER_SIZE)
+    view = memoryview(buf)
+    counters = streams.counters
+    with sock:
+        if scheme == "http":
+            sock.sendall(_http_request("GET", path, url))
+            # read the headers, counting the start of the body in the buffer
+            filled = 0
+            while True:
+                received = sock.recv_into(view[filled:])
+                if not received:
+                    raise ConnectionError("connection closed by {}".format(url))
+                filled += received
+                header_end = buf.find(b"\r\n\r\n", 0, filled)
+                if header_end >= 0:
+                    _check_http_status(buf, url)
+                    counters[idx] += filled - header_end - 4
+                    break
+                if filled == BUFFER_SIZE:
+                    raise ConnectionError("too long headers from {}".format(url))
+        while not streams.stop.is_set():
+            received = sock.recv_into(view)
+            if not received:
+                break
+            counters[idx] += received
+
+
+def _upload_stream(url: str, timeout: float, streams: _Streams, idx: int) -> None:
+    sock, scheme, path = _connect(url, timeout)
+    with sock:
+        if scheme == "http":
+            # stream chunks with a fixed, preallocated chunk header
+            sock.sendall(
+                _http_request("POST", path, url, "Transfer-Encoding: chunked\r\n")
+            )
+            frame = bytearray(b"%x\r\n" % UPLOAD_CHUNK_SIZE)
+            frame.extend(bytes(UPLOAD_CHUNK_SIZE))
+            frame.extend(b"\r\n")
+        else:
+            frame = bytearray(UPLOAD_CHUNK_SIZE)
+        view = memoryview(frame)
+        streams.socks[idx] = sock
+        try:
+            while not streams.stop.is_set():
+                sock.sendall(view)
+                streams.counters[idx] += UPLOAD_CHUNK_SIZE
+            if scheme == "http":
+                # don't wait for the server to drain the queued data, only
+                # check for an early error response
+                sock.setblocking(False)
+                response = bytearray(1024)
+                try:
+                    if sock.recv_into(response):
+                        _check_http_status(response, url)
+                except BlockingIOError:
+                    pass
+        finally:
+            streams.socks[idx] = None
+
+
+def _analyze(stats: ThroughputStats, sample_interval: float) -> None:
+    if not stats.samples:
+        return
+    peak = max(stats.samples)
+    ramped = next(i for i, sample in enumerate(stats.samples) if sample >= peak * 0.8)
+    stats.ramp_up = ramped * sample_interval
+    steady = stats.samples[ramped:]
+    stats.goodput = sum(steady) / len(steady)
+
+
+def measure_throughput(
+    direction: str,
+    url: str,
+    duration: float = 10,
+    streams: int = 4,
+    timeout: float = 10,
+    sample_interval: float = 1.0,
+) -> ThroughputStats:
+    """Download from or upload to the endpoint URL with parallel streams,
+    for duration seconds or until the streams are finished.
+    URL is either http://host[:port]/path for HTTP GET/POST, or tcp://host:port
+    for raw TCP, where the server is expected to send data for downloads,
+    and discard data received for uploads.
+    Payload is received into a preallocated buffer, without copying or decoding.
+
+    :raises: ConnectionError if none of the streams could transfer data
+    """
+    stream_func = _download_stream if direction == DOWNLOAD else _upload_stream
+    stats = ThroughputStats(direction, url)
+    stats.streams = streams
+    transfers = _Streams(streams)
+    started = time()
+    transfers.start(stream_func, url, timeout)
+    last_time, last_bytes = started, 0
+    deadline = started + duration
+    while transfers.alive() and time() < deadline:
+        transfers.stop.wait(min(0.05, sample_interval))
+        now = time()
+        if now - last_time >= sample_interval:
+            total = transfers.transferred()
+            stats.samples.append((total - last_bytes) * 8 / (now - last_time))
+            last_time, last_bytes = now, total
+    # only count bytes accepted by the peer, before closing the streams
+    stats.bytes = transfers.transferred()
+    stats.duration = time() - started
+    transfers.stop.set()
+    for th in transfers.threads:
+        th.join(timeout)
+    if not stats.bytes:
+        record("throughput_error", url, transfers.errors)
+        raise ConnectionError(
+            "failed to measure {} throughput from {}: {}".format(
+                direction,
+                url,
+                transfers.errors[0] if transfers.errors else "no data",
+            )
+        )
+    _analyze(stats, sample_interval)
+    if not stats.goodput:
+        stats.goodput = stats.bytes * 8 / stats.duration
+    record("throughput", url, (direction, stats.bytes, stats.duration))
+    return stats
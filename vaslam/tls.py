@@ -0,0 +1,201 @@
+"""
+vaslam.tls
+==========
+
+probe HTTPS with timings of the TLS handshake, resuming the TLS sessions
+"""
+import ssl
+from time import time
+from logging import getLogger
+from threading import Lock
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from typing import Dict, List, Optional, Tuple
+from vaslam.net import connect_tcp
+from vaslam.recorder import record
+from vaslam.scheduler import scheduler
+
+
+logger = getLogger(__name__)
+
+MAX_RESPONSE_SIZE = 64 * 1024  # type: int
+
+
+class HttpsStats:
+    """Timings of an HTTPS request in miliseconds, and the visible IP address
+    in the response. Handshake time is of a resumed handshake if the TLS
+    session was resumed. The latest full and resumed handshake times of the
+    server are reported too, so both are known regardless of this request.
+    """
+
+    def __init__(self, url: str = ""):
+        self.url = url  # type: str
+        self.ok = False  # type: bool
+        self.status = 0  # type: int
+        self.ip = ""  # type: str
+        self.tls_version = ""  # type: str
+        self.resumed = False  # type: bool
+        self.connect_time = 0  # type: float
+        self.handshake_time = 0  # type: float
+        self.first_byte_time = 0  # type: float
+        self.full_handshake_time = 0  # type: float
+        self.resumed_handshake_time = 0  # type: float
+        # the certificate could not be verified, e.g. intercepted TLS
+        self.cert_error = False  # type: bool
+        self.error = ""  # type: str
+
+
+class TlsSessions:
+    """TLS sessions of the servers, so later connections resume them with
+    abbreviated handshakes. Sessions can only be resumed with the context
+    they're created from. Keeps the latest full and resumed handshake times
+    of each server. Least recently used sessions are dropped after max sessions.
+    """
+
+    def __init__(self, context: Optional[ssl.SSLContext] = None, max_sessions=64):
+        self.context = context or ssl.create_default_context()  # type: ssl.SSLContext
+        self.max_sessions = max_sessions  # type: int
+        self._sessions = OrderedDict()  # type: OrderedDict
+        self._handshakes = {}  # type: Dict[Tuple[str, int], List[float]]
+        self._measured = set()  # type: set
+        self._lock = Lock()
+
+    def get(self, server: Tuple[str, int]) -> Optional[ssl.SSLSession]:
+        with self._lock:
+            session = self._sessions.get(server)
+            if session is not None:
+                self._sessions.move_to_end(server)
+            return session
+
+    def put(self, server: Tuple[str, int], session: Optional[ssl.SSLSession]) -> None:
+        if session is None:
+            return
+        with self._lock:
+            self._sessions[server] = session
+            self._sessions.move_to_end(server)
+            while len(self._sessions) > self.max_sessions:
+                dropped, _ = self._sessions.popitem(last=False)
+                self._handshakes.pop(dropped, None)
+                self._measured.discard(dropped)
+
+    def handshake(
+        self, server: Tuple[str, int], resumed: bool, dur: float = -1
+    ) -> float:
+        """Return the latest (full or resumed) handshake miliseconds of the
+        server, after updating it with the duration if provided
+        """
+        with self._lock:
+            times = self._handshakes.setdefault(server, [0.0, 0.0])
+            if dur >= 0:
+                times[int(resumed)] = dur
+            return times[int(resumed)]
+
+    def measure_resumption(self, server: Tuple[str, int]) -> bool:
+        """Return True only the first time for the server, so resuming its
+        session is measured once, even if the server doesn't support it
+        """
+        with self._lock:
+            if server in self._measured:
+                return False
+            self._measured.add(server)
+            return True
+
+
+def _handshake(
+    server: Tuple[str, int], address: str, sessions: TlsSessions, timeout: float
+) -> Tuple[ssl.SSLSocket, float, float]:
+    """Return a TLS socket connected to the server, resuming its session if
+    possible, and the TCP connect and TLS handshake miliseconds
+    """
+    start = time()
+    sock = connect_tcp((address or server[0], server[1]), timeout)
+    connect_time = (time() - start) * 1000
+    start = time()
+    try:
+        tls_sock = sessions.context.wrap_socket(
+            sock, server_hostname=server[0], session=sessions.get(server)
+        )
+    except (OSError, ValueError):
+        sock.close()
+        raise
+    return tls_sock, connect_time, (time() - start) * 1000
+
+
+def _measure_resumed(
+    server: Tuple[str, int], address: str, sessions: TlsSessions, timeout: float
+) -> None:
+    try:
+        with scheduler.slot(server[0]):
+            sock, _, dur = _handshake(server, address, sessions, timeout)
+    except (OSError, ValueError) as err:
+        logger.debug("failed to resume TLS session of {}: {}".format(server, err))
+        return
+    with sock:
+        if sock.session_reused:
+            sessions.handshake(server, True, dur)
+
+
+def probe_https(
+    url: str, sessions: TlsSessions, timeout: float = 10, address: str = ""
+) -> HttpsStats:
+    """Get the URL over HTTPS, measuring the TCP connect, TLS handshake and the
+    time to the first byte of the response. Connects to the address if
+    specified, instead of resolving the URL host. Resumes the TLS session of
+    the server from the sessions, and keeps the new session there.
+    If the server has no resumed handshake time yet, resumes the new session
+    on another connection, to measure it.
+    Never raises, errors are reported in the stats.
+    """
+    stats = HttpsStats(url)
+    parts = urlsplit(url)
+    server = (parts.hostname or "", parts.port or 443)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    request = (
+        "GET {} HTTP/1.0\r\nHost: {}\r\nUser-Agent: vaslam\r\n"
+        "Connection: close\r\n\r\n".format(path, parts.netloc)
+    ).encode("ascii")
+    try:
+        with scheduler.slot(server[0]):
+            sock, stats.connect_time, stats.handshake_time = _handshake(
+                server, address, sessions, timeout
+            )
+            with sock:
+                stats.resumed = bool(sock.session_reused)
+                stats.tls_version = sock.version() or ""
+                start = time()
+                sock.sendall(request)
+                response = sock.recv(MAX_RESPONSE_SIZE)
+                stats.first_byte_time = (time() - start) * 1000
+                while response and len(response) < MAX_RESPONSE_SIZE:
+                    data = sock.recv(MAX_RESPONSE_SIZE)
+                    if not data:
+                        break
+                    response += data
+                # TLS 1.3 session tickets are received after the handshake
+                sessions.put(server, sock.session)
+    except ssl.SSLCertVerificationError as err:
+        stats.cert_error = True
+        stats.error = str(err)
+    except (OSError, ValueError) as err:
+        stats.error = str(err)
+    else:
+        head, _, body = response.partition(b"\r\n\r\n")
+        status_line = head.split(b"\r\n", 1)[0].split()
+        if len(status_line) > 1 and status_line[1].isdigit():
+            stats.status = int(status_line[1])
+        stats.ok = 200 <= stats.status < 300
+        if stats.ok:
+            stats.ip = body.decode("utf-8", "replace").strip()
+        else:
+            stats.error = "unexpected HTTP status {}".format(stats.status)
+
+    if stats.handshake_time and not stats.error:
+        sessions.handshake(server, stats.resumed, stats.handshake_time)
+        if not stats.resumed and sessions.measure_resumption(server):
+            _measure_resumed(server, address, sessions, timeout)
+    stats.full_handshake_time = sessions.handshake(server, False)
+    stats.resumed_handshake_time = sessions.handshake(server, True)
+    record("https", url, vars(stats))
+    return stats
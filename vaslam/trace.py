@@ -0,0 +1,117 @@
+"""
+vaslam.trace
+============
+
+lightweight tracing of the checks, exported as Chrome trace events
+"""
+import json
+from os import getpid
+from collections import deque
+from time import perf_counter
+from threading import Lock, get_ident
+from typing import Deque, List, Tuple
+
+# spans kept by the tracer, the oldest are dropped in long-running modes
+MAX_SPANS = 100000  # type: int
+
+_Span = Tuple[str, str, float, float, int]
+
+
+class _NoopSpan:
+    """Span used while tracing is disabled, does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_noop_span = _NoopSpan()
+
+
+class Span:
+    def __init__(self, tracer: "Tracer", name: str, target: str):
+        self.tracer = tracer  # type: Tracer
+        self.name = name  # type: str
+        self.target = target  # type: str
+        self.start = 0.0  # type: float
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = perf_counter()
+        self.tracer.add(self.name, self.target, self.start, end, get_ident())
+        return False
+
+
+class Tracer:
+    """Collects spans when enabled. While disabled, spans are a shared
+    no-op object so tracing can stay in place at near zero cost.
+    Spans are kept in a ring buffer of max spans, so watching or serving
+    with tracing enabled keeps the latest spans in bounded memory.
+    """
+
+    def __init__(self, max_spans: int = MAX_SPANS):
+        self.enabled = False  # type: bool
+        self.origin = perf_counter()  # type: float
+        self.spans = deque(maxlen=max_spans)  # type: Deque[_Span]
+        self._lock = Lock()
+
+    def enable(self) -> None:
+        self.origin = perf_counter()
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def clear(self) -> None:
+        with self._lock:
+            self.spans.clear()
+
+    def span(self, name: str, target: str = ""):
+        if not self.enabled:
+            return _noop_span
+        return Span(self, name, target)
+
+    def add(self, name: str, target: str, start: float, end: float, tid: int):
+        with self._lock:
+            self.spans.append((name, target, start, end, tid))
+
+    def trace_events(self) -> List[dict]:
+        """Return the spans as a list of Chrome trace events"""
+        pid = getpid()
+        events = []
+        with self._lock:
+            spans = list(self.spans)
+        for name, target, start, end, tid in spans:
+            event = {
+                "name": name,
+                "cat": "vaslam",
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": pid,
+                "tid": tid,
+            }
+            if target:
+                event["args"] = {"target": target}
+            events.append(event)
+        return events
+
+    def write(self, file_path: str) -> None:
+        """Write spans to the file in Chrome/Perfetto trace event JSON format"""
+        with open(file_path, "wt") as fh:
+            json.dump({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, fh)
+
+
+tracer = Tracer()
+
+
+def span(name: str, target: str = ""):
+    """Return a context manager tracing the enclosed block with the global
+    tracer.
+    """
+    return tracer.span(name, target)
@@ -0,0 +1,214 @@
+"""
+vaslam.traceroute
+=================
+
+trace the network path to a host, probing all the hops at once
+"""
+import errno
+import select
+import socket
+import struct
+from time import time
+from ipaddress import ip_address
+from logging import getLogger
+from typing import Dict, List, Tuple
+from vaslam.net import ConnectionError, SO_TIMESTAMPNS, new_socket
+from vaslam.recorder import record
+from vaslam.scheduler import scheduler
+
+
+logger = getLogger(__name__)
+
+# Linux socket options, not all are exposed by the socket module
+IP_RECVERR = getattr(socket, "IP_RECVERR", 11)  # type: int
+MSG_ERRQUEUE = getattr(socket, "MSG_ERRQUEUE", 0x2000)  # type: int
+SO_EE_ORIGIN_ICMP = 2  # type: int
+ICMP_DEST_UNREACH = 3  # type: int
+ICMP_TIME_EXCEEDED = 11  # type: int
+
+BASE_PORT = 33434  # type: int
+
+_sock_extended_err = struct.Struct("=IBBBBII")
+_sockaddr_in = struct.Struct("=H2s4s")
+_timespec = struct.Struct("=qq")
+
+
+class Hop:
+    """Probe results of a hop on the path. RTTs are in miliseconds"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl  # type: int
+        self.address = ""  # type: str
+        self.sent = 0  # type: int
+        self.rtts = []  # type: List[float]
+        self.reached = False  # type: bool
+
+    @property
+    def recv(self) -> int:
+        return len(self.rtts)
+
+    @property
+    def packet_loss_pct(self) -> int:
+        if not self.sent:
+            return 0
+        return int((self.sent - self.recv) * 100 / self.sent)
+
+    @property
+    def rtt_avg(self) -> float:
+        return sum(self.rtts) / len(self.rtts) if self.rtts else 0
+
+
+class PathAnalysis:
+    """Latency (miliseconds) and packet loss (percent) added by segments of
+    the path. Only what persists up to the last responding hop is counted,
+    since routers often deprioritize generating ICMP replies.
+    """
+
+    def __init__(self):
+        self.isp_edge = ""  # type: str
+        self.isp_latency = 0.0  # type: float
+        self.isp_packet_loss_pct = 0  # type: int
+        self.upstream_latency = 0.0  # type: float
+        self.upstream_packet_loss_pct = 0  # type: int
+
+
+def _parse_error(ancdata: list) -> Tuple[int, int, str, float]:
+    """Return ICMP type, code, offender address and the kernel receive time
+    of an error queue message. Type is -1 if the message has no ICMP error.
+    """
+    icmp_type, icmp_code, offender, received = -1, 0, "", 0.0
+    for level, type_, data in ancdata:
+        if level == socket.SOL_SOCKET and type_ == SO_TIMESTAMPNS:
+            if len(data) >= _timespec.size:
+                sec, nsec = _timespec.unpack_from(data)
+                received = sec + nsec / 1e9
+        elif level == socket.SOL_IP and type_ == IP_RECVERR:
+            if len(data) < _sock_extended_err.size:
+                continue
+            _, origin, ee_type, ee_code, _, _, _ = _sock_extended_err.unpack_from(data)
+            if origin != SO_EE_ORIGIN_ICMP:
+                continue
+            icmp_type, icmp_code = ee_type, ee_code
+            addr_data = data[_sock_extended_err.size :]
+            if len(addr_data) >= _sockaddr_in.size:
+                family, _, addr = _sockaddr_in.unpack_from(addr_data)
+                if family == socket.AF_INET:
+                    offender = socket.inet_ntoa(addr)
+    return icmp_type, icmp_code, offender, received
+
+
+def trace_path(
+    host: str,
+    max_hops: int = 20,
+    probes: int = 3,
+    timeout: float = 2,
+    base_port: int = BASE_PORT,
+) -> List[Hop]:
+    """Trace the path to the IPv4 host, sending UDP probes for all TTLs at once
+    on a single socket, and reading ICMP errors of the routers from the socket
+    error queue (no privileges required, Linux only).
+    Probes are identified by their destination port. Waits for replies until
+    timeout seconds, or all probes up to the host are answered.
+    Return the hops up to the host (or max hops if not reached).
+
+    :raises: ConnectionError on socket errors
+    """
+    hops = [Hop(ttl) for ttl in range(1, max_hops + 1)]
+    sent_at = {}  # type: Dict[int, Tuple[Hop, float]]
+    payload = b"vaslam\x00\x00"
+    try:
+        addr = socket.gethostbyname(host)
+        with scheduler.slot(host, max_hops * probes), new_socket() as sock:
+            sock.setsockopt(socket.SOL_IP, IP_RECVERR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            sock.setblocking(False)
+
+            def _drain() -> None:
+                while True:
+                    try:
+                        _, ancdata, _, dst = sock.recvmsg(512, 512, MSG_ERRQUEUE)
+                    except BlockingIOError:
+                        return
+                    now = time()
+                    icmp_type, _, offender, received = _parse_error(ancdata)
+                    probe = sent_at.pop(dst[1], None) if icmp_type >= 0 else None
+                    if probe is None:
+                        continue
+                    hop, started = probe
+                    hop.address = hop.address or offender
+                    hop.rtts.append(((received or now) - started) * 1000)
+                    hop.reached = icmp_type == ICMP_DEST_UNREACH
+
+            for probe_idx in range(probes):
+                for hop in hops:
+                    port = base_port + (hop.ttl - 1) * probes + probe_idx
+                    sock.setsockopt(socket.SOL_IP, socket.IP_TTL, hop.ttl)
+                    for _ in range(2):
+                        try:
+                            sent_at[port] = (hop, time())
+                            sock.sendto(payload, (addr, port))
+                            hop.sent += 1
+                            break
+                        except OSError as err:
+                            # pending ICMP errors fail sends, read them and retry
+                            if err.errno not in (
+                                errno.ECONNREFUSED,
+                                errno.EHOSTUNREACH,
+                                errno.ENETUNREACH,
+                            ):
+                                raise
+                            _drain()
+
+            deadline = time() + timeout
+            while True:
+                _drain()
+                reached = [h.ttl for h in hops if h.reached]
+                last_ttl = min(reached) if reached else max_hops
+                pending = [p for p, (h, _) in sent_at.items() if h.ttl <= last_ttl]
+                remaining = deadline - time()
+                if not pending or remaining <= 0:
+                    break
+                select.select([sock], [], [], remaining)
+    except OSError as err:
+        raise ConnectionError("failed to trace path to {}: {}".format(host, err))
+
+    reached = [h.ttl for h in hops if h.reached]
+    if reached:
+        hops = hops[: min(reached)]
+    record("trace_path", host, [(h.ttl, h.address, h.sent, h.rtts) for h in hops])
+    return hops
+
+
+def _is_local(address: str) -> bool:
+    try:
+        return ip_address(address).is_private
+    except ValueError:
+        return False
+
+
+def analyze_path(hops: List[Hop]) -> PathAnalysis:
+    """Attribute the latency and packet loss on the path to segments.
+    Leading hops with private addresses are the local network, the first hop
+    after them is the ISP edge, and hops after that are the upstream providers.
+    Latency and loss that first appear at the ISP edge and persist are counted
+    as added by the ISP, the rest that appear up to the last hop as upstream.
+    """
+    analysis = PathAnalysis()
+    responding = [h for h in hops if h.recv > 0]
+    local = 0
+    while local < len(responding) and _is_local(responding[local].address):
+        local += 1
+    if local >= len(responding):
+        return analysis
+    base_rtt = responding[local - 1].rtt_avg if local else 0
+    base_loss = responding[local - 1].packet_loss_pct if local else 0
+    beyond = responding[local:]
+    last = beyond[-1]
+    analysis.isp_edge = beyond[0].address
+    floor_rtt = min(h.rtt_avg for h in beyond)
+    floor_loss = min(h.packet_loss_pct for h in beyond)
+    analysis.isp_latency = max(0.0, floor_rtt - base_rtt)
+    analysis.isp_packet_loss_pct = max(0, floor_loss - base_loss)
+    analysis.upstream_latency = max(0.0, last.rtt_avg - floor_rtt)
+    analysis.upstream_packet_loss_pct = max(0, last.packet_loss_pct - floor_loss)
+    return analysis
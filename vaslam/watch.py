@@ -0,0 +1,202 @@
+"""
+vaslam.watch
+============
+
+continuously diagnose the network
+"""
+from time import time, process_time
+from logging import getLogger
+from threading import Event
+from typing import Callable, Dict, List, Optional, Tuple
+from vaslam.baseline import BaselineStore
+from vaslam.conf import Conf
+from vaslam.diag import diagnose_network, Result
+from vaslam.dns import DnsCache
+from vaslam.dnstransport import TransportPool
+from vaslam.tls import TlsSessions
+from vaslam.system import CounterSampler, Counters, RouteSampler
+
+
+logger = getLogger(__name__)
+
+
+class Cycle:
+    """Information about a single diagnosis cycle of the watch loop"""
+
+    def __init__(self):
+        self.counter = 0  # type: int
+        self.started = 0  # type: float
+        self.duration = 0  # type: float
+        self.cpu_time = 0  # type: float
+        # seconds to the next cycle
+        self.interval = 0  # type: float
+        # issues of the result, compared against the baselines if kept
+        self.issues = []  # type: List[int]
+
+
+class AdaptiveInterval:
+    """Interval between the diagnosis cycles, backing off exponentially up to
+    the max interval while the network is healthy and unchanged, and dropping
+    to the min interval on issues, changes of the routes and addresses, or
+    rising latency. After that it backs off again the same way.
+    Latency is rising when the RTT exceeds its moving average by the trend
+    ratio (and at least min rise miliseconds).
+    """
+
+    def __init__(
+        self,
+        min_interval: float,
+        max_interval: float,
+        factor: float = 2,
+        trend_ratio: float = 0.5,
+        min_rise: float = 10,
+        smoothing: float = 0.3,
+    ):
+        self.min_interval = min_interval  # type: float
+        self.max_interval = max(min_interval, max_interval)  # type: float
+        self.factor = factor  # type: float
+        self.trend_ratio = trend_ratio  # type: float
+        self.min_rise = min_rise  # type: float
+        self.smoothing = smoothing  # type: float
+        self.interval = min_interval  # type: float
+        self._state = None  # type: Optional[Tuple]
+        self._rtt_avg = {}  # type: Dict[str, float]
+
+    def next(self, result: Result, issues: Optional[List[int]] = None) -> float:
+        """Return the seconds to the next cycle, after the Result and its
+        issues (the issues of the Result by default)
+        """
+        state = (
+            result.gateway,
+            result.internet_host,
+            result.ipv4,
+            result.ipv6,
+            tuple((u.route.interface, u.route.gateway) for u in result.uplinks),
+        )
+        changed = self._state is not None and state != self._state
+        self._state = state
+        rising = self._rising(result)
+        if issues is None:
+            issues = result.get_issues()
+        if issues or changed or rising:
+            logger.debug(
+                "sampling fast, issues: {} changed: {} rising latency: {}".format(
+                    issues, changed, rising
+                )
+            )
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.factor)
+        return self.interval
+
+    def reset(self) -> None:
+        """Drop to the min interval, e.g. when the routes changed"""
+        self.interval = self.min_interval
+
+    def _rising(self, result: Result) -> bool:
+        rising = False
+        for path, stats in (
+            ("gateway", result.gateway_ping_stats),
+            ("internet", result.internet_ping_stats),
+        ):
+            if stats.packets_recv < 1:
+                continue
+            avg = self._rtt_avg.get(path)
+            if avg is None:
+                self._rtt_avg[path] = stats.rtt_avg
+                continue
+            if stats.rtt_avg - avg > max(self.min_rise, avg * self.trend_ratio):
+                rising = True
+            self._rtt_avg[path] = avg + self.smoothing * (stats.rtt_avg - avg)
+        return rising
+
+
+def _new_sampler() -> Optional[CounterSampler]:
+    try:
+        return CounterSampler()
+    except OSError as err:
+        logger.warning("can not sample network counters: {}".format(err))
+        return None
+
+
+def watch(
+    conf: Conf,
+    interval: float,
+    on_result: Callable[[Result, Cycle], None],
+    stop: Event,
+    on_counters: Optional[Callable[[Counters], None]] = None,
+    counters_interval: float = 1.0,
+    adaptive: Optional[AdaptiveInterval] = None,
+    baselines: Optional[BaselineStore] = None,
+) -> None:
+    """Diagnose the network every interval seconds until the stop event is set.
+    Calls on_result with the Result and the Cycle info after each diagnosis.
+    Duration and CPU time of the cycle are the overhead of probing.
+    Resolved names are cached, connections of DNS transports are kept open
+    and TLS sessions are resumed, between the cycles.
+    Kernel network counters are sampled every counters_interval seconds,
+    calling on_counters with the changes. The result of each cycle has the
+    changes of the counters since the previous cycle.
+    With an adaptive interval, the interval of each cycle is set by it instead,
+    and the default routes are sampled with the counters while waiting, so
+    changes of the routes are diagnosed right away, at the min interval.
+    With baselines, the issues of each cycle are compared against them and
+    then the baselines are updated with the result.
+    """
+    dns_cache = DnsCache()
+    transports = TransportPool()
+    tls_sessions = TlsSessions()
+    sampler = _new_sampler()
+    cycle_counters = last_counters = sampler.read() if sampler else None
+    route_sampler = RouteSampler() if adaptive is not None else None
+    counter = 0
+    try:
+        while not stop.is_set():
+            counter += 1
+            cycle = Cycle()
+            cycle.counter = counter
+            cycle.started = time()
+            cpu_start = process_time()
+            routes = route_sampler.read() if route_sampler else ()
+            result = diagnose_network(conf, None, dns_cache, transports, tls_sessions)
+            cycle.duration = time() - cycle.started
+            cycle.cpu_time = process_time() - cpu_start
+            if sampler and cycle_counters is not None:
+                counters = sampler.read()
+                result.counters = counters.delta(cycle_counters)
+                cycle_counters = counters
+            logger.debug(
+                "watch cycle {} took {:.3f} seconds".format(counter, cycle.duration)
+            )
+            cycle.issues = result.get_issues(baselines)
+            if baselines is not None:
+                result.update_baselines(baselines)
+            cycle.interval = (
+                adaptive.next(result, cycle.issues) if adaptive else interval
+            )
+            on_result(result, cycle)
+            next_cycle = cycle.started + cycle.interval
+            while not stop.is_set():
+                remaining = next_cycle - time()
+                if remaining <= 0:
+                    break
+                if not sampler and not route_sampler:
+                    stop.wait(remaining)
+                    continue
+                stop.wait(min(remaining, counters_interval))
+                if sampler:
+                    counters = sampler.read()
+                    if on_counters is not None and last_counters is not None:
+                        on_counters(counters.delta(last_counters))
+                    last_counters = counters
+                if adaptive is not None and route_sampler:
+                    if route_sampler.read() != routes:
+                        logger.info("default routes changed, diagnosing now")
+                        adaptive.reset()
+                        break
+    finally:
+        transports.close()
+        if sampler:
+            sampler.close()
+        if route_sampler:
+            route_sampler.close()